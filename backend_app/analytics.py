@@ -0,0 +1,235 @@
+import logging
+import threading
+import numpy as np
+from datetime import date, datetime, timedelta
+from .config import settings
+from .models.device import SensorRollupHour
+from .downsampling import load_series, to_epoch
+from .rollups import load_rollup_series
+from .recent_history import recent_history
+from .compression import history_compressor
+
+logger = logging.getLogger(__name__)
+
+# Các đại lượng cộng dồn theo ngày (giây hoặc số lần). None = không tính được từ nguồn dữ liệu của ngày đó
+USAGE_FIELDS = (
+    "samples", "covered_seconds", "on_seconds", "lamp_seconds", "auto_seconds", "switch_on", "switch_off",
+)
+# Ngày cũ hơn RETENTION_RAW_DAYS chỉ còn rollup theo giờ: không có chế độ auto và số lần bật/tắt
+_ROLLUP_MISSING = ("covered_seconds", "auto_seconds", "switch_on", "switch_off")
+
+
+def _integral(ts: np.ndarray, duration: np.ndarray, rate: np.ndarray, cum: np.ndarray, x: np.ndarray):
+    """Tích phân của hàm bậc thang (rate[i] trên [ts[i], ts[i] + duration[i])) từ -inf tới từng mốc x"""
+    i = np.searchsorted(ts, x, side="right") - 1
+    ic = np.maximum(i, 0)
+    value = cum[ic] + rate[ic] * np.clip(x - ts[ic], 0.0, duration[ic])
+    return np.where(i >= 0, value, 0.0)
+
+
+def usage_by_day(series: dict, first_day: date, days: int, max_gap: float, until: float) -> dict:
+    """
+    Tính các đại lượng USAGE_FIELDS cho `days` ngày liên tiếp từ first_day, hoàn toàn bằng numpy.
+    Mỗi mẫu giữ nguyên giá trị tới mẫu kế tiếp, tối đa max_gap giây (giống on_seconds của rollup);
+    mẫu cuối cùng kéo dài tới `until` (epoch). Khoảng vắt qua nửa đêm được chia đúng cho 2 ngày.
+    """
+    edges = to_epoch(datetime.combine(first_day, datetime.min.time())) + 86400.0 * np.arange(days + 1)
+    ts = series["ts"]
+    if ts.size == 0:
+        return {name: np.zeros(days) for name in USAGE_FIELDS}
+
+    ends = np.minimum(np.append(ts[1:], max(until, ts[-1])), ts + max_gap)
+    duration = ends - ts
+    is_on = series["is_on"]
+    rates = {
+        "covered_seconds": np.ones(ts.size),
+        "on_seconds": is_on,
+        "lamp_seconds": is_on * series["brightness"] / 100.0,   # Độ sáng 100% trong 1 giờ = 1 giờ đèn
+        "auto_seconds": series["is_auto_mode"],
+    }
+    result = {"samples": np.diff(np.searchsorted(ts, edges, side="left")).astype(np.float64)}
+    for name, rate in rates.items():
+        cum = np.concatenate(([0.0], np.cumsum(rate * duration)))
+        result[name] = np.diff(_integral(ts, duration, rate, cum, edges))
+
+    changed = np.flatnonzero(np.diff(is_on) != 0) + 1
+    for name, value in (("switch_on", 1.0), ("switch_off", 0.0)):
+        switch_ts = ts[changed[is_on[changed] == value]]
+        result[name] = np.diff(np.searchsorted(switch_ts, edges, side="left")).astype(np.float64)
+    return result
+
+
+def usage_by_day_from_rollups(series: dict, first_day: date, days: int) -> dict:
+    """Ước lượng từ rollup theo giờ: giờ đèn = on_seconds x độ sáng trung bình của giờ đó"""
+    edges = to_epoch(datetime.combine(first_day, datetime.min.time())) + 86400.0 * np.arange(days + 1)
+    day = np.searchsorted(edges, series["ts"], side="right") - 1
+    inside = (day >= 0) & (day < days)
+    day = day[inside]
+
+    def per_day(values):
+        return np.bincount(day, weights=values[inside], minlength=days)[:days]
+
+    counts = series["count"]
+    avg_brightness = np.divide(series["brightness_sum"], counts, out=np.zeros_like(counts), where=counts > 0)
+    result = {
+        "samples": per_day(counts),
+        "on_seconds": per_day(series["on_seconds"]),
+        "lamp_seconds": per_day(series["on_seconds"] * avg_brightness / 100.0),
+    }
+    result.update({name: None for name in _ROLLUP_MISSING})
+    return result
+
+
+class UsageAnalytics:
+    """
+    Thống kê sử dụng theo ngày/tuần: giờ bật đèn, giờ đèn quy đổi theo độ sáng, điện năng và tiền điện
+    (LAMP_POWER_WATTS, ENERGY_PRICE_PER_KWH), tỉ lệ chế độ auto, số lần bật/tắt.
+    Ngày đã kết thúc được cache trong bộ nhớ theo (device_id, ngày); báo cáo dài chỉ phải tính ngày hôm nay.
+    Cache bị xóa khi có lô mẫu gửi bù cho ngày cũ (ingest) hoặc khi xóa lịch sử (retention job).
+    """
+
+    def __init__(self, max_gap_seconds: float):
+        self._max_gap = max_gap_seconds
+        self._days = {}             # (device_id, date) -> dict USAGE_FIELDS + "source"
+        self._lock = threading.Lock()
+
+        # Thống kê
+        self.hits = 0
+        self.misses = 0
+
+    def max_gap(self, device_id: str) -> float:
+        """Lịch sử đã nén có thể cách nhau tới max_interval giây giữa 2 điểm lưu mà không phải mất dữ liệu"""
+        config = history_compressor.config_for(device_id)
+        if config["method"] == "off":
+            return self._max_gap
+        return self._max_gap + config["max_interval"]
+
+    # ============ Tính theo ngày (có cache) ============
+    def daily(self, db, device_id: str, first_day: date, last_day: date) -> list:
+        """[(ngày, dict USAGE_FIELDS + source)] cho mọi ngày trong [first_day, last_day]"""
+        now = datetime.now()
+        gap = self.max_gap(device_id)
+        days = [first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+        with self._lock:
+            cached = {day: self._days.get((device_id, day)) for day in days}
+        missing = [day for day in days if cached[day] is None]
+        self.hits += len(days) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            raw_since = None
+            if settings.RETENTION_RAW_DAYS > 0:
+                raw_since = now.date() - timedelta(days=settings.RETENTION_RAW_DAYS - 1)
+            from_rollups = [day for day in missing if raw_since is not None and day < raw_since]
+            from_raw = [day for day in missing if raw_since is None or day >= raw_since]
+            computed = {}
+            if from_rollups:
+                computed.update(self._compute(db, device_id, from_rollups[0], from_rollups[-1], now, gap, True))
+            if from_raw:
+                computed.update(self._compute(db, device_id, from_raw[0], from_raw[-1], now, gap, False))
+
+            # Ngày đã kết thúc (mẫu cuối ngày không còn kéo dài sang được nữa) mới được cache
+            closed_before = (now - timedelta(seconds=gap)).date()
+            with self._lock:
+                for day, values in computed.items():
+                    if day < closed_before:
+                        self._days[(device_id, day)] = values
+            cached.update(computed)
+        return [(day, cached[day]) for day in days]
+
+    def _compute(self, db, device_id: str, first_day: date, last_day: date, now: datetime,
+                 gap: float, rollups: bool) -> dict:
+        days = (last_day - first_day).days + 1
+        start = datetime.combine(first_day, datetime.min.time())
+        end = start + timedelta(days=days)
+        if rollups:
+            series = load_rollup_series(db, SensorRollupHour, device_id, start, end)
+            result = usage_by_day_from_rollups(series, first_day, days)
+        else:
+            # Lùi một khoảng gap để có mẫu trước nửa đêm, vượt quá end để biết mẫu cuối ngày kéo dài tới đâu
+            lo, hi = start - timedelta(seconds=gap), min(end + timedelta(seconds=gap), now)
+            series = recent_history.series(device_id, lo, hi)
+            if series is None:
+                series = load_series(db, device_id, lo, hi)
+            result = usage_by_day(series, first_day, days, gap, to_epoch(hi))
+        source = "rollup" if rollups else "raw"
+        return {
+            first_day + timedelta(days=i): dict(
+                {name: None if values is None else float(values[i]) for name, values in result.items()},
+                source=source,
+            )
+            for i in range(days)
+        }
+
+    # ============ Cache ============
+    def invalidate(self, device_id: str = None, since: datetime = None):
+        """Bỏ các ngày đã cache (của một/mọi thiết bị) bị ảnh hưởng bởi dữ liệu từ `since` (None = tất cả)"""
+        first = None
+        if since is not None:
+            gap = timedelta(seconds=self.max_gap(device_id) if device_id is not None else self._max_gap)
+            # Mẫu ngay sau nửa đêm làm thay đổi đoạn cuối của ngày trước đó
+            first = (since - gap).date()
+            if first >= (datetime.now() - gap).date():
+                return  # Chỉ ảnh hưởng các ngày chưa kết thúc (chưa được cache)
+        with self._lock:
+            stale = [key for key in self._days
+                     if (device_id is None or key[0] == device_id) and (first is None or key[1] >= first)]
+            for key in stale:
+                del self._days[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            days = len(self._days)
+        return {"cached_days": days, "hits": self.hits, "misses": self.misses}
+
+
+# ============ Báo cáo ============
+
+def summarize(values: list) -> dict:
+    """Gộp các ngày (dict USAGE_FIELDS) thành một kỳ báo cáo, quy đổi ra giờ / kWh / tiền điện"""
+    totals = {}
+    for name in USAGE_FIELDS:
+        parts = [v[name] for v in values]
+        totals[name] = None if any(p is None for p in parts) else sum(parts)
+    lamp_hours = totals["lamp_seconds"] / 3600
+    energy_kwh = lamp_hours * settings.LAMP_POWER_WATTS / 1000
+    covered = totals["covered_seconds"]
+    return {
+        "samples": int(totals["samples"]),
+        "on_hours": round(totals["on_seconds"] / 3600, 3),
+        "lamp_hours": round(lamp_hours, 3),
+        "energy_kwh": round(energy_kwh, 4),
+        "cost": round(energy_kwh * settings.ENERGY_PRICE_PER_KWH, 2),
+        "auto_share": round(totals["auto_seconds"] / covered, 4) if covered else None,
+        "switch_on": None if totals["switch_on"] is None else int(totals["switch_on"]),
+        "switch_off": None if totals["switch_off"] is None else int(totals["switch_off"]),
+        "source": "+".join(sorted({v["source"] for v in values})),
+    }
+
+
+def usage_report(db, device_ids: list, first_day: date, last_day: date, period: str = "day") -> dict:
+    """Báo cáo theo ngày hoặc tuần (thứ Hai đầu tuần) cho danh sách thiết bị, kèm tổng của cả kỳ"""
+    devices = {}
+    everything = []
+    for device_id in device_ids:
+        daily = usage_analytics.daily(db, device_id, first_day, last_day)
+        everything.extend(values for _, values in daily)
+        periods = {}
+        for day, values in daily:
+            key = day - timedelta(days=day.weekday()) if period == "week" else day
+            periods.setdefault(key, []).append(values)
+        devices[device_id] = [
+            dict(period_start=key.isoformat(), **summarize(values)) for key, values in periods.items()
+        ]
+    return {
+        "period": period,
+        "start": first_day.isoformat(),
+        "end": last_day.isoformat(),
+        "lamp_power_w": settings.LAMP_POWER_WATTS,
+        "price_per_kwh": settings.ENERGY_PRICE_PER_KWH,
+        "devices": devices,
+        "total": summarize(everything) if everything else None,
+    }
+
+
+usage_analytics = UsageAnalytics(max_gap_seconds=settings.ROLLUP_MAX_GAP_SECONDS)
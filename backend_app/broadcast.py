@@ -0,0 +1,106 @@
+import asyncio
+import json
+from datetime import datetime
+from .config import settings
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class Subscriber:
+    """Một client đang nghe luồng trạng thái, có bộ đệm riêng giới hạn kích thước"""
+
+    def __init__(self, device_id, buffer_size: int):
+        self.device_id = device_id      # None = nghe tất cả thiết bị
+        self.queue = asyncio.Queue(maxsize=buffer_size)
+        self.dropped = False
+
+
+class BroadcastHub:
+    """
+    Phát thay đổi trạng thái thiết bị tới các client WebSocket.
+    - publish() gọi được từ mọi thread (paho hoặc event loop), bản tin chỉ serialize MỘT lần.
+    - Mỗi client có hàng đợi riêng; client chậm làm đầy hàng đợi sẽ bị ngắt kết nối
+      (client sẽ tự kết nối lại và nhận snapshot mới), không làm chậm các client khác.
+    - Không có client nào thì publish() trả về ngay, chi phí lúc rảnh gần như bằng 0.
+    """
+
+    def __init__(self, buffer_size: int):
+        self._buffer_size = buffer_size
+        self._loop = None
+        self._by_device = {}        # device_id -> set[Subscriber]
+        self._all = set()           # Subscriber nghe toàn bộ hệ thống
+        self.published = 0
+        self.dropped_clients = 0
+
+    def bind_loop(self, loop):
+        self._loop = loop
+
+    # ============ Quản lý subscriber (chạy trên event loop) ============
+    def subscribe(self, device_id=None) -> Subscriber:
+        sub = Subscriber(device_id, self._buffer_size)
+        if device_id is None:
+            self._all.add(sub)
+        else:
+            self._by_device.setdefault(device_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        if sub.device_id is None:
+            self._all.discard(sub)
+            return
+        subs = self._by_device.get(sub.device_id)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del self._by_device[sub.device_id]
+
+    @staticmethod
+    def encode(state: dict) -> str:
+        return json.dumps(state, default=_json_default)
+
+    # ============ Phát bản tin ============
+    def publish(self, state: dict):
+        """Phát trạng thái thiết bị (an toàn khi gọi từ thread khác event loop)"""
+        device_id = state["device_id"]
+        if self._loop is None or not (self._all or device_id in self._by_device):
+            return
+        message = self.encode(state)
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._fanout(device_id, message)
+        else:
+            self._loop.call_soon_threadsafe(self._fanout, device_id, message)
+
+    def _fanout(self, device_id: str, message: str):
+        self.published += 1
+        for sub in list(self._by_device.get(device_id, ())) + list(self._all):
+            try:
+                sub.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self._drop(sub)
+
+    def _drop(self, sub: Subscriber):
+        """Client quá chậm: bỏ bộ đệm và gửi tín hiệu None để handler đóng kết nối"""
+        self.unsubscribe(sub)
+        sub.dropped = True
+        self.dropped_clients += 1
+        while not sub.queue.empty():
+            sub.queue.get_nowait()
+        sub.queue.put_nowait(None)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self._all) + sum(len(s) for s in self._by_device.values()),
+            "published": self.published,
+            "dropped_clients": self.dropped_clients,
+        }
+
+
+broadcast_hub = BroadcastHub(buffer_size=settings.STREAM_CLIENT_BUFFER)
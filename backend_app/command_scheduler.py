@@ -0,0 +1,149 @@
+import logging
+import threading
+import time
+from .config import settings
+from .database import WriteSessionLocal
+from .state_cache import state_cache, upsert_device_states
+from .metrics import DB_COMMIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingCommands:
+    __slots__ = ("commands", "state", "due")
+
+    def __init__(self, due: float):
+        self.commands = {}      # loại lệnh (payload["type"]) -> payload mới nhất, giữ thứ tự gửi
+        self.state = None       # Trạng thái mới nhất cần lưu xuống device_state
+        self.due = due          # Thời điểm (monotonic) được phép gửi
+
+
+class CommandScheduler:
+    """
+    Hàng đợi lệnh gửi xuống thiết bị (API điều khiển và rule engine):
+    - Lệnh được giữ lại coalesce_window giây; lệnh cùng loại tới sau thay thế lệnh cũ chưa gửi
+      (kéo thanh trượt độ sáng chỉ gửi giá trị cuối cùng), lệnh mới nhất luôn được gửi.
+    - Mỗi thiết bị gửi tối đa max_rate lần/giây, lệnh tới sớm hơn được gộp vào lần gửi kế tiếp.
+    - Trạng thái device_state của các thiết bị tới hạn được ghi trong MỘT transaction.
+    """
+
+    def __init__(self, coalesce_window: float, max_rate: float):
+        self._window = coalesce_window
+        self._min_interval = 1.0 / max_rate if max_rate > 0 else 0.0
+        self._pending = {}          # device_id -> _PendingCommands
+        self._last_sent = {}        # device_id -> thời điểm gửi gần nhất (monotonic)
+        self._cond = threading.Condition()
+        self._publish = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        # Thống kê
+        self.submitted = 0
+        self.coalesced = 0
+        self.sent = 0
+        self.state_writes = 0
+        self.failed_writes = 0
+
+    def bind_publisher(self, publish):
+        """publish(payload, device_id) - gửi lệnh thật sự ra MQTT"""
+        self._publish = publish
+
+    # ============ API cho producer (event loop hoặc thread của paho) ============
+    def submit(self, device_id: str, payload: dict, state: dict = None):
+        """Xếp lệnh vào hàng đợi của thiết bị, kèm trạng thái cần lưu xuống DB (nếu có)"""
+        with self._cond:
+            self.submitted += 1
+            pending = self._pending.get(device_id)
+            if pending is None:
+                due = max(time.monotonic() + self._window,
+                          self._last_sent.get(device_id, 0.0) + self._min_interval)
+                pending = self._pending[device_id] = _PendingCommands(due)
+                self._cond.notify()
+            kind = payload.get("type")
+            if kind in pending.commands:
+                # Lệnh cùng loại chưa kịp gửi đã lỗi thời: bỏ đi, lệnh mới xếp cuối
+                del pending.commands[kind]
+                self.coalesced += 1
+            pending.commands[kind] = payload
+            if state is not None:
+                pending.state = state
+
+    # ============ Vòng đời ============
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="command-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Dừng scheduler, gửi ngay các lệnh còn chờ (gọi trước khi ngắt MQTT)"""
+        self._stop_event.set()
+        with self._cond:
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self) -> dict:
+        with self._cond:
+            pending = sum(len(p.commands) for p in self._pending.values())
+        return {
+            "pending": pending,
+            "submitted": self.submitted,
+            "coalesced": self.coalesced,
+            "sent": self.sent,
+            "state_writes": self.state_writes,
+            "failed_writes": self.failed_writes,
+        }
+
+    # ============ Thread gửi lệnh ============
+    def _run(self):
+        while True:
+            ready = self._collect()
+            if ready:
+                self._dispatch(ready)
+            elif self._stop_event.is_set():
+                return
+
+    def _collect(self) -> list:
+        """Chờ tới khi có thiết bị tới hạn gửi, trả về [(device_id, _PendingCommands)]"""
+        with self._cond:
+            while True:
+                stopping = self._stop_event.is_set()
+                now = time.monotonic()
+                ready = [(device_id, p) for device_id, p in self._pending.items() if stopping or p.due <= now]
+                if ready or stopping:
+                    for device_id, _ in ready:
+                        del self._pending[device_id]
+                        self._last_sent[device_id] = now
+                    return ready
+                timeout = min((p.due for p in self._pending.values()), default=now + 0.5) - now
+                self._cond.wait(timeout)
+
+    def _dispatch(self, ready: list):
+        for device_id, pending in ready:
+            for payload in pending.commands.values():
+                try:
+                    self._publish(payload, device_id)
+                    self.sent += 1
+                except Exception as e:
+                    logger.error("Publish failed: %s", e, extra={"device": device_id})
+
+        states = [p.state for _, p in ready if p.state is not None]
+        if not states:
+            return
+        try:
+            with DB_COMMIT_SECONDS.time(("command",)), WriteSessionLocal() as db, state_cache.write_lock:
+                upsert_device_states(db, states)
+                db.commit()
+            self.state_writes += 1
+        except Exception as e:
+            logger.error("Database error, device states not saved: %s", e, extra={"count": len(states)})
+            self.failed_writes += 1
+
+
+command_scheduler = CommandScheduler(
+    coalesce_window=settings.COMMAND_COALESCE_WINDOW,
+    max_rate=settings.COMMAND_MAX_RATE,
+)
@@ -0,0 +1,203 @@
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from .config import settings
+
+# Biên trên (ms) của các bucket histogram độ trễ, bucket cuối là +inf
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def expected_state(payload: dict) -> dict:
+    """Các trường trạng thái thiết bị phải báo về sau khi thực hiện lệnh"""
+    if payload.get("type") == "MANUAL":
+        if payload.get("state") == "OFF":
+            return {"is_on": False}
+        return {"is_on": True, "brightness": payload.get("brightness")}
+    if payload.get("type") == "AUTO":
+        return {"is_auto_mode": bool(payload.get("enable"))}
+    return {}
+
+
+class LatencyHistogram:
+    """Histogram độ trễ theo bucket cố định, ước lượng phân vị bằng nội suy trong bucket"""
+
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value_ms: float):
+        self.counts[bisect_left(self.bounds, value_ms)] += 1
+        self.count += 1
+        self.sum += value_ms
+        self.max = max(self.max, value_ms)
+
+    def percentile(self, p: float):
+        if not self.count:
+            return None
+        rank = self.count * p / 100
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.max
+                return round(min(lower + (upper - lower) * (rank - seen) / n, self.max), 2)
+            seen += n
+        return round(self.max, 2)
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.sum / self.count, 2) if self.count else None,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "max_ms": round(self.max, 2),
+        }
+
+
+class _PendingCommand:
+    __slots__ = ("cid", "kind", "expected", "sent_at")
+
+    def __init__(self, cid: str, kind: str, expected: dict, sent_at: float):
+        self.cid = cid
+        self.kind = kind
+        self.expected = expected
+        self.sent_at = sent_at
+
+
+class _DeviceAcks:
+    def __init__(self):
+        self.pending = {}           # cid -> _PendingCommand, theo thứ tự gửi
+        self.latency = LatencyHistogram()
+        # Độ trễ của các lần xác nhận chỉ dựa trên trạng thái (không chính xác bằng cid), để riêng
+        self.state_latency = LatencyHistogram()
+        self.echoes_cid = False     # Firmware đã từng gửi lại cid -> chỉ tin độ trễ đo bằng cid
+        self.sent = 0
+        self.acked_by_cid = 0
+        self.acked_by_state = 0
+        self.timeouts = 0
+        self.superseded = 0
+
+
+class CommandTracker:
+    """
+    Theo dõi lệnh gửi xuống thiết bị tới khi thiết bị xác nhận (round-trip):
+    - Mỗi lệnh được gắn correlation ID ("cid") trước khi publish và nằm trong bảng chờ.
+    - Bản tin status có "cid" trùng khớp là xác nhận trực tiếp; firmware chưa gửi lại cid thì
+      lệnh được xác nhận khi trạng thái báo về khớp với trạng thái lệnh yêu cầu, nhưng chỉ với bản tin
+      tới sau ít nhất min_rtt giây (bản tin đang trên đường về lúc gửi lệnh không phải phản hồi).
+      Độ trễ của xác nhận theo trạng thái chỉ vào histogram chính khi thiết bị không gửi lại cid.
+    - Lệnh quá timeout giây chưa được xác nhận bị tính là timeout; lệnh cùng loại gửi sau
+      thay thế lệnh cũ đang chờ (superseded).
+    """
+
+    def __init__(self, timeout: float, max_pending: int, min_rtt: float):
+        self._timeout = timeout
+        self._max_pending = max_pending
+        self._min_rtt = min_rtt
+        self._devices = {}          # device_id -> _DeviceAcks
+        self._lock = threading.Lock()
+
+    def track(self, payload: dict, device_id: str) -> dict:
+        """Gắn cid vào lệnh và đưa vào bảng chờ. Trả về payload mới (không sửa payload gốc)."""
+        cid = uuid.uuid4().hex[:12]
+        pending = _PendingCommand(cid, payload.get("type"), expected_state(payload), time.monotonic())
+        with self._lock:
+            acks = self._devices.get(device_id)
+            if acks is None:
+                acks = self._devices[device_id] = _DeviceAcks()
+            self._expire(acks, pending.sent_at)
+            for old in [p for p in acks.pending.values() if p.kind == pending.kind]:
+                del acks.pending[old.cid]
+                acks.superseded += 1
+            if len(acks.pending) >= self._max_pending:
+                del acks.pending[next(iter(acks.pending))]
+                acks.timeouts += 1
+            acks.pending[cid] = pending
+            acks.sent += 1
+        return dict(payload, cid=cid)
+
+    def acknowledge(self, device_id: str, data: dict):
+        """Đối chiếu bản tin status với các lệnh đang chờ của thiết bị (gọi trong on_message)"""
+        now = time.monotonic()
+        with self._lock:
+            acks = self._devices.get(device_id)
+            if acks is None:
+                return
+            cid = data.get("cid")
+            if cid is not None:
+                acks.echoes_cid = True
+            self._expire(acks, now)
+            matched = None
+            if cid is not None:
+                # Bản tin mang cid là phản hồi của đúng lệnh đó (có thể đã hết hạn / bị thay thế)
+                matched = acks.pending.get(cid)
+                if matched is not None:
+                    acks.acked_by_cid += 1
+                histogram = acks.latency
+            else:
+                for pending in acks.pending.values():
+                    if now - pending.sent_at < self._min_rtt:
+                        break   # Bảng chờ sắp theo thời gian gửi: các lệnh sau còn mới hơn
+                    if pending.expected and all(data.get(k) == v for k, v in pending.expected.items()):
+                        matched = pending
+                        acks.acked_by_state += 1
+                        break
+                histogram = acks.state_latency if acks.echoes_cid else acks.latency
+            if matched is not None:
+                del acks.pending[matched.cid]
+                histogram.observe((now - matched.sent_at) * 1000)
+
+    def report(self, device_id: str = None) -> dict:
+        """Thống kê độ trễ round-trip theo thiết bị (device_id=None: tất cả thiết bị)"""
+        now = time.monotonic()
+        with self._lock:
+            if device_id is not None:
+                items = [(device_id, self._devices[device_id])] if device_id in self._devices else []
+            else:
+                items = list(self._devices.items())
+            result = {}
+            for dev, acks in items:
+                self._expire(acks, now)
+                result[dev] = {
+                    "sent": acks.sent,
+                    "acked_by_cid": acks.acked_by_cid,
+                    "acked_by_state": acks.acked_by_state,
+                    "timeouts": acks.timeouts,
+                    "superseded": acks.superseded,
+                    "pending": len(acks.pending),
+                    "latency": acks.latency.summary(),
+                    "state_latency": acks.state_latency.summary(),
+                }
+            return result
+
+    def stats(self) -> dict:
+        devices = self.report()
+        return {
+            "timeout_s": self._timeout,
+            "devices": len(devices),
+            "sent": sum(d["sent"] for d in devices.values()),
+            "acked": sum(d["acked_by_cid"] + d["acked_by_state"] for d in devices.values()),
+            "timeouts": sum(d["timeouts"] for d in devices.values()),
+            "pending": sum(d["pending"] for d in devices.values()),
+        }
+
+    def _expire(self, acks: _DeviceAcks, now: float):
+        """Bỏ các lệnh quá hạn (gọi khi đã giữ lock; bảng chờ sắp theo thời gian gửi)"""
+        while acks.pending:
+            oldest = next(iter(acks.pending.values()))
+            if now - oldest.sent_at < self._timeout:
+                break
+            del acks.pending[oldest.cid]
+            acks.timeouts += 1
+
+
+command_tracker = CommandTracker(
+    timeout=settings.COMMAND_ACK_TIMEOUT,
+    max_pending=settings.COMMAND_ACK_MAX_PENDING,
+    min_rtt=settings.COMMAND_ACK_MIN_RTT,
+)
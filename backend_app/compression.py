@@ -0,0 +1,193 @@
+import json
+import logging
+import threading
+from datetime import datetime
+from sqlalchemy import select
+from .config import settings
+from .database import SessionLocal
+from .models.device import DeviceState
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_METHODS = ("off", "deadband", "swinging_door")
+# Đổi một trong các trường này thì luôn lưu (điểm cuối trạng thái cũ + điểm đầu trạng thái mới)
+DISCRETE_FIELDS = ("is_on", "brightness", "is_auto_mode")
+
+
+def default_config() -> dict:
+    return {
+        "method": settings.HISTORY_COMPRESSION,
+        "deadband": settings.COMPRESSION_DEADBAND,
+        "deviation": settings.COMPRESSION_DEVIATION,
+        "max_interval": settings.COMPRESSION_MAX_INTERVAL,
+    }
+
+
+class _DeviceCompression:
+    __slots__ = ("config", "archived", "held", "upper", "lower", "received", "stored")
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.archived = None        # (record_time, state) đã lưu gần nhất
+        self.held = None            # Mẫu mới nhất chưa lưu (được lưu khi mẫu sau nằm ngoài cửa)
+        self.upper = float("inf")   # Độ dốc cho phép (trên/dưới) từ điểm đã lưu: giao "cửa" của các mẫu đang giữ
+        self.lower = float("-inf")
+        self.received = 0
+        self.stored = 0
+
+
+class HistoryCompressor:
+    """
+    Nén lịch sử trước khi ghi sensor_history (bật theo thiết bị, mặc định theo HISTORY_COMPRESSION):
+    - deadband: chỉ lưu khi sensor_value lệch quá `deadband` so với điểm đã lưu (dựng lại dạng bậc thang).
+    - swinging_door: mẫu mới nằm ngoài "cửa xoay" (đường thẳng từ điểm đã lưu tới nó lệch quá `deviation`
+      với một mẫu ở giữa) thì lưu mẫu giữ trước đó (dựng lại bằng nội suy tuyến tính).
+    - Đổi is_on/brightness/is_auto_mode thì luôn lưu; quá `max_interval` giây chưa lưu thì lưu một điểm (heartbeat).
+    Mẫu tới muộn (cũ hơn điểm đã lưu) được lưu nguyên. Rollup vẫn tính trên toàn bộ mẫu nhận được.
+    """
+
+    def __init__(self):
+        self._devices = {}          # device_id -> _DeviceCompression
+        self._overrides = {}        # device_id -> cấu hình riêng (cột device_state.compression)
+        self._lock = threading.Lock()
+
+    # ============ Cấu hình ============
+    def config_for(self, device_id: str) -> dict:
+        return dict(default_config(), **self._overrides.get(device_id, {}))
+
+    def set_override(self, device_id: str, override: dict):
+        """Đổi cấu hình riêng của thiết bị (đã lưu xuống DB); trạng thái nén bắt đầu lại"""
+        with self._lock:
+            if override:
+                self._overrides[device_id] = dict(override)
+            else:
+                self._overrides.pop(device_id, None)
+            self._devices.pop(device_id, None)
+
+    def reload(self, db=None):
+        """Nạp cấu hình riêng từ device_state (lúc khởi động và khi DB bị sửa từ tiến trình khác)"""
+        own_session = db is None
+        db = db or SessionLocal()
+        try:
+            rows = db.execute(
+                select(DeviceState.device_id, DeviceState.compression).where(DeviceState.compression.is_not(None))
+            ).all()
+        finally:
+            if own_session:
+                db.close()
+        overrides = {device_id: json.loads(raw) for device_id, raw in rows}
+        with self._lock:
+            for device_id in set(overrides) | set(self._overrides):
+                if overrides.get(device_id) != self._overrides.get(device_id):
+                    self._devices.pop(device_id, None)
+            self._overrides = overrides
+
+    # ============ Nén (thread của paho) ============
+    def offer(self, device_id: str, samples: list):
+        """
+        samples = [(record_time, state)] theo thứ tự thời gian. Trả về các mẫu cần lưu,
+        hoặc None nếu thiết bị không bật nén (lưu tất cả).
+        """
+        if settings.HISTORY_COMPRESSION == "off" and device_id not in self._overrides:
+            return None
+        with self._lock:
+            device = self._devices.get(device_id)
+            if device is None:
+                device = self._devices[device_id] = _DeviceCompression(self.config_for(device_id))
+            if device.config["method"] == "off":
+                return None
+            stored = []
+            for record_time, state in samples:
+                stored.extend(self._offer(device, record_time, state))
+            device.received += len(samples)
+            device.stored += len(stored)
+            return stored
+
+    def drain(self) -> list:
+        """Lấy các mẫu đang giữ chưa lưu của mọi thiết bị (gọi khi tắt server): [(device_id, record_time, state)]"""
+        pending = []
+        with self._lock:
+            for device_id, device in self._devices.items():
+                if device.held is not None:
+                    pending.append((device_id, *device.held))
+                    device.stored += 1
+                    self._archive(device, *device.held)
+        return pending
+
+    def pending(self, device_id: str):
+        """Mẫu đang giữ (chưa lưu) của thiết bị: (record_time, state) hoặc None"""
+        with self._lock:
+            device = self._devices.get(device_id)
+            return device.held if device is not None else None
+
+    def stats(self, device_id: str = None) -> dict:
+        with self._lock:
+            if device_id is None:
+                devices = list(self._devices.values())
+            else:
+                devices = [self._devices[device_id]] if device_id in self._devices else []
+            received = sum(d.received for d in devices)
+            stored = sum(d.stored for d in devices)
+        return {
+            "devices": len(devices),
+            "received": received,
+            "stored": stored,
+            # Số mẫu nhận được trên mỗi dòng lưu xuống DB
+            "ratio": round(received / stored, 2) if stored else None,
+        }
+
+    # ============ Nội bộ (gọi khi đã giữ lock) ============
+    @staticmethod
+    def _archive(device: _DeviceCompression, record_time: datetime, state: dict):
+        device.archived = (record_time, state)
+        device.held = None
+        device.upper = float("inf")
+        device.lower = float("-inf")
+
+    def _offer(self, device: _DeviceCompression, record_time: datetime, state: dict) -> list:
+        if device.archived is None or record_time < device.archived[0]:
+            # Mẫu đầu tiên, hoặc mẫu tới muộn: lưu nguyên, không ảnh hưởng trạng thái nén
+            if device.archived is None:
+                self._archive(device, record_time, state)
+            return [(record_time, state)]
+
+        config = device.config
+        previous = device.held or device.archived
+        if any(state[k] != previous[1][k] for k in DISCRETE_FIELDS):
+            stored = [device.held] if device.held is not None else []
+            self._archive(device, record_time, state)
+            return stored + [(record_time, state)]
+
+        stored = []
+        if config["method"] == "deadband":
+            if abs(state["sensor_value"] - device.archived[1]["sensor_value"]) > config["deadband"]:
+                self._archive(device, record_time, state)
+                return [(record_time, state)]
+        else:
+            slope, upper, lower = self._door(device.archived, record_time, state, config["deviation"])
+            if not device.lower <= slope <= device.upper:
+                # Ngoài cửa: đường thẳng tới mẫu hiện tại lệch quá deviation với một mẫu đang giữ ->
+                # lưu mẫu giữ gần nhất (nằm trong cửa), mở cửa mới từ đó
+                stored.append(device.held)
+                self._archive(device, *device.held)
+                slope, upper, lower = self._door(device.archived, record_time, state, config["deviation"])
+            device.upper, device.lower = min(device.upper, upper), max(device.lower, lower)
+
+        if (record_time - device.archived[0]).total_seconds() >= config["max_interval"]:
+            stored.append((record_time, state))
+            self._archive(device, record_time, state)
+        else:
+            device.held = (record_time, state)
+        return stored
+
+    @staticmethod
+    def _door(archived: tuple, record_time: datetime, state: dict, deviation: float) -> tuple:
+        """Độ dốc từ điểm đã lưu tới mẫu hiện tại, và tới mẫu hiện tại +/- deviation (cửa của mẫu này)"""
+        dt = (record_time - archived[0]).total_seconds()
+        if dt <= 0:
+            return 0.0, float("inf"), float("-inf")
+        dv = state["sensor_value"] - archived[1]["sensor_value"]
+        return dv / dt, (dv + deviation) / dt, (dv - deviation) / dt
+
+
+history_compressor = HistoryCompressor()
@@ -4,9 +4,40 @@ class Settings:
     SECRET_KEY = "your-secret-key-keep-it-secret" # In production, use env var
     ALGORITHM = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES = 30
+
+    # Cache token đã xác thực (tránh decode JWT + SELECT users ở mỗi request)
+    TOKEN_CACHE_MAX_SIZE = 1024     # Số token tối đa giữ trong cache (LRU)
+    TOKEN_CACHE_TTL = 60            # Thời gian sống tối đa của một mục (giây), không vượt exp của JWT
+
+    # Logging (ghi qua hàng đợi, thread nền mới format và in ra)
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")     # DEBUG để xem log từng bản tin MQTT / lệnh gửi đi
+    LOG_QUEUE_SIZE = 10000          # Hàng đợi log đầy thì bỏ bản ghi, không chặn thread gọi log
+    LOG_SAMPLE_EVERY = 100          # Log lặp lại theo từng bản tin chỉ ghi 1 trên mỗi ngần này lần
     
-    # Database
-    DATABASE_URL = "sqlite:///./smartlight.db"
+    # Database (có thể đổi qua biến môi trường, ví dụ khi chạy benchmark trên DB riêng)
+    DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./smartlight.db")
+    # Mọi truy vấn DB của các route async chạy trên thread pool riêng có giới hạn,
+    # không chặn event loop. DB_OFFLOAD=0 để chạy trực tiếp trên event loop (so sánh benchmark).
+    DB_OFFLOAD = os.getenv("DB_OFFLOAD", "1") == "1"
+    DB_POOL_WORKERS = int(os.getenv("DB_POOL_WORKERS", "8"))
+
+    # Cấu hình lưu trữ (PRAGMA áp dụng cho mỗi connection SQLite), chọn qua DB_PROFILE
+    DB_PROFILE = os.getenv("DB_PROFILE", "production")
+    DB_PROFILES = {
+        # Mặc định của SQLite: rollback journal, reader và writer chặn nhau, mỗi commit fsync đầy đủ
+        "default": {},
+        # WAL: reader không chặn writer (và ngược lại); synchronous=NORMAL chỉ fsync khi checkpoint
+        "production": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "mmap_size": 268435456,     # 256 MB
+            "cache_size": -16000,       # ~16 MB mỗi connection (số âm = KiB)
+            "busy_timeout": 5000,       # ms
+            "temp_store": "MEMORY",
+        },
+    }
+    # Số connection đọc cho API (ghi luôn đi qua MỘT connection riêng)
+    DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "8"))
     
     # --- CẤU HÌNH MQTT (LOCAL) ---
     MQTT_BROKER = "localhost"   # Chạy trên cùng máy tính
@@ -21,8 +52,82 @@ class Settings:
     # MQTT_USERNAME = "admin"
     # MQTT_PASSWORD = "public"  (hoặc pass mới bạn đã đổi)
 
+    # Topic theo từng thiết bị: iot/light/<device_id>/status và iot/light/<device_id>/command
+    MQTT_TOPIC_STATUS_WILDCARD = "iot/light/+/status"
+    # Hậu tố chọn codec payload: iot/light/<device_id>/status/<codec> (json, struct, msgpack, cbor)
+    MQTT_TOPIC_STATUS_CODEC_WILDCARD = "iot/light/+/status/+"
+    MQTT_TOPIC_COMMAND_TEMPLATE = "iot/light/{device_id}/command"
+
+    # Topic cũ (chỉ một đèn) vẫn được hỗ trợ, ánh xạ vào thiết bị mặc định
     MQTT_TOPIC_COMMAND = "iot/light/command"
     MQTT_TOPIC_STATUS = "iot/light/status"
+    MQTT_TOPIC_STATUS_CODEC = "iot/light/status/+"
+    DEFAULT_DEVICE_ID = "1"
     MQTT_CLIENT_ID = "fastapi_server_client"
 
+    # --- INGEST (Ghi trễ dữ liệu telemetry theo lô) ---
+    INGEST_QUEUE_MAXSIZE = 10000    # Số bản tin tối đa chờ ghi, vượt quá sẽ bị bỏ
+    INGEST_BATCH_SIZE = 500         # Flush khi gom đủ số bản tin này
+    INGEST_FLUSH_INTERVAL = 0.5     # Hoặc flush sau khoảng thời gian này (giây)
+
+    # --- TELEMETRY NHIỀU MẪU (thiết bị gửi bù dữ liệu đệm sau khi mất kết nối) ---
+    TELEMETRY_BATCH_MAX_SAMPLES = 1000  # Số mẫu tối đa trong một bản tin
+    CLOCK_SYNC_WINDOW = 16              # Số lần đo độ lệch đồng hồ gần nhất dùng để ước lượng (lấy nhỏ nhất)
+    CLOCK_RESYNC_SECONDS = 30.0         # Độ lệch đo được khác ước lượng quá ngần này -> đồng hồ thiết bị đã nhảy
+
+    # Chu kỳ kiểm tra DB có bị sửa từ tiến trình khác không (ví dụ create_user.py) - giây
+    STATE_CACHE_REVALIDATE_INTERVAL = 2.0
+
+    # Số bản tin tối đa chờ gửi cho mỗi client WebSocket, vượt quá thì ngắt client chậm
+    STREAM_CLIENT_BUFFER = 32
+
+    # Số điểm tối đa một API lịch sử trả về khi dùng resolution/max_points
+    HISTORY_MAX_POINTS = 5000
+    # Truy vấn lịch sử không giảm mẫu có nhiều hơn ngần này mẫu gốc (hoặc vượt RETENTION_RAW_DAYS)
+    # thì tự chuyển sang khung rollup, tối đa limit khung, thay vì quét dữ liệu gốc
+    HISTORY_RAW_ROW_BUDGET = 10000
+
+    # Lịch sử gần đây giữ trong bộ nhớ (recent_history): biểu đồ trong khoảng này không cần đọc SQLite
+    RECENT_HISTORY_HOURS = 24
+    RECENT_HISTORY_CAPACITY = 86400     # Số mẫu tối đa mỗi thiết bị (~15 byte/mẫu), đầy thì bỏ mẫu cũ nhất
+    RECENT_HISTORY_WARM_ROWS = 2000000  # Số mẫu tối đa nạp lúc khởi động cho cả hệ thống (mới nhất trước)
+
+    # --- NÉN LỊCH SỬ (compression.py), cấu hình riêng từng thiết bị qua PUT /api/device/{id}/compression ---
+    HISTORY_COMPRESSION = "off"         # Mặc định cho mọi thiết bị: off / deadband / swinging_door
+    COMPRESSION_DEADBAND = 5.0          # deadband: sensor_value lệch quá ngần này so với điểm đã lưu mới lưu
+    COMPRESSION_DEVIATION = 5.0         # swinging_door: sai số tối đa của nội suy tuyến tính
+    COMPRESSION_MAX_INTERVAL = 300.0    # Heartbeat: tối đa ngần này giây giữa 2 điểm lưu (giây)
+
+    # Rollup: khoảng cách tối đa giữa 2 mẫu liên tiếp vẫn được tính là đèn bật liên tục (giây)
+    ROLLUP_MAX_GAP_SECONDS = 300
+
+    # --- THỐNG KÊ SỬ DỤNG / ĐIỆN NĂNG (analytics.py, GET /api/device/analytics/usage) ---
+    LAMP_POWER_WATTS = 9.0              # Công suất đèn ở độ sáng 100% (W)
+    ENERGY_PRICE_PER_KWH = 2500.0       # Đơn giá điện (VND/kWh)
+    ANALYTICS_MAX_DAYS = 366            # Số ngày tối đa của một báo cáo
+
+    # --- RETENTION (Dọn dữ liệu cũ chạy nền) ---
+    # Số ngày giữ lại cho từng loại dữ liệu, 0 = giữ vĩnh viễn
+    RETENTION_RAW_DAYS = 30             # Dữ liệu gốc sensor_history
+    RETENTION_MINUTE_ROLLUP_DAYS = 180  # Rollup theo phút
+    RETENTION_HOUR_ROLLUP_DAYS = 730    # Rollup theo giờ
+    RETENTION_DAY_ROLLUP_DAYS = 0       # Rollup theo ngày
+    RETENTION_INTERVAL = 3600           # Chu kỳ áp dụng chính sách (giây)
+    RETENTION_BATCH_SIZE = 2000         # Số dòng xóa trong mỗi transaction
+    RETENTION_BATCH_PAUSE = 0.05        # Nghỉ giữa 2 lô để ingest giành được khóa ghi (giây)
+    RETENTION_VACUUM_PAGES = 500        # Số trang trả lại hệ điều hành mỗi bước incremental vacuum
+
+    # --- RULE ENGINE (Tự động bật/tắt theo cảm biến, chạy ngay khi nhận telemetry) ---
+    RULE_ENGINE_ENABLED = True
+    RULE_DEBOUNCE_SECONDS = 5.0         # Vùng sáng/tối mới phải giữ liên tục ngần này mới được xác nhận
+    RULE_MIN_DWELL_SECONDS = 60.0       # Khoảng cách tối thiểu giữa 2 lệnh tự động cho cùng một thiết bị
+
+    # --- COMMAND SCHEDULER (Gộp lệnh điều khiển gửi xuống thiết bị) ---
+    COMMAND_COALESCE_WINDOW = 0.05      # Giữ lệnh lại ngần này giây để gộp các lệnh cùng loại tới sau
+    COMMAND_MAX_RATE = 5.0              # Số lần gửi lệnh tối đa mỗi giây cho một thiết bị
+    COMMAND_ACK_TIMEOUT = 5.0           # Lệnh chưa được thiết bị xác nhận sau ngần này giây bị tính là timeout
+    COMMAND_ACK_MAX_PENDING = 100       # Số lệnh chờ xác nhận tối đa mỗi thiết bị
+    COMMAND_ACK_MIN_RTT = 0.05          # Bản tin khớp trạng thái tới sớm hơn ngần này giây sau khi gửi không tính là xác nhận
+    BULK_CONTROL_MAX_DEVICES = 5000     # Số thiết bị tối đa trong một lệnh điều khiển hàng loạt
+
 settings = Settings()
@@ -1,18 +1,98 @@
-from sqlalchemy import create_engine
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from .config import settings
 
-engine = create_engine(
-    settings.DATABASE_URL, connect_args={"check_same_thread": False}
+logger = logging.getLogger(__name__)
+
+def create_db_engine(url: str, profile: str, pool_size: int, max_overflow: int = 0):
+    """Engine SQLite áp dụng PRAGMA của profile (settings.DB_PROFILES) cho mỗi connection mới"""
+    if profile not in settings.DB_PROFILES:
+        raise ValueError(f"Unknown DB profile: {profile}")
+    pragmas = settings.DB_PROFILES[profile]
+    db_engine = create_engine(
+        url, connect_args={"check_same_thread": False}, pool_size=pool_size, max_overflow=max_overflow
+    )
+
+    @event.listens_for(db_engine, "connect")
+    def _apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # Phải đặt trước khi DB mới chuyển sang WAL / tạo bảng đầu tiên.
+        # DB cũ chỉ đổi chế độ sau khi VACUUM (compact_db.py), với DB đó lệnh này không có tác dụng.
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    return db_engine
+
+# Đọc (API, cache, export): pool nhiều connection
+engine = create_db_engine(
+    settings.DATABASE_URL, settings.DB_PROFILE,
+    pool_size=settings.DB_READ_POOL_SIZE, max_overflow=settings.DB_READ_POOL_SIZE
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Ghi (ingest, retention, lệnh điều khiển, cài đặt): MỘT connection duy nhất, các writer xếp hàng
+# chờ connection trong pool thay vì tranh khóa ghi của SQLite (SQLITE_BUSY).
+# BẤT BIẾN: mọi thao tác ghi trong tiến trình này PHẢI đi qua write_engine (WriteSessionLocal).
+# state_cache phân biệt commit của chính ta với tiến trình khác nhờ hook checkin của engine này;
+# ghi qua engine/connection khác sẽ bị coi là thay đổi từ bên ngoài (quét lại device_state mỗi lần).
+write_engine = create_db_engine(settings.DATABASE_URL, settings.DB_PROFILE, pool_size=1, max_overflow=0)
+WriteSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=write_engine)
+
+# Theo dõi thay đổi (state_cache): MỘT connection riêng, giữ suốt vòng đời, chỉ đọc PRAGMA data_version
+# -> không mượn connection ghi và không phải xếp hàng sau ingest
+watch_engine = create_db_engine(settings.DATABASE_URL, settings.DB_PROFILE, pool_size=1, max_overflow=0)
+
 Base = declarative_base()
 
-def get_db():
+async def get_db():
+    # Dependency async: tạo Session không chạm DB nên không cần sang thread pool của FastAPI;
+    # các truy vấn thực sự được route đẩy sang db_executor qua run_db()
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+# ============ THREAD POOL CHO TRUY VẤN DB ============
+# SQLAlchemy Session là đồng bộ: gọi trực tiếp trong route async sẽ chặn event loop và mọi request khác.
+# Các route đẩy phần việc chạm DB sang pool này (số thread có giới hạn = số truy vấn đồng thời tối đa).
+db_executor = ThreadPoolExecutor(max_workers=settings.DB_POOL_WORKERS, thread_name_prefix="db")
+
+async def run_db(fn, *args, **kwargs):
+    """Chạy hàm đồng bộ fn(*args, **kwargs) (có truy vấn DB) trên db_executor và chờ kết quả"""
+    if not settings.DB_OFFLOAD:
+        return fn(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, functools.partial(fn, *args, **kwargs))
+
+def migrate_schema():
+    """
+    Nâng cấp DB đã tạo từ phiên bản cũ: create_all() không ALTER bảng có sẵn,
+    nên bổ sung các cột còn thiếu (dùng server_default để điền dữ liệu cũ) và các index mới.
+    """
+    # Dùng chung connection của transaction: engine ghi chỉ có MỘT connection
+    with write_engine.begin() as conn:
+        inspector = inspect(conn)
+        existing_tables = set(inspector.get_table_names())
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(write_engine.dialect)}"
+                if column.server_default is not None:
+                    ddl += f" NOT NULL DEFAULT '{column.server_default.arg}'" if not column.nullable \
+                        else f" DEFAULT '{column.server_default.arg}'"
+                conn.execute(text(ddl))
+                logger.info("Added column %s.%s", table.name, column.name)
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
@@ -0,0 +1,212 @@
+import math
+from itertools import chain
+import numpy as np
+from datetime import datetime
+from sqlalchemy import select, func
+from .config import settings
+from .models.device import SensorHistory
+
+# Cột của một chuỗi lịch sử dạng mảng (mỗi cột là một numpy array cùng độ dài)
+SERIES_FIELDS = ("id", "ts", "sensor_value", "brightness", "is_on", "is_auto_mode")
+
+# julianday() tính trong SQLite -> epoch giây, tránh parse datetime từng dòng trong Python
+_EPOCH_SECONDS = (func.julianday(SensorHistory.timestamp) - 2440587.5) * 86400.0
+
+
+def empty_series() -> dict:
+    return {name: np.empty(0, dtype=np.float64) for name in SERIES_FIELDS}
+
+
+def to_epoch(ts: datetime) -> float:
+    """Datetime (naive) -> epoch giây, cùng quy ước với cột ts của chuỗi"""
+    return (ts - datetime(1970, 1, 1)).total_seconds()
+
+
+def to_datetimes(ts: np.ndarray) -> list:
+    """Mảng epoch giây -> list datetime (naive), chuyển đổi vector hóa qua datetime64"""
+    return np.round(ts * 1e6).astype("int64").astype("datetime64[us]").tolist()
+
+
+def load_series(db, device_id: str, start: datetime, end: datetime = None) -> dict:
+    """Đọc lịch sử của một thiết bị thành các mảng cột (không tạo ORM object)"""
+    stmt = select(
+        SensorHistory.id, _EPOCH_SECONDS,
+        SensorHistory.sensor_value, SensorHistory.brightness,
+        SensorHistory.is_on, SensorHistory.is_auto_mode,
+    ).where(SensorHistory.device_id == device_id, SensorHistory.timestamp >= start)
+    if end is not None:
+        stmt = stmt.where(SensorHistory.timestamp < end)
+    rows = db.execute(stmt.order_by(SensorHistory.timestamp)).all()
+    if not rows:
+        return empty_series()
+    width = len(SERIES_FIELDS)
+    matrix = np.fromiter(chain.from_iterable(rows), dtype=np.float64, count=len(rows) * width)
+    matrix = matrix.reshape(len(rows), width)
+    series = {name: matrix[:, i] for i, name in enumerate(SERIES_FIELDS)}
+    # julianday là số thực: làm tròn về mili giây để bỏ sai số dấu phẩy động
+    series["ts"] = np.round(series["ts"], 3)
+    return series
+
+
+def take(series: dict, indices: np.ndarray) -> dict:
+    return {name: values[indices] for name, values in series.items()}
+
+
+# ============ 1. GOM NHÓM THEO KHUNG THỜI GIAN ============
+
+def bucket_aggregate(series: dict, bucket_seconds: float, origin: float = 0.0,
+                     max_gap: float = settings.ROLLUP_MAX_GAP_SECONDS) -> dict:
+    """
+    Gom chuỗi (đã sắp xếp theo thời gian) vào các khung cố định bucket_seconds, căn theo origin.
+    Trả về các mảng: ts (đầu khung), count, min/max/avg của sensor_value và brightness, on_ratio,
+    on_seconds (tính như rollup: khoảng tới mẫu kế tiếp nếu đèn bật và không quá max_gap giây,
+    cộng vào khung của mẫu trước) -> cùng định dạng với rollups.rollup_buckets.
+    """
+    ts = series["ts"]
+    if ts.size == 0:
+        return {"ts": ts, "count": ts}
+    bucket = np.floor((ts - origin) / bucket_seconds).astype(np.int64)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(bucket)) + 1))
+    counts = np.diff(np.concatenate((starts, [ts.size])))
+    gaps = np.append(np.diff(ts), 0.0)
+    on_gaps = np.where((gaps > 0) & (gaps <= max_gap), gaps, 0.0) * series["is_on"]
+
+    result = {
+        "ts": origin + bucket[starts] * bucket_seconds,
+        "count": counts,
+        "on_ratio": np.add.reduceat(series["is_on"], starts) / counts,
+        "on_seconds": np.add.reduceat(on_gaps, starts),
+    }
+    for name in ("sensor_value", "brightness"):
+        values = series[name]
+        result[f"{name}_min"] = np.minimum.reduceat(values, starts)
+        result[f"{name}_max"] = np.maximum.reduceat(values, starts)
+        result[f"{name}_avg"] = np.add.reduceat(values, starts) / counts
+    return result
+
+
+def clamp_resolution(resolution: int, range_seconds: float, max_points: int) -> int:
+    """Tăng độ dài khung nếu cần để số khung trong khoảng thời gian không vượt max_points"""
+    return max(int(resolution), math.ceil(range_seconds / max_points))
+
+
+def buckets_to_items(buckets: dict) -> list:
+    if buckets["ts"].size == 0:
+        return []
+    return [
+        {
+            "timestamp": ts,
+            "count": int(count),
+            "sensor_value": round(s_avg, 2),
+            "sensor_min": int(s_min),
+            "sensor_max": int(s_max),
+            "brightness": round(b_avg, 2),
+            "brightness_min": int(b_min),
+            "brightness_max": int(b_max),
+            "on_ratio": round(on_ratio, 4),
+            "on_seconds": round(on_seconds, 3),
+        }
+        for ts, count, s_avg, s_min, s_max, b_avg, b_min, b_max, on_ratio, on_seconds in zip(
+            to_datetimes(buckets["ts"]), buckets["count"].tolist(),
+            buckets["sensor_value_avg"].tolist(), buckets["sensor_value_min"].tolist(),
+            buckets["sensor_value_max"].tolist(), buckets["brightness_avg"].tolist(),
+            buckets["brightness_min"].tolist(), buckets["brightness_max"].tolist(),
+            buckets["on_ratio"].tolist(), buckets["on_seconds"].tolist(),
+        )
+    ]
+
+
+# ============ 2. LTTB (LARGEST-TRIANGLE-THREE-BUCKETS) ============
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Chọn threshold điểm giữ nguyên hình dạng đường cong (Steinarsson, 2013).
+    Vòng lặp chỉ chạy theo số khung (<= threshold), trong mỗi khung tính diện tích bằng numpy.
+    """
+    n = x.size
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    edges = np.floor(np.linspace(1, n - 1, threshold - 1)).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Điểm trung bình của khung kế tiếp (khung cuối dùng điểm cuối cùng)
+        if i + 2 < edges.size:
+            nlo, nhi = edges[i + 1], edges[i + 2]
+            avg_x, avg_y = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        else:
+            avg_x, avg_y = x[n - 1], y[n - 1]
+        areas = np.abs(
+            (x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a])
+        )
+        a = lo + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+def downsample_lttb(series: dict, max_points: int) -> dict:
+    """
+    LTTB riêng cho sensor_value và brightness (mỗi chuỗi một nửa số điểm),
+    hợp hai tập chỉ số lại để biểu đồ giữ được cả hai đường. Kết quả <= max_points điểm.
+    """
+    n = series["ts"].size
+    if n <= max_points:
+        return series
+    half = max_points // 2
+    if half < 3:
+        # Quá ít điểm cho LTTB (cần >= 3 điểm mỗi chuỗi): lấy mẫu đều, luôn giữ điểm đầu và cuối
+        return take(series, np.unique(np.linspace(0, n - 1, max(max_points, 0)).round().astype(np.int64)))
+    indices = np.union1d(
+        lttb_indices(series["ts"], series["sensor_value"], half),
+        lttb_indices(series["ts"], series["brightness"], half),
+    )
+    return take(series, indices)
+
+
+# ============ 3. DỰNG LẠI CHUỖI ĐÃ NÉN (compression.py) ============
+
+def reconstruct_series(series: dict, start_ts: float, end_ts: float, interval: float,
+                       method: str = "step") -> dict:
+    """
+    Dựng lại chuỗi đều interval giây trong [start_ts, end_ts) từ các điểm đã lưu (đã sắp xếp).
+    sensor_value: "step" giữ giá trị điểm lưu trước đó (deadband), "linear" nội suy tuyến tính
+    (swinging door); is_on/brightness/is_auto_mode luôn giữ giá trị trước đó. Không dựng trước điểm lưu đầu tiên.
+    """
+    ts = series["ts"]
+    if ts.size == 0:
+        return {name: np.empty(0, dtype=np.float64) for name in SERIES_FIELDS if name != "id"}
+    grid = np.arange(start_ts, end_ts, interval, dtype=np.float64)
+    grid = grid[grid >= ts[0]]
+    previous = np.searchsorted(ts, grid, side="right") - 1
+    result = {name: series[name][previous] for name in ("brightness", "is_on", "is_auto_mode")}
+    result["ts"] = grid
+    if method == "linear":
+        result["sensor_value"] = np.round(np.interp(grid, ts, series["sensor_value"]))
+    else:
+        result["sensor_value"] = series["sensor_value"][previous]
+    return result
+
+
+def series_to_items(series: dict, device_id: str = None) -> list:
+    """Chuỗi mảng -> list dict giống SensorHistoryItem (chuỗi từ recent_history không có id)"""
+    ids = series["id"].tolist() if "id" in series else [None] * series["ts"].size
+    return [
+        {
+            "id": None if row_id is None else int(row_id),
+            "device_id": device_id,
+            "sensor_value": int(sensor_value),
+            "brightness": int(brightness),
+            "is_on": bool(is_on),
+            "is_auto_mode": bool(is_auto_mode),
+            "timestamp": ts,
+        }
+        for row_id, ts, sensor_value, brightness, is_on, is_auto_mode in zip(
+            ids, to_datetimes(series["ts"]),
+            series["sensor_value"].tolist(), series["brightness"].tolist(),
+            series["is_on"].tolist(), series["is_auto_mode"].tolist(),
+        )
+    ]
@@ -0,0 +1,80 @@
+import csv
+import io
+import json
+from datetime import datetime
+from sqlalchemy import select
+from .database import SessionLocal, run_db
+from .models.device import SensorHistory
+
+EXPORT_FIELDS = ("id", "device_id", "sensor_value", "brightness", "is_on", "is_auto_mode", "timestamp")
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+EXPORT_CHUNK_ROWS = 1000
+
+
+def history_range(columns, device_id: str, start: datetime, end: datetime):
+    """
+    SELECT lịch sử của một thiết bị trong khoảng nửa mở [start, end), sắp xếp theo thời gian.
+    So sánh trực tiếp trên cột timestamp (không bọc trong hàm) để SQLite dùng được
+    index (device_id, timestamp) thay vì quét toàn bảng.
+    """
+    return select(*columns).where(
+        SensorHistory.device_id == device_id,
+        SensorHistory.timestamp >= start,
+        SensorHistory.timestamp < end,
+    ).order_by(SensorHistory.timestamp)
+
+
+def _ndjson_chunk(rows) -> str:
+    return "".join(
+        json.dumps({
+            "id": row_id, "device_id": device_id, "sensor_value": sensor_value,
+            "brightness": brightness, "is_on": bool(is_on), "is_auto_mode": bool(is_auto_mode),
+            "timestamp": ts.isoformat(),
+        }) + "\n"
+        for row_id, device_id, sensor_value, brightness, is_on, is_auto_mode, ts in rows
+    )
+
+
+def _csv_chunk(rows, header: bool = False) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if header:
+        writer.writerow(EXPORT_FIELDS)
+    writer.writerows(
+        (row_id, device_id, sensor_value, brightness, int(is_on), int(is_auto_mode), ts.isoformat())
+        for row_id, device_id, sensor_value, brightness, is_on, is_auto_mode, ts in rows
+    )
+    return buffer.getvalue()
+
+
+def iter_export(device_id: str, start: datetime, end: datetime, fmt: str):
+    """
+    Sinh nội dung export theo từng khối EXPORT_CHUNK_ROWS dòng (yield_per), bộ nhớ không phụ thuộc
+    độ dài khoảng thời gian. Tự mở session riêng vì generator chạy sau khi request handler kết thúc.
+    """
+    columns = [getattr(SensorHistory, name) for name in EXPORT_FIELDS]
+    stmt = history_range(columns, device_id, start, end).execution_options(yield_per=EXPORT_CHUNK_ROWS)
+    db = SessionLocal()
+    try:
+        if fmt == "csv":
+            yield _csv_chunk((), header=True)
+        for rows in db.execute(stmt).partitions():
+            yield _csv_chunk(rows) if fmt == "csv" else _ndjson_chunk(rows)
+    finally:
+        db.close()
+
+
+async def aiter_export(device_id: str, start: datetime, end: datetime, fmt: str):
+    """iter_export cho StreamingResponse: mỗi khối được đọc trên thread pool của DB (run_db)"""
+    chunks = iter_export(device_id, start, end, fmt)
+    try:
+        while True:
+            chunk = await run_db(next, chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+    finally:
+        await run_db(chunks.close)
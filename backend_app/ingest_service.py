@@ -0,0 +1,184 @@
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import insert
+from .config import settings
+from .database import WriteSessionLocal
+from .models.device import SensorHistory
+from .state_cache import state_cache, upsert_device_states
+from .rollups import rollup_aggregator
+from .analytics import usage_analytics
+from .metrics import DB_COMMIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class IngestPipeline:
+    """
+    Hàng đợi ghi trễ (write-behind) cho dữ liệu telemetry từ MQTT.
+    - on_message chỉ đẩy bản tin vào hàng đợi, không chạm vào DB trên thread của paho.
+    - Thread nền gom bản tin theo cửa sổ flush (đủ kích thước hoặc hết thời gian),
+      ghi trạng thái cuối cùng của mỗi thiết bị (giá trị cuối cùng thắng) và bulk insert lịch sử
+      trong MỘT transaction duy nhất.
+    """
+
+    def __init__(self, maxsize: int, batch_size: int, flush_interval: float):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        # Thống kê (chỉ thread writer ghi, trừ received/dropped)
+        self.received = 0
+        self.dropped = 0
+        self.flushed_messages = 0
+        self.flushed_batches = 0
+        self.failed_batches = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    # ============ API cho producer (thread của paho) ============
+    def submit(self, device_id: str, state: dict, record_time: datetime,
+               samples: list = None, stored: list = None) -> bool:
+        """
+        Đẩy trạng thái thiết bị (đã gộp) vào hàng đợi. Trả về False nếu hàng đợi đầy (bị bỏ).
+        Bản tin nhiều mẫu truyền samples = [(record_time, state)] (mỗi mẫu một dòng lịch sử);
+        state = None khi cả lô cũ hơn trạng thái hiện tại (chỉ ghi lịch sử).
+        stored: các mẫu còn lại sau khi nén (compression.py), None = lưu hết; rollup luôn tính trên samples.
+        """
+        self.received += 1
+        try:
+            self._queue.put_nowait((device_id, state, record_time, samples, stored))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    # ============ Vòng đời ============
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Dừng writer, flush nốt những gì còn trong hàng đợi."""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self) -> dict:
+        batches = self.flushed_batches + self.failed_batches
+        return {
+            "queue_depth": self._queue.qsize(),
+            "queue_maxsize": self._queue.maxsize,
+            "received": self.received,
+            "dropped": self.dropped,
+            "flushed_messages": self.flushed_messages,
+            "flushed_batches": self.flushed_batches,
+            "failed_batches": self.failed_batches,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "avg_flush_ms": round(self._total_flush_ms / batches, 3) if batches else 0.0,
+            "max_flush_ms": round(self.max_flush_ms, 3),
+        }
+
+    # ============ Thread writer ============
+    def _run(self):
+        while not (self._stop_event.is_set() and self._queue.empty()):
+            batch = self._collect()
+            if batch:
+                self._flush(batch)
+
+    def _collect(self) -> list:
+        """Gom một cửa sổ flush: chờ bản tin đầu tiên, sau đó gom tới khi đủ batch_size hoặc hết flush_interval."""
+        try:
+            first = self._queue.get(timeout=0.5)
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + self._flush_interval
+        while len(batch) < self._batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch: list):
+        started = time.perf_counter()
+        db = WriteSessionLocal()
+        try:
+            # Mỗi phần tử là trạng thái đầy đủ (đã gộp trong state_cache) tại thời điểm nhận:
+            # device_state chỉ cần trạng thái cuối cùng của mỗi thiết bị, lịch sử thì lưu hết.
+            latest = {}
+            history_rows = []
+            rollup_rows = []
+            earliest = {}   # device_id -> mẫu cũ nhất của các lô nhiều mẫu (có thể gửi bù cho ngày cũ)
+            for device_id, state, record_time, samples, stored in batch:
+                if state is not None:
+                    latest[device_id] = state
+                if samples:
+                    earliest[device_id] = min(samples[0][0], earliest.get(device_id, samples[0][0]))
+                rows = [
+                    _history_row(device_id, sample_time, sample)
+                    for sample_time, sample in (samples if samples is not None else ((record_time, state),))
+                ]
+                rollup_rows.extend(rows)
+                history_rows.extend(rows if stored is None else [
+                    _history_row(device_id, sample_time, sample) for sample_time, sample in stored
+                ])
+
+            with DB_COMMIT_SECONDS.time(("ingest",)), state_cache.write_lock:
+                upsert_device_states(db, latest.values())
+                # Mọi dòng lịch sử (kể cả các lô nhiều mẫu) trong MỘT câu INSERT executemany
+                if history_rows:
+                    db.execute(insert(SensorHistory), history_rows)
+                rollup_aggregator.apply(db, rollup_rows)
+                db.commit()
+            # Dữ liệu đọc từ DB vừa đổi: ETag lịch sử của các thiết bị này phải đổi theo
+            state_cache.touch_history({item[0] for item in batch})
+            state_cache.touch_days({(row["device_id"], row["timestamp"].date()) for row in rollup_rows})
+            for device_id, since in earliest.items():
+                usage_analytics.invalidate(device_id, since)
+
+            self.flushed_messages += len(batch)
+            self.flushed_batches += 1
+        except Exception as e:
+            logger.error("Database error, batch dropped: %s", e, extra={"count": len(batch)})
+            db.rollback()
+            self.failed_batches += 1
+        finally:
+            db.close()
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.last_flush_ms = elapsed_ms
+        self._total_flush_ms += elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+
+
+def _history_row(device_id: str, record_time: datetime, state: dict) -> dict:
+    return {
+        "device_id": device_id,
+        "sensor_value": state["sensor_value"],
+        "brightness": state["brightness"],
+        "is_on": state["is_on"],
+        "is_auto_mode": state["is_auto_mode"],
+        "timestamp": record_time,
+    }
+
+
+ingest_pipeline = IngestPipeline(
+    maxsize=settings.INGEST_QUEUE_MAXSIZE,
+    batch_size=settings.INGEST_BATCH_SIZE,
+    flush_interval=settings.INGEST_FLUSH_INTERVAL,
+)
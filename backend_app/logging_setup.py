@@ -0,0 +1,73 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+from .config import settings
+
+# Các trường cấu trúc (truyền qua extra=...) được nối vào cuối dòng log dạng key=value
+STRUCTURED_FIELDS = ("device", "topic", "latency_ms", "count", "job")
+
+_listener = None
+
+
+class StructuredFormatter(logging.Formatter):
+    def format(self, record) -> str:
+        line = super().format(record)
+        fields = " ".join(f"{k}={getattr(record, k)}" for k in STRUCTURED_FIELDS if hasattr(record, k))
+        return f"{line} {fields}" if fields else line
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Không bao giờ chặn thread ghi log: hàng đợi đầy thì bỏ bản ghi và đếm lại"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogSampler:
+    """
+    Lấy mẫu log lặp lại theo từng bản tin: chỉ 1 trên mỗi `every` lần gọi cùng khóa trả về True.
+    Bộ đếm không khóa (sai lệch vài lần khi nhiều thread cùng gọi không quan trọng với việc lấy mẫu).
+    """
+
+    def __init__(self, every: int):
+        self._every = max(1, every)
+        self._counts = {}
+
+    def __call__(self, key: str) -> bool:
+        n = self._counts.get(key, 0)
+        self._counts[key] = n + 1
+        return n % self._every == 0
+
+
+def setup_logging():
+    """
+    Cấu hình logger "backend_app": thread gọi log chỉ đẩy bản ghi vào hàng đợi (QueueHandler),
+    việc format và ghi ra stderr do thread nền (QueueListener) làm. Gọi nhiều lần không sao.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.Queue(settings.LOG_QUEUE_SIZE)
+    output = logging.StreamHandler()
+    output.setFormatter(StructuredFormatter("%(asctime)s %(levelname)-7s [%(name)s] %(message)s"))
+
+    logger = logging.getLogger("backend_app")
+    logger.setLevel(settings.LOG_LEVEL)
+    logger.addHandler(_DroppingQueueHandler(log_queue))
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+sample = LogSampler(settings.LOG_SAMPLE_EVERY)
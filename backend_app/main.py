@@ -1,14 +1,36 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse
 from pathlib import Path
-from .routers import auth, control
-from .database import engine, Base
+import asyncio
+import logging
+from .routers import auth, control, stream, analytics
+from .database import write_engine, Base, SessionLocal, migrate_schema
 from .mqtt_service import mqtt_service
+from .ingest_service import ingest_pipeline
+from .state_cache import state_cache
+from .broadcast import broadcast_hub
+from .rollups import rollup_aggregator
+from .recent_history import recent_history
+from .telemetry_batch import clock_sync
+from .compression import history_compressor
+from .analytics import usage_analytics
+from .retention import retention_engine
+from .token_cache import token_cache
+from .rule_engine import rule_engine
+from .command_scheduler import command_scheduler
+from .command_tracker import command_tracker
+from .database import db_executor
+from .metrics import metrics, MetricsMiddleware
+from .logging_setup import setup_logging
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# Create tables (DB mới được tạo ở chế độ auto_vacuum=INCREMENTAL, xem database.create_db_engine)
+Base.metadata.create_all(bind=write_engine)
+migrate_schema()
 
 app = FastAPI(
     title="IoT Smart Light Backend",
@@ -23,11 +45,31 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],    # Frontend đọc ETag để gửi lại If-None-Match
 )
 
+# Đo độ trễ HTTP theo route cho /metrics
+app.add_middleware(MetricsMiddleware)
+
+# Độ sâu các hàng đợi, chỉ đọc lúc scrape /metrics
+metrics.gauge("iot_ingest_queue_depth", "Telemetry messages waiting for the ingest writer",
+              lambda: ingest_pipeline.stats()["queue_depth"])
+metrics.gauge("iot_command_pending", "Commands waiting in the command scheduler",
+              lambda: command_scheduler.stats()["pending"])
+metrics.gauge("iot_command_ack_pending", "Commands waiting for device acknowledgement",
+              lambda: command_tracker.stats()["pending"])
+metrics.gauge("iot_db_executor_queue_depth", "DB calls waiting for a run_db worker thread",
+              lambda: db_executor._work_queue.qsize())
+metrics.gauge("iot_stream_subscribers", "Connected WebSocket stream clients",
+              lambda: broadcast_hub.stats()["subscribers"])
+metrics.gauge("iot_retention_pending_jobs", "Queued retention jobs",
+              lambda: retention_engine.stats()["pending_jobs"])
+
 # Include API Routers
 app.include_router(auth.router)
 app.include_router(control.router)
+app.include_router(stream.router)
+app.include_router(analytics.router)
 
 # Frontend path
 frontend_path = Path(__file__).parent.parent / "frontend"
@@ -44,10 +86,38 @@ app.mount("/fonts", StaticFiles(directory=str(frontend_path / "fonts")), name="f
 @app.on_event("startup")
 async def startup_event():
     """Khởi động kết nối MQTT khi server start"""
+    broadcast_hub.bind_loop(asyncio.get_running_loop())
+    # Thiết bị mặc định luôn tồn tại (các route chỉ đọc trả về 404 cho thiết bị chưa biết)
+    with SessionLocal() as db:
+        control.get_or_create_device_state(db)
+    state_cache.load()
+    rule_engine.reload()
+    state_cache.add_listener(token_cache.revalidate)
+    state_cache.add_listener(rule_engine.reload)
+    state_cache.add_listener(history_compressor.reload)
+    state_cache.start()
+    with SessionLocal() as db:
+        rollup_aggregator.warm(db)
+        recent_history.warm(db)
+        history_compressor.reload(db)
+        token_cache.revalidate(db)
+    ingest_pipeline.start()
+    retention_engine.start()
+    command_scheduler.start()
     mqtt_service.connect()
-    print("=" * 50)
-    print("🚀 IoT Smart Light Backend đã khởi động!")
-    print("=" * 50)
+    logger.info("🚀 IoT Smart Light Backend đã khởi động!")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Gửi nốt lệnh đang chờ, dừng MQTT, sau đó flush nốt hàng đợi ghi trễ"""
+    command_scheduler.stop()
+    mqtt_service.client.loop_stop()
+    # Mẫu đang giữ lại trong bộ nén (chưa quyết định lưu) được ghi trước khi dừng writer
+    for device_id, record_time, state in history_compressor.drain():
+        ingest_pipeline.submit(device_id, None, record_time, [], [(record_time, state)])
+    ingest_pipeline.stop()
+    retention_engine.stop()
+    state_cache.stop()
 
 # Serve frontend static files
 @app.get("/", tags=["frontend"])
@@ -70,5 +140,21 @@ async def health_check():
     """Health check endpoint"""
     return {
         "status": "healthy",
-        "mqtt_connected": mqtt_service.connected
-    }
\ No newline at end of file
+        "mqtt_connected": mqtt_service.connected,
+        "ingest": ingest_pipeline.stats(),
+        "stream": broadcast_hub.stats(),
+        "auth": token_cache.stats(),
+        "retention": retention_engine.stats(),
+        "rules": rule_engine.stats(),
+        "commands": command_scheduler.stats(),
+        "acks": command_tracker.stats(),
+        "recent_history": recent_history.stats(),
+        "clock_sync": clock_sync.stats(),
+        "compression": history_compressor.stats(),
+        "analytics": usage_analytics.stats()
+    }
+
+@app.get("/metrics", tags=["health"], response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Metrics định dạng Prometheus (text exposition format)"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,215 @@
+import threading
+import time
+from bisect import bisect_left
+
+# Bucket mặc định (giây) cho các histogram độ trễ
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class _Metric:
+    def __init__(self, registry, name: str, help_text: str, labelnames: tuple):
+        self._registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+
+    def _format_labels(self, labels: tuple, extra: str = "") -> str:
+        pairs = [f'{k}="{_escape(v)}"' for k, v in zip(self.labelnames, labels)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, labels: tuple = ()):
+        values = self._registry._shard()
+        key = (self, labels)
+        values[key] = values.get(key, 0) + amount
+
+    def render(self, merged: dict) -> list:
+        return [f"{self.name}{self._format_labels(labels)} {_number(value)}"
+                for labels, value in sorted(merged.items())]
+
+    def merge(self, into: dict, labels: tuple, value):
+        into[labels] = into.get(labels, 0) + value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name: str, help_text: str, labelnames: tuple, buckets: tuple):
+        super().__init__(registry, name, help_text, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value: float, labels: tuple = ()):
+        values = self._registry._shard()
+        key = (self, labels)
+        data = values.get(key)
+        if data is None:
+            # [count từng bucket..., bucket +Inf, sum]
+            data = values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        data[bisect_left(self.buckets, value)] += 1
+        data[-1] += value
+
+    def time(self, labels: tuple = ()):
+        return _Timer(self, labels)
+
+    def merge(self, into: dict, labels: tuple, value):
+        current = into.get(labels)
+        if current is None:
+            into[labels] = list(value)
+        else:
+            for i, v in enumerate(value):
+                current[i] += v
+
+    def render(self, merged: dict) -> list:
+        lines = []
+        for labels, data in sorted(merged.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), data):
+                cumulative += count
+                le = 'le="%s"' % (bound if bound == "+Inf" else _number(bound))
+                lines.append(f"{self.name}_bucket{self._format_labels(labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(labels)} {_number(data[-1])}")
+            lines.append(f"{self.name}_count{self._format_labels(labels)} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Giá trị đọc lúc scrape qua callback (độ sâu hàng đợi...), không tốn gì khi ghi"""
+    kind = "gauge"
+
+    def __init__(self, registry, name: str, help_text: str, callback):
+        super().__init__(registry, name, help_text, ())
+        self.callback = callback
+
+    def render(self, merged: dict) -> list:
+        try:
+            return [f"{self.name} {_number(self.callback())}"]
+        except Exception:
+            return []
+
+
+class _Timer:
+    __slots__ = ("_histogram", "_labels", "_started")
+
+    def __init__(self, histogram: Histogram, labels: tuple):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._started, self._labels)
+
+
+class MetricsRegistry:
+    """
+    Bộ đếm/histogram kiểu Prometheus, ghi không cần khóa:
+    - Mỗi thread ghi vào shard (dict) riêng của nó, thread paho không bao giờ chờ khóa chung.
+    - Khi scrape /metrics mới cộng dồn các shard lại (chỉ khóa lúc đăng ký shard mới).
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        self._local = threading.local()
+
+    def counter(self, name: str, help_text: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(self, name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(self, name, help_text, labelnames, buckets))
+
+    def gauge(self, name: str, help_text: str, callback) -> Gauge:
+        return self._register(Gauge(self, name, help_text, callback))
+
+    def render(self) -> str:
+        """Xuất toàn bộ metric theo định dạng text của Prometheus"""
+        merged = {metric: {} for metric in self._metrics}
+        with self._shards_lock:
+            shards = list(self._shards)
+        for values in shards:
+            for (metric, labels), value in list(values.items()):
+                metric.merge(merged[metric], labels, value)
+
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render(merged[metric]))
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def _shard(self) -> dict:
+        values = getattr(self._local, "values", None)
+        if values is None:
+            values = self._local.values = {}
+            with self._shards_lock:
+                self._shards.append(values)
+        return values
+
+
+class MetricsMiddleware:
+    """ASGI middleware đo độ trễ HTTP theo route (dùng mẫu đường dẫn, không dùng URL thật)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, (scope["method"], path, str(status[0])))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+metrics = MetricsRegistry()
+
+# ============ Metric dùng chung ============
+MQTT_MESSAGES_RECEIVED = metrics.counter(
+    "iot_mqtt_messages_received_total", "MQTT status messages received")
+MQTT_MESSAGES_PARSED = metrics.counter(
+    "iot_mqtt_messages_parsed_total", "MQTT status messages parsed successfully", ("codec",))
+MQTT_PAYLOAD_BYTES = metrics.counter(
+    "iot_mqtt_payload_bytes_total", "Bytes of parsed MQTT status payloads", ("codec",))
+MQTT_MESSAGE_ERRORS = metrics.counter(
+    "iot_mqtt_message_errors_total", "MQTT status messages that failed to process")
+MQTT_ON_MESSAGE_SECONDS = metrics.histogram(
+    "iot_mqtt_on_message_seconds", "Processing time of on_message on the paho thread")
+MQTT_PUBLISH_SECONDS = metrics.histogram(
+    "iot_mqtt_publish_seconds", "Latency of publish_command")
+DB_COMMIT_SECONDS = metrics.histogram(
+    "iot_db_commit_seconds", "Latency of write transactions (lock wait + statements + commit)", ("writer",))
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    "iot_http_request_seconds", "HTTP request latency by route", ("method", "route", "status"))
@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, Index, false, func
 from ..database import Base
+from ..config import settings
 from datetime import datetime
 
 class User(Base):
@@ -12,24 +13,76 @@ class User(Base):
 class DeviceState(Base):
     __tablename__ = "device_state"
 
-    id = Column(Integer, primary_key=True, index=True)  # Default 1
+    id = Column(Integer, primary_key=True, index=True)
+    # Mã thiết bị (lấy từ topic iot/light/<device_id>/status), đèn cũ dùng DEFAULT_DEVICE_ID
+    device_id = Column(String, unique=True, index=True, nullable=False,
+                       server_default=settings.DEFAULT_DEVICE_ID)
     is_on = Column(Boolean, default=False)
     brightness = Column(Integer, default=0)
     sensor_value = Column(Integer, default=0)  # Light sensor value (LDR)
     is_auto_mode = Column(Boolean, default=False)
     last_updated = Column(DateTime, default=datetime.utcnow)
+    # Nhóm (ví dụ tầng/phòng) và tag để điều khiển hàng loạt; tags lưu dạng ",tag1,tag2," (lọc bằng has_tag)
+    group_name = Column(String, nullable=True, index=True)
+    tags = Column(String, nullable=True)
+    # Cấu hình nén lịch sử riêng (JSON, xem compression.py), NULL = dùng mặc định trong config
+    compression = Column(String, nullable=True)
+    # Luật tự động (rule_engine) có được điều khiển đèn này không: False khi người dùng điều khiển tay,
+    # True khi chọn AUTO. NULL = chưa quyết định (lấy theo is_auto_mode lần đầu rule_engine gặp thiết bị)
+    rules_armed = Column(Boolean, nullable=True)
+
+    @classmethod
+    def has_tag(cls, tag: str):
+        """
+        Điều kiện lọc thiết bị có đúng tag này (phân biệt hoa thường). Dùng instr thay cho LIKE
+        để '%', '_' trong tag người dùng nhập không thành ký tự đại diện.
+        """
+        if "," in tag:
+            return false()  # Tag không được chứa dấu phẩy (xem save_device_group)
+        return func.instr(cls.tags, f",{tag},") > 0
 
 class SensorHistory(Base):
     """Bảng lưu lịch sử dữ liệu cảm biến để vẽ biểu đồ"""
     __tablename__ = "sensor_history"
+    __table_args__ = (
+        # Truy vấn lịch sử luôn lọc theo thiết bị + khoảng thời gian
+        Index("ix_sensor_history_device_ts", "device_id", "timestamp"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
+    device_id = Column(String, nullable=False, server_default=settings.DEFAULT_DEVICE_ID)
     sensor_value = Column(Integer, nullable=False)  # Giá trị cảm biến ánh sáng
     brightness = Column(Integer, nullable=False)     # Độ sáng đèn tại thời điểm đó
     is_on = Column(Boolean, default=False)           # Trạng thái đèn
     is_auto_mode = Column(Boolean, default=False)    # Chế độ tự động
     timestamp = Column(DateTime, default=datetime.utcnow, index=True)
 
+class _SensorRollupColumns:
+    """Các cột chung của bảng tổng hợp lịch sử (mỗi dòng = một thiết bị trong một khung thời gian)"""
+    device_id = Column(String, primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)   # Thời điểm bắt đầu khung
+    count = Column(Integer, nullable=False, default=0)  # Số mẫu gốc trong khung
+    sensor_min = Column(Integer)
+    sensor_max = Column(Integer)
+    sensor_sum = Column(Integer)
+    brightness_min = Column(Integer)
+    brightness_max = Column(Integer)
+    brightness_sum = Column(Integer)
+    on_count = Column(Integer, default=0)               # Số mẫu có is_on = True
+    on_seconds = Column(Float, default=0.0)             # Tổng thời gian đèn bật (giây)
+
+class SensorRollupMinute(_SensorRollupColumns, Base):
+    """Tổng hợp lịch sử cảm biến theo phút"""
+    __tablename__ = "sensor_rollup_minute"
+
+class SensorRollupHour(_SensorRollupColumns, Base):
+    """Tổng hợp lịch sử cảm biến theo giờ"""
+    __tablename__ = "sensor_rollup_hour"
+
+class SensorRollupDay(_SensorRollupColumns, Base):
+    """Tổng hợp lịch sử cảm biến theo ngày"""
+    __tablename__ = "sensor_rollup_day"
+
 class UserSettings(Base):
     """Bảng lưu cài đặt người dùng (ngưỡng sáng/tối cho chế độ Auto)"""
     __tablename__ = "user_settings"
@@ -1,9 +1,26 @@
 import paho.mqtt.client as mqtt
 import json
+import logging
+import time
 from datetime import datetime
 from .config import settings
-from .database import SessionLocal
-from .models.device import DeviceState, SensorHistory, UserSettings
+from .ingest_service import ingest_pipeline
+from .state_cache import state_cache
+from .broadcast import broadcast_hub
+from .recent_history import recent_history
+from .rule_engine import rule_engine
+from .command_scheduler import command_scheduler
+from .command_tracker import command_tracker
+from .metrics import (
+    MQTT_MESSAGES_RECEIVED, MQTT_MESSAGES_PARSED, MQTT_MESSAGE_ERRORS,
+    MQTT_ON_MESSAGE_SECONDS, MQTT_PUBLISH_SECONDS, MQTT_PAYLOAD_BYTES,
+)
+from .logging_setup import sample
+from .payload_codecs import decode_payload
+from .telemetry_batch import batch_samples
+from .compression import history_compressor
+
+logger = logging.getLogger(__name__)
 
 class MQTTService:
     def __init__(self):
@@ -11,130 +28,125 @@ class MQTTService:
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
         self.connected = False
+        # Lệnh điều khiển đi qua command_scheduler (gộp + giới hạn tần suất) rồi mới tới publish_command
+        command_scheduler.bind_publisher(self.publish_command)
 
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
-            print("Connected to MQTT Broker!")
+            logger.info("Connected to MQTT Broker")
             self.connected = True
-            self.client.subscribe(settings.MQTT_TOPIC_STATUS)
-            print(f"Subscribed to {settings.MQTT_TOPIC_STATUS}")
+            topics = [
+                settings.MQTT_TOPIC_STATUS_WILDCARD, settings.MQTT_TOPIC_STATUS_CODEC_WILDCARD,
+                settings.MQTT_TOPIC_STATUS, settings.MQTT_TOPIC_STATUS_CODEC,
+            ]
+            self.client.subscribe([(topic, 0) for topic in topics])
+            logger.info("Subscribed to %s", ", ".join(topics))
         else:
-            print(f"Failed to connect, return code {rc}")
+            logger.error("Failed to connect, return code %s", rc)
 
-    def on_message(self, client, userdata, msg):
-        try:
-            payload = msg.payload.decode()
-            print(f"[MQTT] Received message from device: {payload}")
-            data = json.loads(payload)
-            
-            db = SessionLocal()
-            try:
-                # === 1. Cập nhật trạng thái thiết bị ===
-                device = db.query(DeviceState).filter(DeviceState.id == 1).first()
-                if not device:
-                    device = DeviceState(id=1)
-                    db.add(device)
-
-                # ... (Các dòng gán device.is_on, brightness... giữ nguyên) ...
-                if "is_on" in data:
-                    device.is_on = data["is_on"]
-                if "brightness" in data:
-                    device.brightness = data["brightness"]
-                if "sensor_value" in data:
-                    device.sensor_value = data["sensor_value"]
-                if "is_auto_mode" in data:
-                    device.is_auto_mode = data["is_auto_mode"]
-                
-                # === SỬA LẠI PHẦN NÀY ===
-                # Thay vì lấy timestamp từ ESP32 (là uptime giả), ta lấy giờ hệ thống của Server
-                # datetime.now() sẽ lấy giờ theo múi giờ máy tính của bạn (Việt Nam)
-                record_time = datetime.now() 
-                
-                # Cập nhật thời gian vào bảng DeviceState
-                device.last_updated = record_time
-                db.commit()
-                print("[MQTT] Device state updated!")
-
-                # === 2. Lưu lịch sử cảm biến ===
-                # Dùng chính record_time vừa tạo để lưu vào lịch sử
-                # Đảm bảo biểu đồ sẽ vẽ đúng thời gian thực tế
-                history = SensorHistory(
-                    sensor_value=device.sensor_value,
-                    brightness=device.brightness,
-                    is_on=device.is_on,
-                    is_auto_mode=device.is_auto_mode,
-                    timestamp=record_time 
-                )
-                db.add(history)
-                db.commit()
-                print(f"[MQTT] Sensor history saved at {record_time}!")
-
-            except Exception as db_err:
-                print(f"[MQTT] Database Error: {db_err}")
-                db.rollback()
-            finally:
-                db.close()
-                
-        except Exception as e:
-            print(f"[MQTT] Error processing message: {e}")
+    @staticmethod
+    def device_id_from_topic(topic: str):
+        """iot/light/<device_id>/status -> device_id; topic cũ iot/light/status -> thiết bị mặc định"""
+        return MQTTService.parse_status_topic(topic)[0]
 
-    def _process_auto_logic(self, db, device: DeviceState):
+    @staticmethod
+    def parse_status_topic(topic: str):
         """
-        LOGIC TỰ ĐỘNG (SỬA ĐỔI):
-        - Server đóng vai trò "Giám sát viên".
-        - Sensor thấp (Trời sáng) -> Server ra lệnh TẮT HẲN.
-        - Sensor cao (Trời tối) -> Server ra lệnh BẬT CHẾ ĐỘ AUTO (để ESP32 tự dimming).
+        -> (device_id, codec): iot/light/<device_id>/status[/<codec>], topic cũ iot/light/status[/<codec>].
+        codec = None khi không có hậu tố (xét byte đầu payload); topic lạ -> (None, None)
         """
+        if topic == settings.MQTT_TOPIC_STATUS:
+            return settings.DEFAULT_DEVICE_ID, None
+        legacy, _, codec = topic.rpartition("/")
+        if legacy == settings.MQTT_TOPIC_STATUS and codec:
+            return settings.DEFAULT_DEVICE_ID, codec
+        parts = topic.split("/")
+        if len(parts) == 4 and parts[3] == "status" and parts[2]:
+            return parts[2], None
+        if len(parts) == 5 and parts[3] == "status" and parts[2] and parts[4]:
+            return parts[2], parts[4]
+        return None, None
+
+    @staticmethod
+    def command_topic(device_id: str = None) -> str:
+        """Thiết bị mặc định vẫn nhận lệnh ở topic cũ để tương thích firmware hiện tại"""
+        if device_id is None or device_id == settings.DEFAULT_DEVICE_ID:
+            return settings.MQTT_TOPIC_COMMAND
+        return settings.MQTT_TOPIC_COMMAND_TEMPLATE.format(device_id=device_id)
+
+    def on_message(self, client, userdata, msg):
+        started = time.perf_counter()
+        MQTT_MESSAGES_RECEIVED.inc()
         try:
-            # 1. Lấy cài đặt ngưỡng từ Database
-            user_settings = db.query(UserSettings).filter(UserSettings.id == 1).first()
-            if not user_settings:
-                # Tạo mặc định nếu chưa có (Dựa trên log thực tế của bạn: 28 là sáng, 1400 là tối)
-                user_settings = UserSettings(
-                    id=1,
-                    light_threshold_low=300,    # Dưới 300 là SÁNG QUÁ -> Cần tắt đèn
-                    light_threshold_high=1200,  # Trên 1200 là TỐI -> Cần bật Auto
-                    auto_brightness=80          
-                )
-                db.add(user_settings)
-                db.commit()
-            
-        
-            sensor_value = device.sensor_value
-            threshold_turn_off = user_settings.light_threshold_low   # Ngưỡng sáng (để tắt)
-            threshold_turn_on = user_settings.light_threshold_high   # Ngưỡng tối (để bật Auto)
-
-            print(f"[AUTO CHECK] Sensor: {sensor_value} | Tắt nếu < {threshold_turn_off} | Bật Auto nếu > {threshold_turn_on}")
-
-            # === TRƯỜNG HỢP 1: TRỜI SÁNG -> TẮT ĐÈN ===
-            # Điều kiện: (Sensor nhỏ hơn ngưỡng thấp) VÀ (Đèn đang bật)
-            if sensor_value < threshold_turn_off and device.is_on:
-                print(f"☀️ [AUTO] Trời sáng (Sensor {sensor_value} < {threshold_turn_off}) -> Gửi lệnh TẮT ĐÈN.")
-                self.publish_command({
-                    "type": "MANUAL",
-                    "state": "OFF",
-                    "brightness": 0
-                })
-            
-            # === TRƯỜNG HỢP 2: TRỜI TỐI -> BẬT CHẾ ĐỘ AUTO ===
-            # Điều kiện: (Sensor lớn hơn ngưỡng cao) VÀ (Đèn đang tắt HOẶC Đang không ở chế độ Auto)
-            # Nếu đèn đang sáng và đang ở Auto rồi thì cứ để ESP32 tự chỉnh, Server không cần can thiệp nữa.
-            elif sensor_value > threshold_turn_on and (not device.is_on or not device.is_auto_mode):
-                print(f"🌙 [AUTO] Trời tối (Sensor {sensor_value} > {threshold_turn_on}) -> Kích hoạt ESP32 AUTO MODE.")
-                
-                # Gửi lệnh kích hoạt chế độ Auto cho ESP32
-                # ESP32 sẽ tự tính toán map(sensor) ra độ sáng phù hợp
-                self.publish_command({
-                    "type": "AUTO",
-                    "enable": True
-                })
+            device_id, codec_name = self.parse_status_topic(msg.topic)
+            if device_id is None:
+                if sample("mqtt.unknown_topic"):
+                    logger.warning("Ignoring message on unknown topic", extra={"topic": msg.topic})
+                return
 
-            # === TRƯỜNG HỢP 3: VÙNG GIỮA (HYSTERESIS) ===
+            # Giải mã thẳng trên bytes của paho (JSON mặc định, nhị phân theo hậu tố topic/byte đầu)
+            codec, data = decode_payload(msg.payload, codec_name)
+            MQTT_MESSAGES_PARSED.inc(labels=(codec.name,))
+            MQTT_PAYLOAD_BYTES.inc(len(msg.payload), (codec.name,))
+
+            if isinstance(data, dict) and "samples" in data:
+                # Bản tin nhiều mẫu (thiết bị gửi bù dữ liệu đệm): giờ của từng mẫu lấy theo đồng hồ
+                # thiết bị đã hiệu chỉnh độ lệch, chỉ mẫu mới nhất cập nhật trạng thái thiết bị
+                samples = batch_samples(device_id, data, time.time())
+                rows, state = state_cache.apply_samples(device_id, samples)
+                record_time = rows[-1][0]
+                stored = history_compressor.offer(device_id, rows)
+                queued = ingest_pipeline.submit(device_id, state, record_time, rows, stored)
+                if queued:
+                    recent_history.extend(device_id, rows if stored is None else stored)
+                if state is not None:
+                    command_tracker.acknowledge(device_id, dict(state, cid=data.get("cid")))
             else:
-                print(f"⚖️ [AUTO] Giữ nguyên trạng thái (Sensor nằm trong vùng đệm hoặc trạng thái đã đúng).")
+                # Bản tin status có thể là phản hồi của lệnh đang chờ xác nhận
+                command_tracker.acknowledge(device_id, data)
+
+                # Thay vì lấy timestamp từ ESP32 (là uptime giả), ta lấy giờ hệ thống của Server
+                # datetime.now() sẽ lấy giờ theo múi giờ máy tính của bạn (Việt Nam)
+                record_time = datetime.now()
+
+                # Cache trong bộ nhớ được cập nhật ngay (API đọc từ đây), còn DB thì không ghi
+                # trên thread của paho: đẩy vào hàng đợi ghi trễ, thread writer sẽ cập nhật
+                # DeviceState và lưu SensorHistory theo lô.
+                state = state_cache.apply_telemetry(device_id, data, record_time)
+                stored = history_compressor.offer(device_id, ((record_time, state),))
+                queued = ingest_pipeline.submit(device_id, state, record_time, stored=stored)
+                # Vòng đệm chỉ nhận những gì sẽ được ghi: bỏ qua bản tin bị drop và mẫu bị nén bỏ
+                if queued and stored is None:
+                    recent_history.append(device_id, state, record_time)
+                elif queued and stored:
+                    recent_history.extend(device_id, stored)
+
+            if not queued and sample("mqtt.ingest_full"):
+                logger.warning("Ingest queue full, message dropped", extra={"device": device_id})
+            if state is None:
+                # Cả lô cũ hơn trạng thái hiện tại: chỉ bổ sung lịch sử
+                return
+            broadcast_hub.publish(state)
+
+            # Luật tự động chạy trên trạng thái trong bộ nhớ, không truy vấn DB
+            command = rule_engine.evaluate(device_id, state, record_time)
+            if command is not None:
+                logger.info("Auto rule: sensor %s -> %s", state["sensor_value"], command, extra={"device": device_id})
+                command_scheduler.submit(device_id, command)
+
+            # Log từng bản tin chỉ khi bật DEBUG, và chỉ lấy mẫu 1/LOG_SAMPLE_EVERY
+            if logger.isEnabledFor(logging.DEBUG) and sample("mqtt.message"):
+                logger.debug("Status %s", data, extra={
+                    "device": device_id, "topic": msg.topic,
+                    "latency_ms": round((time.perf_counter() - started) * 1000, 3),
+                })
 
         except Exception as e:
-            print(f"❌ [AUTO] Lỗi logic tự động: {e}")
+            MQTT_MESSAGE_ERRORS.inc()
+            if sample("mqtt.error"):
+                logger.warning("Error processing message: %s", e, extra={"topic": msg.topic})
+        finally:
+            MQTT_ON_MESSAGE_SECONDS.observe(time.perf_counter() - started)
 
     def connect(self):
         try:
@@ -147,17 +159,26 @@ class MQTTService:
             # Kết nối vào Broker
             self.client.connect(settings.MQTT_BROKER, settings.MQTT_PORT, 60)
             self.client.loop_start()
-            print(f"✅ [MQTT] Connected to {settings.MQTT_BROKER}:{settings.MQTT_PORT}")
+            logger.info("✅ Connected to %s:%s", settings.MQTT_BROKER, settings.MQTT_PORT)
             
         except Exception as e:
-            print(f"❌ [MQTT] Could not connect to Broker: {e}")
+            logger.error("❌ Could not connect to Broker: %s", e)
 
-    def publish_command(self, payload: dict):
+    def publish_command(self, payload: dict, device_id: str = None):
         if not self.connected:
-            print("[MQTT] Not connected, attempting to reconnect...")
+            logger.warning("Not connected, attempting to reconnect...")
         
+        topic = self.command_topic(device_id)
+        # Gắn correlation ID để đo độ trễ tới khi thiết bị báo trạng thái mới
+        payload = command_tracker.track(payload, device_id or settings.DEFAULT_DEVICE_ID)
         message = json.dumps(payload)
-        self.client.publish(settings.MQTT_TOPIC_COMMAND, message)
-        print(f"[MQTT] Published: {message} to {settings.MQTT_TOPIC_COMMAND}")
+        started = time.perf_counter()
+        self.client.publish(topic, message)
+        elapsed = time.perf_counter() - started
+        MQTT_PUBLISH_SECONDS.observe(elapsed)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Published %s", message, extra={
+                "device": device_id, "topic": topic, "latency_ms": round(elapsed * 1000, 3),
+            })
 
 mqtt_service = MQTTService()
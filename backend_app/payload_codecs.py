@@ -0,0 +1,142 @@
+import json
+import struct
+
+# Thư viện tùy chọn: thiếu thì codec tương ứng không được đăng ký, bản tin dùng nó bị báo lỗi
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+# Bit trong byte cờ của định dạng struct
+FLAG_ON = 1
+FLAG_AUTO = 2
+
+
+class PayloadCodec:
+    """
+    Một định dạng payload của bản tin status.
+    name: hậu tố topic (iot/light/<id>/status/<name>); format_byte: byte đầu payload (None = không có).
+    decode nhận bytes hoặc memoryview, không copy lại buffer của paho nếu thư viện cho phép.
+    """
+    name = None
+    format_byte = None
+
+    def decode(self, buf) -> dict:
+        raise NotImplementedError
+
+    def encode(self, data: dict) -> bytes:
+        raise NotImplementedError
+
+
+class JsonCodec(PayloadCodec):
+    """Mặc định, tương thích firmware hiện tại"""
+    name = "json"
+
+    def decode(self, buf) -> dict:
+        # str(buf, "utf-8") đọc thẳng bytes/memoryview; json.loads(bytes) chậm hơn vì phải dò encoding
+        return json.loads(str(buf, "utf-8"))
+
+    def encode(self, data: dict) -> bytes:
+        return json.dumps(data, separators=(",", ":")).encode()
+
+
+class StructCodec(PayloadCodec):
+    """
+    Bố cục cố định 4 byte, little-endian: cờ (bit 0 is_on, bit 1 is_auto_mode), brightness (uint8),
+    sensor_value (uint16). Đọc bằng unpack_from trực tiếp trên buffer.
+    """
+    name = "struct"
+    format_byte = 0x01
+    layout = struct.Struct("<BBH")
+
+    def decode(self, buf) -> dict:
+        if len(buf) != self.layout.size:
+            raise ValueError(f"struct payload must be {self.layout.size} bytes, got {len(buf)}")
+        flags, brightness, sensor_value = self.layout.unpack_from(buf)
+        return {
+            "is_on": bool(flags & FLAG_ON),
+            "brightness": brightness,
+            "sensor_value": sensor_value,
+            "is_auto_mode": bool(flags & FLAG_AUTO),
+        }
+
+    def encode(self, data: dict) -> bytes:
+        flags = (FLAG_ON if data["is_on"] else 0) | (FLAG_AUTO if data["is_auto_mode"] else 0)
+        return self.layout.pack(flags, data["brightness"], data["sensor_value"])
+
+
+class MsgpackCodec(PayloadCodec):
+    """MessagePack (pip install msgpack): unpackb đọc thẳng memoryview"""
+    name = "msgpack"
+    format_byte = 0x02
+
+    def decode(self, buf) -> dict:
+        return msgpack.unpackb(buf)
+
+    def encode(self, data: dict) -> bytes:
+        return msgpack.packb(data)
+
+
+class CborCodec(PayloadCodec):
+    """CBOR (pip install cbor2)"""
+    name = "cbor"
+    format_byte = 0x03
+
+    def decode(self, buf) -> dict:
+        return cbor2.loads(buf)
+
+    def encode(self, data: dict) -> bytes:
+        return cbor2.dumps(data)
+
+
+JSON_CODEC = JsonCodec()
+CODECS = {codec.name: codec for codec in (
+    JSON_CODEC,
+    StructCodec(),
+    *((MsgpackCodec(),) if msgpack is not None else ()),
+    *((CborCodec(),) if cbor2 is not None else ()),
+)}
+# Byte đầu < 0x20 (trừ khoảng trắng JSON) là byte định dạng; JSON luôn bắt đầu bằng '{', '[' hoặc khoảng trắng
+_BY_FORMAT_BYTE = {codec.format_byte: codec for codec in CODECS.values() if codec.format_byte is not None}
+_KNOWN_FORMAT_BYTES = {MsgpackCodec.format_byte: "msgpack", CborCodec.format_byte: "cbor"}
+
+
+def get_codec(name: str) -> PayloadCodec:
+    codec = CODECS.get(name)
+    if codec is None:
+        raise ValueError(f"payload codec '{name}' is not available")
+    return codec
+
+
+def decode_payload(payload, codec_name: str = None):
+    """
+    Giải mã payload status -> (codec, data).
+    codec_name lấy từ hậu tố topic; không có thì xét byte đầu, mặc định JSON.
+    """
+    if codec_name is not None:
+        codec = get_codec(codec_name)
+        return codec, codec.decode(payload)
+    if payload:
+        first = payload[0]
+        if first == 0x7B:     # '{': JSON, trường hợp phổ biến nhất
+            return JSON_CODEC, json.loads(str(payload, "utf-8"))
+        codec = _BY_FORMAT_BYTE.get(first)
+        if codec is not None:
+            # Bỏ byte định dạng bằng memoryview: không copy phần còn lại
+            return codec, codec.decode(memoryview(payload)[1:])
+        if first in _KNOWN_FORMAT_BYTES:
+            raise ValueError(f"payload codec '{_KNOWN_FORMAT_BYTES[first]}' is not available")
+    return JSON_CODEC, JSON_CODEC.decode(payload)
+
+
+def encode_payload(data: dict, codec_name: str = "json", format_byte: bool = True) -> bytes:
+    """Mã hóa bản tin status (giả lập thiết bị, benchmark); format_byte=False khi chọn codec bằng hậu tố topic"""
+    codec = get_codec(codec_name)
+    body = codec.encode(data)
+    if format_byte and codec.format_byte is not None:
+        return bytes((codec.format_byte,)) + body
+    return body
@@ -0,0 +1,260 @@
+import logging
+import threading
+from itertools import chain
+import numpy as np
+from datetime import datetime, timedelta
+from sqlalchemy import select, func, cast, Integer
+from .config import settings
+from .models.device import SensorHistory
+from .downsampling import to_epoch
+
+logger = logging.getLogger(__name__)
+
+# Bit trong cột flags
+FLAG_ON = 1
+FLAG_AUTO = 2
+
+# Epoch chính xác tới micro giây (julianday chỉ chính xác cỡ 0.1 ms, lệch biên khoảng [start, end)):
+# phần giây từ strftime('%s'), phần lẻ đọc thẳng từ chuỗi "YYYY-MM-DD HH:MM:SS.ffffff" SQLAlchemy lưu
+_EXACT_EPOCH = (
+    cast(func.strftime("%s", SensorHistory.timestamp), Integer)
+    + cast(func.substr(SensorHistory.timestamp, 21, 6), Integer) / 1e6
+)
+_WARM_COLUMNS = (
+    SensorHistory.device_id, _EXACT_EPOCH, SensorHistory.sensor_value, SensorHistory.brightness,
+    SensorHistory.is_on, SensorHistory.is_auto_mode,
+)
+
+# Kích thước ban đầu của vòng đệm mỗi thiết bị, nhân đôi khi đầy cho tới capacity
+_INITIAL_SIZE = 64
+
+
+class _Ring:
+    """Vòng đệm của một thiết bị: các mảng cột kiểu cố định, mẫu cũ nhất nằm ở vị trí head"""
+    __slots__ = ("ts", "sensor_value", "brightness", "flags", "head", "size", "complete_since")
+
+    def __init__(self, size: int, complete_since: float):
+        self.ts = np.empty(size, dtype=np.float64)
+        self.sensor_value = np.empty(size, dtype=np.int32)
+        self.brightness = np.empty(size, dtype=np.int16)
+        self.flags = np.empty(size, dtype=np.uint8)
+        self.head = 0
+        self.size = 0
+        # Mọi mẫu có ts >= mốc này đều đang nằm trong vòng đệm
+        self.complete_since = complete_since
+
+    @classmethod
+    def filled(cls, columns: tuple, complete_since: float, capacity: int):
+        """Vòng đệm chứa sẵn các cột (đã sắp xếp theo ts), chỉ giữ capacity mẫu mới nhất"""
+        n = columns[0].size
+        keep = min(n, capacity)
+        ring = cls(max(min(_INITIAL_SIZE, capacity), keep), complete_since)
+        for target, column in zip(ring.columns(), columns):
+            target[:keep] = column[n - keep:]
+        ring.size = keep
+        if keep < n:
+            ring.complete_since = max(complete_since, float(ring.ts[0])) if complete_since is not None else None
+        return ring
+
+    def columns(self):
+        return self.ts, self.sensor_value, self.brightness, self.flags
+
+    def ordered_columns(self, lo: int = 0, hi: int = None) -> tuple:
+        positions = self.positions(lo, self.size if hi is None else hi)
+        return tuple(column[positions] for column in self.columns())
+
+    def resize(self, size: int):
+        positions = self.positions(0, self.size)
+        old = self.columns()
+        self.ts, self.sensor_value, self.brightness, self.flags = (
+            np.empty(size, dtype=column.dtype) for column in old
+        )
+        for new, column in zip(self.columns(), old):
+            new[:self.size] = column[positions]
+        self.head = 0
+
+    def append(self, ts: float, sensor_value: int, brightness: int, flags: int, capacity: int):
+        size = self.ts.size
+        if self.size == size and size < capacity:
+            self.resize(min(size * 2, capacity))
+            size = self.ts.size
+        i = (self.head + self.size) % size
+        self.ts[i] = ts
+        self.sensor_value[i] = sensor_value
+        self.brightness[i] = brightness
+        self.flags[i] = flags
+        if self.size == size:
+            # Đầy: vừa ghi đè mẫu cũ nhất, vòng đệm giờ chỉ đầy đủ từ mẫu cũ nhất còn lại
+            self.head = (self.head + 1) % size
+            self.complete_since = float(self.ts[self.head])
+        else:
+            self.size += 1
+
+    def positions(self, lo: int, hi: int) -> np.ndarray:
+        """Chỉ số logic [lo, hi) (0 = mẫu cũ nhất) -> chỉ số thật trong mảng"""
+        return (self.head + np.arange(lo, hi)) % max(self.ts.size, 1)
+
+    def ordered_ts(self) -> np.ndarray:
+        end = self.head + self.size
+        if end <= self.ts.size:
+            return self.ts[self.head:end]
+        return np.concatenate((self.ts[self.head:], self.ts[:end - self.ts.size]))
+
+
+class RecentHistoryBuffer:
+    """
+    Lịch sử cảm biến gần đây của từng thiết bị trong bộ nhớ (ring buffer numpy, ~15 byte/mẫu).
+    - on_message ghi thêm ngay các mẫu đã vào hàng đợi ingest và sẽ được lưu (sau khi nén),
+      không đợi ghi xuống DB -> vòng đệm luôn chứa đúng những gì sensor_history có.
+    - Khởi động: nạp horizon_hours gần nhất từ DB (warm), tối đa warm_rows mẫu cho cả hệ thống.
+    - series() trả về chuỗi dạng downsampling cho khoảng thời gian nằm trọn trong vòng đệm,
+      ngược lại trả về None để caller đọc SQLite.
+    """
+
+    def __init__(self, capacity: int, horizon_hours: float, warm_rows: int):
+        self._capacity = max(1, capacity)
+        self._warm_rows = max(1, warm_rows)
+        self._horizon = timedelta(hours=horizon_hours)
+        self._rings = {}            # device_id -> _Ring
+        self._since = None          # Mốc warm: trước khi warm không phục vụ truy vấn nào
+        self._lock = threading.Lock()
+
+        # Thống kê
+        self.hits = 0
+        self.misses = 0
+
+    def warm(self, db):
+        """
+        Nạp lịch sử trong horizon của mọi thiết bị bằng một truy vấn (gọi lúc khởi động, trước khi
+        nhận MQTT). Quá warm_rows mẫu thì chỉ giữ các mẫu mới nhất, mốc đầy đủ lùi lên theo.
+        """
+        start = datetime.now() - self._horizon
+        since = to_epoch(start)
+        rows = db.execute(
+            select(*_WARM_COLUMNS).where(SensorHistory.timestamp >= start)
+            .order_by(SensorHistory.timestamp.desc()).limit(self._warm_rows)
+        ).all()
+        rows.reverse()
+        if len(rows) == self._warm_rows:
+            # Mọi mẫu sau mẫu cũ nhất đã nạp đều có mặt (mẫu cùng thời điểm có thể bị cắt)
+            since = max(since, float(np.nextafter(rows[0][1], np.inf)))
+
+        codes = {}
+        device_codes = np.fromiter(
+            (codes.setdefault(row[0], len(codes)) for row in rows), dtype=np.int64, count=len(rows)
+        )
+        width = len(_WARM_COLUMNS) - 1
+        matrix = np.fromiter(
+            chain.from_iterable(row[1:] for row in rows), dtype=np.float64, count=len(rows) * width
+        ).reshape(len(rows), width)
+        # Tách theo thiết bị, giữ thứ tự thời gian trong mỗi thiết bị
+        order = np.argsort(device_codes, kind="stable")
+        bounds = np.searchsorted(device_codes[order], np.arange(len(codes) + 1))
+        rings = {}
+        for device_id, code in codes.items():
+            ts, sensor_value, brightness, is_on, is_auto_mode = matrix[order[bounds[code]:bounds[code + 1]]].T
+            rings[device_id] = _Ring.filled(
+                (ts, sensor_value, brightness, is_on * FLAG_ON + is_auto_mode * FLAG_AUTO), since, self._capacity
+            )
+        with self._lock:
+            self._rings = rings
+            self._since = since
+        logger.info("Recent history warmed", extra={"count": len(rows), "devices": len(rings)})
+
+    def append(self, device_id: str, state: dict, record_time: datetime):
+        """Ghi thêm một mẫu (gọi trên thread của paho)"""
+        flags = (FLAG_ON if state["is_on"] else 0) | (FLAG_AUTO if state["is_auto_mode"] else 0)
+        ts = to_epoch(record_time)
+        with self._lock:
+            ring = self._rings.get(device_id)
+            if ring is None:
+                # Thiết bị mới: không có mẫu nào trước thời điểm này
+                ring = self._rings[device_id] = _Ring(min(_INITIAL_SIZE, self._capacity), self._since)
+            ring.append(ts, state["sensor_value"], state["brightness"], flags, self._capacity)
+
+    def extend(self, device_id: str, samples: list):
+        """
+        Ghi thêm lô mẫu [(record_time, state)] đã sắp xếp (bản tin nhiều mẫu). Lô cũ hơn mẫu cuối
+        trong vòng đệm (gửi bù sau khi mất kết nối) được trộn vào đúng vị trí theo thời gian.
+        """
+        if not samples:
+            return
+        ts = np.array([to_epoch(record_time) for record_time, _ in samples], dtype=np.float64)
+        sensor_value = np.array([s["sensor_value"] for _, s in samples], dtype=np.int32)
+        brightness = np.array([s["brightness"] for _, s in samples], dtype=np.int16)
+        flags = np.array([(FLAG_ON if s["is_on"] else 0) | (FLAG_AUTO if s["is_auto_mode"] else 0)
+                          for _, s in samples], dtype=np.uint8)
+        with self._lock:
+            ring = self._rings.get(device_id)
+            if ring is None:
+                ring = self._rings[device_id] = _Ring(min(_INITIAL_SIZE, self._capacity), self._since)
+            if ring.size == 0 or ts[0] >= ring.ts[(ring.head + ring.size - 1) % ring.ts.size]:
+                for i in range(ts.size):
+                    ring.append(ts[i], sensor_value[i], brightness[i], flags[i], self._capacity)
+                return
+            merged = tuple(
+                np.concatenate((old, new))
+                for old, new in zip(ring.ordered_columns(), (ts, sensor_value, brightness, flags))
+            )
+            order = np.argsort(merged[0], kind="stable")
+            self._rings[device_id] = _Ring.filled(
+                tuple(column[order] for column in merged), ring.complete_since, self._capacity
+            )
+
+    def series(self, device_id: str, start: datetime, end: datetime = None):
+        """Chuỗi mảng cột (không có id) trong [start, end), hoặc None nếu vòng đệm không phủ hết khoảng này"""
+        start_ts = to_epoch(start)
+        with self._lock:
+            ring = self._rings.get(device_id)
+            complete_since = ring.complete_since if ring is not None else self._since
+            if complete_since is None or start_ts < complete_since:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if ring is None or ring.size == 0:
+                columns = (np.empty(0), np.empty(0, np.int32), np.empty(0, np.int16), np.empty(0, np.uint8))
+            else:
+                ts = ring.ordered_ts()
+                lo = int(np.searchsorted(ts, start_ts, side="left"))
+                hi = ts.size if end is None else int(np.searchsorted(ts, to_epoch(end), side="left"))
+                columns = ring.ordered_columns(lo, max(lo, hi))
+
+        ts, sensor_value, brightness, flags = columns
+        return {
+            "ts": ts.astype(np.float64),
+            "sensor_value": sensor_value.astype(np.float64),
+            "brightness": brightness.astype(np.float64),
+            "is_on": (flags & FLAG_ON).astype(np.float64),
+            "is_auto_mode": ((flags & FLAG_AUTO) >> 1).astype(np.float64),
+        }
+
+    def discard(self, device_id: str = None, cutoff: datetime = None):
+        """Bỏ các mẫu trước cutoff (None = tất cả) của một thiết bị hoặc mọi thiết bị, đi cùng job xóa lịch sử"""
+        cutoff_ts = to_epoch(cutoff) if cutoff is not None else None
+        with self._lock:
+            targets = [device_id] if device_id is not None else list(self._rings)
+            for target in targets:
+                ring = self._rings.get(target)
+                if ring is None:
+                    continue
+                lo = ring.size if cutoff_ts is None else int(np.searchsorted(ring.ordered_ts(), cutoff_ts))
+                self._rings[target] = _Ring.filled(ring.ordered_columns(lo), ring.complete_since, self._capacity)
+
+    def stats(self) -> dict:
+        with self._lock:
+            samples = sum(r.size for r in self._rings.values())
+            nbytes = sum(sum(c.nbytes for c in r.columns()) for r in self._rings.values())
+        return {
+            "devices": len(self._rings),
+            "samples": samples,
+            "bytes": nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+recent_history = RecentHistoryBuffer(
+    capacity=settings.RECENT_HISTORY_CAPACITY,
+    horizon_hours=settings.RECENT_HISTORY_HOURS,
+    warm_rows=settings.RECENT_HISTORY_WARM_ROWS,
+)
@@ -0,0 +1,261 @@
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import text, bindparam, DateTime
+from .config import settings
+from .database import SessionLocal, engine, write_engine
+from .models.device import SensorHistory, SensorRollupMinute, SensorRollupHour, SensorRollupDay
+from .state_cache import state_cache
+from .recent_history import recent_history
+from .analytics import usage_analytics
+from .metrics import DB_COMMIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# (bảng, cột thời gian, số ngày giữ lại) - 0 ngày = giữ vĩnh viễn
+RETENTION_POLICIES = (
+    (SensorHistory.__tablename__, "timestamp", settings.RETENTION_RAW_DAYS),
+    (SensorRollupMinute.__tablename__, "bucket_start", settings.RETENTION_MINUTE_ROLLUP_DAYS),
+    (SensorRollupHour.__tablename__, "bucket_start", settings.RETENTION_HOUR_ROLLUP_DAYS),
+    (SensorRollupDay.__tablename__, "bucket_start", settings.RETENTION_DAY_ROLLUP_DAYS),
+)
+
+AUTO_VACUUM_INCREMENTAL = 2
+MAX_FINISHED_JOBS = 100
+
+
+def auto_vacuum_mode() -> int:
+    with engine.connect() as conn:
+        return conn.exec_driver_sql("PRAGMA auto_vacuum").scalar()
+
+
+def compact():
+    """VACUUM toàn bộ file DB (khóa DB trong lúc chạy) và chuyển sang auto_vacuum=INCREMENTAL."""
+    with write_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.exec_driver_sql("VACUUM")
+
+
+class RetentionEngine:
+    """
+    Dọn dữ liệu cũ trên thread nền, không chặn ingest:
+    - Xóa theo lô nhỏ (mỗi lô một transaction ngắn), nghỉ giữa các lô để writer của ingest
+      giành được khóa ghi của SQLite.
+    - Định kỳ áp dụng RETENTION_POLICIES; các job xóa do API yêu cầu được xếp hàng và chạy
+      trên cùng thread, nên không bao giờ có 2 tác vụ xóa lớn chạy song song.
+    - Sau khi xóa, trả dung lượng trống về hệ điều hành bằng incremental vacuum theo từng bước.
+    """
+
+    def __init__(self, interval: float, batch_size: int, batch_pause: float, vacuum_pages: int):
+        self._interval = interval
+        self._batch_size = batch_size
+        self._batch_pause = batch_pause
+        self._vacuum_pages = vacuum_pages
+        self._jobs = queue.Queue()
+        self._job_status = OrderedDict()   # job_id -> dict trạng thái
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._warned_vacuum = False
+
+        # Thống kê
+        self.runs = 0
+        self.deleted_rows = 0
+        self.vacuumed_pages = 0
+        self.last_run = None
+        self.last_run_ms = 0.0
+
+    # ============ API cho router ============
+    def schedule_delete(self, device_id: str = None, keep_hours: int = 0) -> dict:
+        """Xếp hàng một job xóa lịch sử (và rollup tương ứng), trả về trạng thái ban đầu của job."""
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "status": "pending",
+            "device_id": device_id,
+            "keep_hours": keep_hours,
+            "deleted_records": 0,
+            "created_at": datetime.now(),
+            "finished_at": None,
+            "error": None,
+        }
+        with self._lock:
+            self._job_status[job["job_id"]] = job
+            self._trim_jobs()
+        self._jobs.put(job["job_id"])
+        return dict(job)
+
+    def get_job(self, job_id: str):
+        with self._lock:
+            job = self._job_status.get(job_id)
+            return dict(job) if job is not None else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = sum(1 for j in self._job_status.values() if j["status"] in ("pending", "running"))
+        return {
+            "runs": self.runs,
+            "deleted_rows": self.deleted_rows,
+            "vacuumed_pages": self.vacuumed_pages,
+            "pending_jobs": pending,
+            "last_run": self.last_run,
+            "last_run_ms": round(self.last_run_ms, 3),
+        }
+
+    # ============ Vòng đời ============
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop_event.set()
+        self._jobs.put(None)  # Đánh thức thread nếu đang chờ
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    # ============ Thread nền ============
+    def _run(self):
+        next_policy_run = time.monotonic()
+        while not self._stop_event.is_set():
+            try:
+                job_id = self._jobs.get(timeout=max(next_policy_run - time.monotonic(), 0))
+            except queue.Empty:
+                job_id = None
+
+            try:
+                if job_id is not None:
+                    self._run_job(job_id)
+                elif time.monotonic() >= next_policy_run:
+                    self.apply_policies()
+                    next_policy_run = time.monotonic() + self._interval
+            except Exception as e:
+                logger.error("Error: %s", e)
+
+    def _run_job(self, job_id: str):
+        with self._lock:
+            job = self._job_status.get(job_id)
+            if job is None:
+                return
+            job["status"] = "running"
+        try:
+            cutoff = datetime.now() - timedelta(hours=job["keep_hours"]) if job["keep_hours"] > 0 else None
+            recent_history.discard(job["device_id"], cutoff)
+            usage_analytics.invalidate(job["device_id"])
+            deleted = self.delete_batched(SensorHistory.__tablename__, "timestamp", cutoff, job["device_id"])
+            with self._lock:
+                job["deleted_records"] = deleted
+            for table, column, _ in RETENTION_POLICIES[1:]:
+                self.delete_batched(table, column, cutoff, job["device_id"])
+            with SessionLocal() as db:
+                state_cache.reload_history_counts(db, job["device_id"])
+            state_cache.history_deleted(job["device_id"])
+            self.vacuum()
+            # Bị dừng giữa chừng (server tắt) thì job chưa xóa hết
+            status, error = ("interrupted", None) if self._stop_event.is_set() else ("done", None)
+        except Exception as e:
+            logger.error("Job failed: %s", e, extra={"job": job_id})
+            status, error = "failed", str(e)
+        with self._lock:
+            job.update(status=status, error=error, finished_at=datetime.now())
+
+    def apply_policies(self):
+        """Xóa dữ liệu quá hạn theo RETENTION_POLICIES rồi incremental vacuum."""
+        started = time.perf_counter()
+        now = datetime.now()
+        deleted = 0
+        for table, column, days in RETENTION_POLICIES:
+            if days > 0:
+                deleted += self.delete_batched(table, column, now - timedelta(days=days))
+        if deleted:
+            state_cache.history_deleted()
+        self.vacuum()
+        self.runs += 1
+        self.last_run = now
+        self.last_run_ms = (time.perf_counter() - started) * 1000
+        if deleted:
+            logger.info("Removed expired rows", extra={"count": deleted, "latency_ms": round(self.last_run_ms)})
+        return deleted
+
+    # ============ Xóa theo lô / vacuum ============
+    def delete_batched(self, table: str, column: str, cutoff: datetime = None, device_id: str = None) -> int:
+        """
+        Xóa các dòng có column < cutoff (và thuộc device_id nếu có), mỗi lần tối đa batch_size dòng
+        chọn qua index thời gian. Trả về tổng số dòng đã xóa.
+        """
+        conditions = []
+        params = {"limit": self._batch_size}
+        if cutoff is not None:
+            conditions.append(f"{column} < :cutoff")
+            params["cutoff"] = cutoff
+        if device_id is not None:
+            conditions.append("device_id = :device_id")
+            params["device_id"] = device_id
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        stmt = text(
+            f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} {where} LIMIT :limit)"
+        )
+        if cutoff is not None:
+            # Cùng định dạng chuỗi với cột DateTime mà SQLAlchemy ghi
+            stmt = stmt.bindparams(bindparam("cutoff", type_=DateTime))
+
+        total = 0
+        while not self._stop_event.is_set():
+            with DB_COMMIT_SECONDS.time(("retention",)), write_engine.begin() as conn:
+                deleted = conn.execute(stmt, params).rowcount
+            total += deleted
+            self.deleted_rows += deleted
+            if deleted < self._batch_size:
+                break
+            time.sleep(self._batch_pause)
+        return total
+
+    def vacuum(self) -> int:
+        """Trả các trang trống về hệ điều hành theo từng bước nhỏ (cần auto_vacuum=INCREMENTAL)."""
+        if auto_vacuum_mode() != AUTO_VACUUM_INCREMENTAL:
+            if not self._warned_vacuum:
+                logger.warning("auto_vacuum is not INCREMENTAL, run compact_db.py once to reclaim space")
+                self._warned_vacuum = True
+            return 0
+
+        freed = 0
+        previous = None
+        while not self._stop_event.is_set():
+            # Mượn connection ghi cho từng bước, trả lại trong lúc nghỉ để ingest được ghi xen kẽ
+            conn = write_engine.raw_connection()
+            try:
+                cursor = conn.cursor()
+                free_pages = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+                cursor.close()
+                if free_pages == 0 or (previous is not None and free_pages >= previous):
+                    break
+                previous = free_pages
+                step = min(free_pages, self._vacuum_pages)
+                # sqlite3 execute() chỉ chạy một bước của pragma (= 1 trang), executescript chạy hết
+                conn.driver_connection.executescript(f"PRAGMA incremental_vacuum({step})")
+            finally:
+                conn.close()
+            freed += step
+            self.vacuumed_pages += step
+            time.sleep(self._batch_pause)
+        return freed
+
+    def _trim_jobs(self):
+        """Giữ tối đa MAX_FINISHED_JOBS job đã kết thúc (gọi khi đã giữ lock)."""
+        finished = [j for j, v in self._job_status.items() if v["status"] in ("done", "failed", "interrupted")]
+        for job_id in finished[:max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+            del self._job_status[job_id]
+
+
+retention_engine = RetentionEngine(
+    interval=settings.RETENTION_INTERVAL,
+    batch_size=settings.RETENTION_BATCH_SIZE,
+    batch_pause=settings.RETENTION_BATCH_PAUSE,
+    vacuum_pages=settings.RETENTION_VACUUM_PAGES,
+)
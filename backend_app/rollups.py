@@ -0,0 +1,278 @@
+import math
+from datetime import datetime, timedelta
+from itertools import chain
+import numpy as np
+from sqlalchemy import select, func, delete, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from .config import settings
+from .models.device import SensorHistory, SensorRollupMinute, SensorRollupHour, SensorRollupDay
+from .downsampling import to_epoch
+
+# (độ dài khung - giây, model, định dạng đầu khung giống cách SQLAlchemy lưu DateTime trong SQLite)
+ROLLUP_LEVELS = (
+    (60, SensorRollupMinute, "%Y-%m-%d %H:%M:00.000000"),
+    (3600, SensorRollupHour, "%Y-%m-%d %H:00:00.000000"),
+    (86400, SensorRollupDay, "%Y-%m-%d 00:00:00.000000"),
+)
+
+ROLLUP_FIELDS = (
+    "ts", "count", "sensor_min", "sensor_max", "sensor_sum",
+    "brightness_min", "brightness_max", "brightness_sum", "on_count", "on_seconds",
+)
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def floor_time(ts: datetime, seconds: int) -> datetime:
+    return _EPOCH + timedelta(seconds=(to_epoch(ts) // seconds) * seconds)
+
+
+class RollupAggregator:
+    """
+    Cập nhật tăng dần các bảng rollup (phút/giờ/ngày) cho mỗi lô lịch sử mà ingest writer ghi,
+    trong CÙNG transaction với dữ liệu gốc.
+    on_seconds: khoảng thời gian từ một mẫu tới mẫu kế tiếp (nếu đèn đang bật và khoảng cách
+    không quá ROLLUP_MAX_GAP_SECONDS), tính vào khung của mẫu trước.
+    """
+
+    def __init__(self, max_gap_seconds: float):
+        self._max_gap = max_gap_seconds
+        self._last = {}  # device_id -> (timestamp, is_on) của mẫu mới nhất đã tổng hợp
+
+    def warm(self, db):
+        """Nạp mẫu mới nhất của mỗi thiết bị để tính on_seconds liền mạch sau khi khởi động lại"""
+        latest = select(
+            SensorHistory.device_id, func.max(SensorHistory.timestamp).label("ts")
+        ).group_by(SensorHistory.device_id).subquery()
+        rows = db.execute(
+            select(SensorHistory.device_id, SensorHistory.timestamp, SensorHistory.is_on).join(
+                latest,
+                (SensorHistory.device_id == latest.c.device_id) & (SensorHistory.timestamp == latest.c.ts),
+            )
+        ).all()
+        self._last = {device_id: (ts, bool(is_on)) for device_id, ts, is_on in rows}
+
+    def apply(self, db, history_rows: list):
+        """Gộp các dòng lịch sử vào rollup bằng INSERT ... ON CONFLICT DO UPDATE. Caller commit."""
+        acc = {}  # (level_seconds, device_id, bucket_start) -> dict giá trị cộng dồn
+
+        def entry(seconds, device_id, ts):
+            key = (seconds, device_id, floor_time(ts, seconds))
+            item = acc.get(key)
+            if item is None:
+                item = acc[key] = {
+                    "device_id": device_id, "bucket_start": key[2], "count": 0,
+                    "sensor_min": None, "sensor_max": None, "sensor_sum": 0,
+                    "brightness_min": None, "brightness_max": None, "brightness_sum": 0,
+                    "on_count": 0, "on_seconds": 0.0,
+                }
+            return item
+
+        late = {}  # device_id -> mẫu tới muộn liền trước trong cùng lần gọi
+        for row in history_rows:
+            device_id, ts = row["device_id"], row["timestamp"]
+            sensor, brightness, is_on = row["sensor_value"], row["brightness"], bool(row["is_on"])
+
+            last = self._last.get(device_id)
+            if last is not None and ts < last[0]:
+                # Mẫu cũ hơn mẫu mới nhất đã thấy (lô gửi bù, đã sắp xếp): on_seconds tính nối tiếp trong lô
+                last = late.get(device_id)
+                late[device_id] = (ts, is_on)
+            if last is not None:
+                gap = (ts - last[0]).total_seconds()
+                if last[1] and 0 < gap <= self._max_gap:
+                    for seconds, _, _ in ROLLUP_LEVELS:
+                        entry(seconds, device_id, last[0])["on_seconds"] += gap
+            if last is None or ts >= last[0]:
+                self._last[device_id] = (ts, is_on)
+
+            for seconds, _, _ in ROLLUP_LEVELS:
+                item = entry(seconds, device_id, ts)
+                item["count"] += 1
+                item["sensor_min"] = sensor if item["sensor_min"] is None else min(item["sensor_min"], sensor)
+                item["sensor_max"] = sensor if item["sensor_max"] is None else max(item["sensor_max"], sensor)
+                item["sensor_sum"] += sensor
+                item["brightness_min"] = brightness if item["brightness_min"] is None else min(item["brightness_min"], brightness)
+                item["brightness_max"] = brightness if item["brightness_max"] is None else max(item["brightness_max"], brightness)
+                item["brightness_sum"] += brightness
+                item["on_count"] += is_on
+
+        for seconds, model, _ in ROLLUP_LEVELS:
+            rows = [item for (level, _, _), item in acc.items() if level == seconds]
+            if rows:
+                db.execute(_upsert_statement(model), rows)
+
+
+def _upsert_statement(model):
+    stmt = sqlite_insert(model)
+    excluded = stmt.excluded
+    table = model.__table__.c
+
+    def merge_min(col):
+        return func.min(func.coalesce(table[col], excluded[col]), func.coalesce(excluded[col], table[col]))
+
+    def merge_max(col):
+        return func.max(func.coalesce(table[col], excluded[col]), func.coalesce(excluded[col], table[col]))
+
+    return stmt.on_conflict_do_update(
+        index_elements=[table.device_id, table.bucket_start],
+        set_={
+            "count": table.count + excluded.count,
+            "sensor_min": merge_min("sensor_min"),
+            "sensor_max": merge_max("sensor_max"),
+            "sensor_sum": table.sensor_sum + excluded.sensor_sum,
+            "brightness_min": merge_min("brightness_min"),
+            "brightness_max": merge_max("brightness_max"),
+            "brightness_sum": table.brightness_sum + excluded.brightness_sum,
+            "on_count": table.on_count + excluded.on_count,
+            "on_seconds": table.on_seconds + excluded.on_seconds,
+        },
+    )
+
+
+# ============ BACKFILL (dữ liệu có sẵn trong smartlight.db) ============
+
+_BACKFILL_MINUTE_SQL = """
+WITH samples AS (
+    SELECT device_id, timestamp, sensor_value, brightness, is_on,
+           (julianday(LEAD(timestamp) OVER (PARTITION BY device_id ORDER BY timestamp))
+            - julianday(timestamp)) * 86400.0 AS gap
+    FROM sensor_history
+    WHERE (:device_id IS NULL OR device_id = :device_id)
+)
+INSERT INTO sensor_rollup_minute (
+    device_id, bucket_start, count, sensor_min, sensor_max, sensor_sum,
+    brightness_min, brightness_max, brightness_sum, on_count, on_seconds
+)
+SELECT device_id, strftime('{fmt}', timestamp), count(*),
+       min(sensor_value), max(sensor_value), sum(sensor_value),
+       min(brightness), max(brightness), sum(brightness), sum(is_on),
+       sum(CASE WHEN is_on AND gap > 0 AND gap <= :max_gap THEN gap ELSE 0 END)
+FROM samples
+GROUP BY device_id, strftime('{fmt}', timestamp)
+"""
+
+_BACKFILL_FROM_MINUTE_SQL = """
+INSERT INTO {table} (
+    device_id, bucket_start, count, sensor_min, sensor_max, sensor_sum,
+    brightness_min, brightness_max, brightness_sum, on_count, on_seconds
+)
+SELECT device_id, strftime('{fmt}', bucket_start), sum(count),
+       min(sensor_min), max(sensor_max), sum(sensor_sum),
+       min(brightness_min), max(brightness_max), sum(brightness_sum), sum(on_count), sum(on_seconds)
+FROM sensor_rollup_minute
+WHERE (:device_id IS NULL OR device_id = :device_id)
+GROUP BY device_id, strftime('{fmt}', bucket_start)
+"""
+
+
+def backfill(db, device_id: str = None):
+    """
+    Tính lại toàn bộ rollup từ sensor_history (hoặc của một thiết bị). Caller commit.
+    Bảng phút tính trực tiếp từ dữ liệu gốc, bảng giờ/ngày tính từ bảng phút.
+    """
+    params = {"device_id": device_id, "max_gap": settings.ROLLUP_MAX_GAP_SECONDS}
+    for _, model, _ in ROLLUP_LEVELS:
+        stmt = delete(model)
+        if device_id is not None:
+            stmt = stmt.where(model.device_id == device_id)
+        db.execute(stmt)
+
+    (_, _, minute_fmt), *coarser = ROLLUP_LEVELS
+    db.execute(text(_BACKFILL_MINUTE_SQL.format(fmt=minute_fmt)), params)
+    for _, model, fmt in coarser:
+        db.execute(text(_BACKFILL_FROM_MINUTE_SQL.format(table=model.__tablename__, fmt=fmt)), params)
+
+
+# ============ ĐỌC ROLLUP CHO CÁC API LỊCH SỬ ============
+
+def pick_rollup_level(resolution: int):
+    """Bảng rollup thô nhất mà khung của nó chia hết resolution, None nếu phải dùng dữ liệu gốc"""
+    for seconds, model, _ in reversed(ROLLUP_LEVELS):
+        if resolution >= seconds and resolution % seconds == 0:
+            return seconds, model
+    return None
+
+
+def align_to_rollup(resolution: int) -> int:
+    """
+    Làm tròn lên resolution thành bội số của mức rollup lớn nhất không vượt quá nó,
+    để pick_rollup_level luôn tìm được bảng (giữ nguyên nếu nhỏ hơn mức nhỏ nhất).
+
+    Ví dụ /history?hours=168&resolution=60 bị clamp lên 121 giây (5000 điểm), sau đó đọc bảng phút:
+
+    >>> align_to_rollup(121), pick_rollup_level(align_to_rollup(121))[0]
+    (180, 60)
+    >>> align_to_rollup(3601), align_to_rollup(30)
+    (7200, 30)
+    """
+    levels = [seconds for seconds, _, _ in ROLLUP_LEVELS if seconds <= resolution]
+    if not levels:
+        return int(resolution)
+    level = max(levels)
+    return math.ceil(resolution / level) * level
+
+
+def rollup_resolution(range_seconds: float, max_points: int):
+    """
+    Độ dài khung (bội số của một mức rollup) để khoảng range_seconds có tối đa max_points khung,
+    None nếu khoảng đủ ngắn để trả về mẫu gốc.
+    """
+    needed = math.ceil(range_seconds / max_points)
+    if needed < ROLLUP_LEVELS[0][0]:
+        return None
+    return align_to_rollup(needed)
+
+
+def estimate_history_rows(db, device_id: str, start: datetime, end: datetime = None) -> int:
+    """Ước lượng số mẫu gốc trong khoảng từ rollup theo giờ (vài trăm dòng thay vì quét sensor_history)"""
+    stmt = select(func.coalesce(func.sum(SensorRollupHour.count), 0)).where(
+        SensorRollupHour.device_id == device_id, SensorRollupHour.bucket_start >= floor_time(start, 3600)
+    )
+    if end is not None:
+        stmt = stmt.where(SensorRollupHour.bucket_start < end)
+    return int(db.scalar(stmt))
+
+
+def load_rollup_series(db, model, device_id: str, start: datetime, end: datetime = None) -> dict:
+    """Đọc các dòng rollup của một thiết bị thành mảng cột"""
+    stmt = select(
+        (func.julianday(model.bucket_start) - 2440587.5) * 86400.0,
+        model.count, model.sensor_min, model.sensor_max, model.sensor_sum,
+        model.brightness_min, model.brightness_max, model.brightness_sum,
+        model.on_count, model.on_seconds,
+    ).where(model.device_id == device_id, model.bucket_start >= start, model.count > 0)
+    if end is not None:
+        stmt = stmt.where(model.bucket_start < end)
+    rows = db.execute(stmt.order_by(model.bucket_start)).all()
+    width = len(ROLLUP_FIELDS)
+    matrix = np.fromiter(chain.from_iterable(rows), dtype=np.float64, count=len(rows) * width)
+    matrix = matrix.reshape(len(rows), width)
+    series = {name: matrix[:, i] for i, name in enumerate(ROLLUP_FIELDS)}
+    series["ts"] = np.round(series["ts"], 3)
+    return series
+
+
+def rollup_buckets(series: dict, bucket_seconds: float) -> dict:
+    """Gộp các dòng rollup thành khung bucket_seconds, cùng định dạng với downsampling.bucket_aggregate"""
+    ts = series["ts"]
+    if ts.size == 0:
+        return {"ts": ts, "count": ts}
+    bucket = np.floor(ts / bucket_seconds).astype(np.int64)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(bucket)) + 1))
+    counts = np.add.reduceat(series["count"], starts)
+    return {
+        "ts": bucket[starts] * float(bucket_seconds),
+        "count": counts.astype(np.int64),
+        "on_ratio": np.add.reduceat(series["on_count"], starts) / counts,
+        "on_seconds": np.add.reduceat(series["on_seconds"], starts),
+        "sensor_value_min": np.minimum.reduceat(series["sensor_min"], starts),
+        "sensor_value_max": np.maximum.reduceat(series["sensor_max"], starts),
+        "sensor_value_avg": np.add.reduceat(series["sensor_sum"], starts) / counts,
+        "brightness_min": np.minimum.reduceat(series["brightness_min"], starts),
+        "brightness_max": np.maximum.reduceat(series["brightness_max"], starts),
+        "brightness_avg": np.add.reduceat(series["brightness_sum"], starts) / counts,
+    }
+
+
+rollup_aggregator = RollupAggregator(max_gap_seconds=settings.ROLLUP_MAX_GAP_SECONDS)
@@ -0,0 +1,78 @@
+from datetime import date, timedelta
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from ..database import get_db, run_db
+from ..config import settings as app_settings
+from ..models.device import DeviceState, User
+from ..analytics import usage_report
+from .auth import get_current_user
+from .control import load_device_state
+
+router = APIRouter(
+    prefix="/api/device",
+    tags=["analytics"],
+)
+
+DEFAULT_DEVICE_ID = app_settings.DEFAULT_DEVICE_ID
+
+# ============ THỐNG KÊ SỬ DỤNG / ĐIỆN NĂNG ============
+#   /api/device/analytics/usage              -> thiết bị mặc định
+#   /api/device/{device_id}/analytics/usage  -> một thiết bị
+#   /api/device/analytics/usage/all          -> toàn bộ thiết bị (lọc theo group / tag)
+
+START_QUERY = Query(default=None, description="Ngày đầu (YYYY-MM-DD), mặc định 6 ngày trước")
+END_QUERY = Query(default=None, description="Ngày cuối (bao gồm), mặc định hôm nay")
+PERIOD_QUERY = Query(default="day", pattern="^(day|week)$", description="Gộp theo ngày hoặc tuần (thứ Hai)")
+
+def validate_days(start: Optional[date], end: Optional[date]) -> tuple:
+    today = date.today()
+    end = min(end or today, today)
+    start = start or end - timedelta(days=6)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if (end - start).days + 1 > app_settings.ANALYTICS_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range is limited to {app_settings.ANALYTICS_MAX_DAYS} days")
+    return start, end
+
+def fleet_usage_report(db: Session, start: date, end: date, period: str,
+                       group: Optional[str], tag: Optional[str]) -> dict:
+    stmt = select(DeviceState.device_id).order_by(DeviceState.device_id)
+    if group is not None:
+        stmt = stmt.where(DeviceState.group_name == group)
+    if tag is not None:
+        stmt = stmt.where(DeviceState.has_tag(tag))
+    return usage_report(db, db.scalars(stmt).all(), start, end, period)
+
+@router.get("/analytics/usage/all")
+async def get_fleet_usage(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+    start: Optional[date] = START_QUERY,
+    end: Optional[date] = END_QUERY,
+    period: str = PERIOD_QUERY,
+    group: Optional[str] = None,
+    tag: Optional[str] = None
+):
+    """Giờ đèn, điện năng, tiền điện, tỉ lệ auto và số lần bật/tắt của mọi thiết bị (kèm tổng)"""
+    start, end = validate_days(start, end)
+    return await run_db(fleet_usage_report, db, start, end, period, group, tag)
+
+@router.get("/analytics/usage")
+@router.get("/{device_id}/analytics/usage")
+async def get_device_usage(
+    device_id: str = DEFAULT_DEVICE_ID,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+    start: Optional[date] = START_QUERY,
+    end: Optional[date] = END_QUERY,
+    period: str = PERIOD_QUERY
+):
+    """
+    Thống kê sử dụng của một thiết bị theo ngày/tuần trong [start, end].
+    Ngày cũ hơn RETENTION_RAW_DAYS được ước lượng từ rollup theo giờ (source = "rollup").
+    """
+    start, end = validate_days(start, end)
+    await load_device_state(db, device_id)     # 404 nếu thiết bị chưa tồn tại
+    return await run_db(usage_report, db, [device_id], start, end, period)
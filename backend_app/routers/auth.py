@@ -4,10 +4,11 @@ from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from ..database import get_db
+from ..database import get_db, run_db
 from ..models.device import User
 from ..schemas.device_schema import Token
 from ..config import settings
+from ..token_cache import token_cache
 
 router = APIRouter()
 
@@ -30,10 +31,17 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
+def authenticate_user(db: Session, username: str, password: str):
+    """Trả về User nếu đúng username/password (bcrypt tốn CPU - gọi qua run_db)"""
+    user = db.query(User).filter(User.username == username).first()
+    if not user or not verify_password(password, user.hashed_password):
+        return None
+    return user
+
 @router.post("/token", response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    user = await run_db(authenticate_user, db, form_data.username, form_data.password)
+    if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -45,20 +53,33 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+def verify_token(token: str, db: Session):
+    """
+    Xác thực JWT và trả về User, None nếu token không hợp lệ (dùng chung cho HTTP và WebSocket).
+    Kết quả hợp lệ được lưu vào token_cache: caller tra cache trước, chỉ gọi hàm này (qua run_db) khi miss.
+    """
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
-            raise credentials_exception
+            return None
     except JWTError:
-        raise credentials_exception
+        return None
     user = db.query(User).filter(User.username == username).first()
+    if user is not None:
+        # Tách khỏi session để dùng lại an toàn ở các request sau
+        db.expunge(user)
+        token_cache.put(token, user, payload["exp"])
+    return user
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    # Cache hit trả về ngay trên event loop, chỉ khi miss mới sang thread pool của DB
+    user = token_cache.get(token) or await run_db(verify_token, token, db)
     if user is None:
         raise credentials_exception
     return user
@@ -1,23 +1,61 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+import json
+import time
+from email.utils import format_datetime, parsedate_to_datetime
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse, JSONResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
-from typing import Optional
-from datetime import datetime, timedelta
-from ..database import get_db
+from sqlalchemy import desc, or_
+from typing import Optional, Union, Literal
+from datetime import datetime, timedelta, timezone
+from ..database import get_db, run_db, WriteSessionLocal
+from ..config import settings as app_settings
 from ..models.device import DeviceState, User, SensorHistory, UserSettings
 from ..schemas.device_schema import (
     DeviceStatus, 
     DeviceStatusFull,
     ControlRequest, 
+    BulkControlRequest,
+    DeviceGroupUpdate,
+    CompressionSettings,
     SensorHistoryItem,
     SensorHistoryResponse,
+    SensorHistoryBucketResponse,
     UserSettingsResponse,
     UserSettingsUpdate,
     DashboardSummary
 )
-from ..mqtt_service import mqtt_service
+from ..state_cache import state_cache, upsert_device_states
+from ..broadcast import broadcast_hub
+from ..rule_engine import rule_engine
+from ..command_scheduler import command_scheduler
+from ..command_tracker import command_tracker
+from ..downsampling import (
+    load_series,
+    bucket_aggregate,
+    buckets_to_items,
+    clamp_resolution,
+    downsample_lttb,
+    series_to_items,
+    take,
+    to_datetimes,
+    to_epoch,
+    reconstruct_series,
+)
+from ..rollups import (
+    ROLLUP_LEVELS,
+    align_to_rollup,
+    estimate_history_rows,
+    pick_rollup_level,
+    rollup_resolution,
+    load_rollup_series,
+    rollup_buckets,
+)
+from ..recent_history import recent_history
+from ..compression import history_compressor
+from ..retention import retention_engine
+from ..history_export import EXPORT_FORMATS, history_range, aiter_export
 from .auth import get_current_user
-from sqlalchemy import func
 from datetime import date
 
 router = APIRouter(
@@ -26,38 +64,128 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
+DEFAULT_DEVICE_ID = app_settings.DEFAULT_DEVICE_ID
+
+# Mỗi API thiết bị có 2 dạng route:
+#   /api/device/<action>              -> thiết bị mặc định (tương thích frontend cũ)
+#   /api/device/{device_id}/<action>  -> thiết bị bất kỳ trong hệ thống
+
+# ============ HELPER: CONDITIONAL GET (ETag / 304) ============
+# ETag lấy từ phiên bản trong state_cache (trạng thái, lịch sử, cài đặt), không cần đọc DB hay serialize lại.
+# Phiên bản đếm lại từ đầu mỗi lần khởi động -> thêm mốc khởi động để ETag không trùng giữa các lần chạy.
+_ETAG_BOOT = format(time.time_ns(), "x")
+REVALIDATE = "private, no-cache"     # Trình duyệt được lưu nhưng phải hỏi lại server (If-None-Match) mỗi lần
+# Ngày đã qua vẫn có thể nhận lô mẫu gửi bù (telemetry_batch) nên cũng phải hỏi lại; chừa vài phút
+# cho các mẫu cuối ngày còn trong hàng đợi ingest trước khi coi là "đã qua"
+PAST_DAY_MARGIN = timedelta(minutes=5)
+
+def make_etag(kind: str, *versions):
+    """ETag mạnh từ các số phiên bản, None nếu thiếu phiên bản (thiết bị chưa có trong cache)"""
+    if any(v is None for v in versions):
+        return None
+    return f'"{kind}-{_ETAG_BOOT}-{"-".join(map(str, versions))}"'
+
+def http_date(moment: datetime) -> str:
+    """Giờ địa phương (naive) -> định dạng HTTP-date (GMT) cho Last-Modified"""
+    return format_datetime(moment.astimezone(timezone.utc).replace(microsecond=0), usegmt=True)
+
+def etag_headers(etag: Optional[str], cache_control: str = REVALIDATE, last_modified: datetime = None) -> dict:
+    if etag is None:
+        return {}
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+def not_modified(request: Request, etag: Optional[str], cache_control: str = REVALIDATE,
+                 last_modified: datetime = None):
+    """
+    Response 304 nếu If-None-Match của client khớp etag, hoặc (khi không có If-None-Match)
+    If-Modified-Since không cũ hơn last_modified; ngược lại None.
+    """
+    if etag is None:
+        return None
+    header = request.headers.get("if-none-match")
+    if header:
+        tags = [t.strip().removeprefix("W/") for t in header.split(",")]
+        fresh = "*" in tags or etag in tags
+    else:
+        since = request.headers.get("if-modified-since")
+        if not since or last_modified is None:
+            return None
+        try:
+            fresh = last_modified.astimezone(timezone.utc).replace(microsecond=0) <= parsedate_to_datetime(since)
+        except (TypeError, ValueError):
+            return None
+    if fresh:
+        return Response(status_code=304, headers=etag_headers(etag, cache_control, last_modified))
+    return None
+
+
 # ============ HELPER: GET DEVICE STATE ============
-def get_or_create_device_state(db: Session):
-    device = db.query(DeviceState).filter(DeviceState.id == 1).first()
+def get_or_create_device_state(db: Session, device_id: str = DEFAULT_DEVICE_ID):
+    device = db.query(DeviceState).filter(DeviceState.device_id == device_id).first()
     if not device:
-        device = DeviceState(id=1, is_on=False, brightness=0, is_auto_mode=False)
-        db.add(device)
-        db.commit()
-        db.refresh(device)
+        # Mọi thao tác ghi đi qua connection ghi duy nhất (WriteSessionLocal)
+        with WriteSessionLocal() as write_db:
+            device = DeviceState(device_id=device_id, is_on=False, brightness=0, is_auto_mode=False)
+            write_db.add(device)
+            write_db.commit()
+            write_db.refresh(device)
     return device
 
-# ============ 1. DEVICE STATUS & CONTROL ============
+def get_cached_device_state(db: Session, device_id: str = DEFAULT_DEVICE_ID, create: bool = False) -> dict:
+    """
+    Đọc trạng thái từ cache; cache miss mới chạm DB. Thiết bị chưa tồn tại chỉ được tạo mới
+    trên đường điều khiển (create=True), các route chỉ đọc trả về 404.
+    """
+    state = state_cache.get(device_id)
+    if state is None:
+        if create:
+            device = get_or_create_device_state(db, device_id)
+        else:
+            device = db.query(DeviceState).filter(DeviceState.device_id == device_id).first()
+            if device is None:
+                raise HTTPException(status_code=404, detail=f"Device {device_id} not found")
+        state = state_cache.put_row(device)
+    return state
 
-@router.get("/status", response_model=DeviceStatusFull)
-async def get_device_status(
-    current_user: User = Depends(get_current_user), 
-    db: Session = Depends(get_db)
-):
-    """Lấy trạng thái hiện tại của thiết bị"""
-    return get_or_create_device_state(db)
+async def load_device_state(db: Session, device_id: str = DEFAULT_DEVICE_ID, create: bool = False) -> dict:
+    """Như get_cached_device_state nhưng dùng trong route async: cache hit không rời event loop"""
+    state = state_cache.get(device_id)
+    if state is None:
+        state = await run_db(get_cached_device_state, db, device_id, create)
+    return state
 
+def get_cached_settings(db: Session) -> dict:
+    settings = state_cache.get_settings()
+    if settings is None:
+        row = db.query(UserSettings).filter(UserSettings.id == 1).first()
+        if not row:
+            with WriteSessionLocal() as write_db:
+                row = UserSettings(id=1, light_threshold_low=300, light_threshold_high=700, auto_brightness=80)
+                write_db.add(row)
+                write_db.commit()
+                write_db.refresh(row)
+        state_cache.set_settings(row)
+        settings = state_cache.get_settings()
+        rule_engine.configure(settings)
+    return settings
 
-@router.post("/control")
-async def control_device(
-    request: ControlRequest, 
-    current_user: User = Depends(get_current_user), 
-    db: Session = Depends(get_db)
-):
+async def load_settings(db: Session) -> dict:
+    settings = state_cache.get_settings()
+    if settings is None:
+        settings = await run_db(get_cached_settings, db)
+    return settings
+
+# ============ 1. DEVICE STATUS & CONTROL ============
+
+def build_command(request: ControlRequest, device: dict):
     """
-    Gửi lệnh điều khiển chuẩn xác.
-    Đã fix lỗi: Tắt đèn là tắt hẳn (brightness=0), bật Auto là gửi lệnh Auto.
+    Chuyển yêu cầu điều khiển thành (thay đổi trạng thái, payload MQTT) cho một thiết bị.
+    Dùng chung cho điều khiển từng thiết bị và điều khiển hàng loạt.
     """
-    device = get_or_create_device_state(db)
+    changes = {}
     mqtt_payload = {}
 
     # --- CASE 1: CHỈNH ĐỘ SÁNG (SET_BRIGHTNESS) ---
@@ -67,10 +195,10 @@ async def control_device(
             if not 0 <= val <= 100:
                 raise HTTPException(status_code=400, detail="Brightness must be 0-100")
             
-            # Cập nhật DB
-            device.brightness = val
-            device.is_on = True        # Có độ sáng tức là đang Bật
-            device.is_auto_mode = False # Chỉnh tay thì tắt Auto
+            # Cập nhật trạng thái
+            changes["brightness"] = val
+            changes["is_on"] = True         # Có độ sáng tức là đang Bật
+            changes["is_auto_mode"] = False # Chỉnh tay thì tắt Auto
             
             mqtt_payload = {
                 "type": "MANUAL",
@@ -81,15 +209,15 @@ async def control_device(
     # --- CASE 2: BẬT / TẮT NGUỒN (TOGGLE_POWER) ---
     elif request.action == "TOGGLE_POWER":
         # Xác định trạng thái mới
-        target_state = request.state if request.state is not None else (not device.is_on)
+        target_state = request.state if request.state is not None else (not device["is_on"])
         
-        # Cập nhật DB
-        device.is_on = target_state
+        # Cập nhật trạng thái
+        changes["is_on"] = target_state
         
         if target_state == False:
             # NẾU TẮT:
-            device.brightness = 0       # Về 0 ngay
-            device.is_auto_mode = False # Tắt luôn Auto
+            changes["brightness"] = 0       # Về 0 ngay
+            changes["is_auto_mode"] = False # Tắt luôn Auto
             
             mqtt_payload = {
                 "type": "MANUAL",
@@ -99,8 +227,8 @@ async def control_device(
         else:
             # NẾU BẬT:
             # Khôi phục độ sáng cũ (hoặc mặc định 50 nếu cũ là 0)
-            restore_brightness = device.brightness if device.brightness > 0 else 50
-            device.brightness = restore_brightness
+            restore_brightness = device["brightness"] if device["brightness"] > 0 else 50
+            changes["brightness"] = restore_brightness
             
             mqtt_payload = {
                 "type": "MANUAL",
@@ -111,10 +239,10 @@ async def control_device(
     # --- CASE 3: CHẾ ĐỘ TỰ ĐỘNG (SET_AUTO) ---
     elif request.action == "SET_AUTO":
         if request.enable is not None:
-            # Cập nhật DB
-            device.is_auto_mode = request.enable
+            # Cập nhật trạng thái
+            changes["is_auto_mode"] = request.enable
             if request.enable:
-                device.is_on = True # Bật Auto thì mặc định đèn phải ON
+                changes["is_on"] = True # Bật Auto thì mặc định đèn phải ON
             
             mqtt_payload = {
                 "type": "AUTO",
@@ -123,31 +251,315 @@ async def control_device(
 
     else:
         raise HTTPException(status_code=400, detail=f"Unknown action: {request.action}")
+
+    if mqtt_payload:
+        # Điều khiển tay thì tạm ngưng luật tự động của thiết bị, bật lại khi người dùng chọn AUTO
+        # (lưu cùng trạng thái thiết bị để giữ được qua các lần khởi động lại)
+        changes["rules_armed"] = request.action == "SET_AUTO" and bool(request.enable)
+    return changes, mqtt_payload
+
+
+@router.get("/status", response_model=DeviceStatusFull)
+@router.get("/{device_id}/status", response_model=DeviceStatusFull)
+async def get_device_status(
+    request: Request,
+    response: Response,
+    device_id: str = DEFAULT_DEVICE_ID,
+    current_user: User = Depends(get_current_user), 
+    db: Session = Depends(get_db)
+):
+    """
+    Lấy trạng thái hiện tại của thiết bị (phục vụ từ cache, không truy vấn DB).
+    Gửi kèm If-None-Match (ETag lần trước) để nhận 304 khi trạng thái chưa đổi.
+    """
+    # Đọc phiên bản TRƯỚC trạng thái: nếu trạng thái đổi giữa 2 lần đọc thì ETag cũ hơn nội dung,
+    # lần sau client chỉ phải tải lại chứ không bị giữ nội dung cũ
+    etag = make_etag("status", state_cache.version(device_id))
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    state = await load_device_state(db, device_id)
+    response.headers.update(etag_headers(etag))
+    return state
+
+
+@router.post("/control")
+@router.post("/{device_id}/control")
+async def control_device(
+    request: ControlRequest, 
+    device_id: str = DEFAULT_DEVICE_ID,
+    current_user: User = Depends(get_current_user), 
+    db: Session = Depends(get_db)
+):
+    """
+    Gửi lệnh điều khiển chuẩn xác.
+    Đã fix lỗi: Tắt đèn là tắt hẳn (brightness=0), bật Auto là gửi lệnh Auto.
+    """
+    device = await load_device_state(db, device_id, create=True)
+    changes, mqtt_payload = build_command(request, device)
+    if not mqtt_payload:
+        # Lệnh không có gì để gửi (thiếu value/enable): không đổi trạng thái, phiên bản và ETag giữ nguyên
+        return {"status": "success", "message": "Nothing to send", "device_id": device_id, "payload": mqtt_payload}
     
-    # Lưu thay đổi vào Database
-    device.last_updated = datetime.utcnow()
-    db.commit()
-    db.refresh(device)
+    # Cập nhật cache ngay (dùng cùng đồng hồ với dữ liệu telemetry trong on_message)
+    state = state_cache.apply_changes(device_id, changes, datetime.now())
+    broadcast_hub.publish(state)
     
-    # Gửi lệnh xuống MQTT
-    if mqtt_payload:
-        mqtt_service.publish_command(mqtt_payload)
+    # Gửi lệnh xuống MQTT qua command_scheduler: lệnh cùng loại tới dồn dập (kéo thanh trượt)
+    # được gộp lại, trạng thái được lưu vào Database theo lô cùng lúc gửi lệnh
+    command_scheduler.submit(device_id, mqtt_payload, state)
 
-    return {"status": "success", "message": "Command sent", "payload": mqtt_payload}
+    return {"status": "success", "message": "Command sent", "device_id": device_id, "payload": mqtt_payload}
 
 
-# ============ 2. SENSOR HISTORY ============
+def resolve_bulk_targets(db: Session, request: BulkControlRequest) -> list:
+    """device_id của các thiết bị được chọn (danh sách + nhóm + tag), giữ thứ tự, không trùng"""
+    targets = list(request.devices or [])
+    conditions = []
+    if request.group:
+        conditions.append(DeviceState.group_name == request.group)
+    if request.tag:
+        conditions.append(DeviceState.has_tag(request.tag))
+    if conditions:
+        rows = db.query(DeviceState.device_id).filter(or_(*conditions)).order_by(DeviceState.device_id)
+        targets.extend(row.device_id for row in rows)
+    return list(dict.fromkeys(targets))
 
-@router.get("/history", response_model=SensorHistoryResponse)
-async def get_sensor_history(
+def save_device_states(states: list):
+    """Lưu trạng thái của nhiều thiết bị trong MỘT transaction"""
+    with WriteSessionLocal() as write_db, state_cache.write_lock:
+        upsert_device_states(write_db, states)
+        write_db.commit()
+
+@router.post("/control/bulk")
+async def bulk_control(
+    request: BulkControlRequest,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
-    limit: int = Query(default=100, ge=1, le=1000),
-    hours: Optional[int] = Query(default=24, ge=1, le=168)
+    db: Session = Depends(get_db)
+):
+    """
+    Điều khiển hàng loạt (cả tầng, cả nhóm đèn) bằng MỘT request, cùng ý nghĩa với /control:
+    trạng thái mọi thiết bị được lưu trong một transaction, lệnh MQTT được đẩy hết vào
+    command_scheduler (publish liên tiếp, không chờ từng thiết bị).
+    """
+    if not (request.devices or request.group or request.tag):
+        raise HTTPException(status_code=400, detail="Specify devices, group or tag")
+    device_ids = await run_db(resolve_bulk_targets, db, request)
+    if len(device_ids) > app_settings.BULK_CONTROL_MAX_DEVICES:
+        raise HTTPException(status_code=400, detail=f"Too many devices (max {app_settings.BULK_CONTROL_MAX_DEVICES})")
+
+    now = datetime.now()
+    results = []
+    states = []
+    commands = []
+    for device_id in device_ids:
+        device = state_cache.get(device_id)
+        if device is None:
+            results.append({"device_id": device_id, "status": "not_found"})
+            continue
+        # Lỗi tham số (độ sáng sai, action lạ) giống nhau cho mọi thiết bị -> 400 ngay ở thiết bị đầu tiên
+        changes, mqtt_payload = build_command(request, device)
+        if not mqtt_payload:
+            results.append({"device_id": device_id, "status": "unchanged"})
+            continue
+        states.append(state_cache.apply_changes(device_id, changes, now))
+        commands.append((device_id, mqtt_payload))
+        results.append({"device_id": device_id, "status": "sent", "payload": mqtt_payload})
+
+    if states:
+        await run_db(save_device_states, states)
+    for state in states:
+        broadcast_hub.publish(state)
+
+    for device_id, mqtt_payload in commands:
+        command_scheduler.submit(device_id, mqtt_payload)
+
+    return {
+        "status": "success",
+        "action": request.action,
+        "requested": len(device_ids),
+        "sent": len(commands),
+        "results": results,
+    }
+
+
+def save_device_group(device_id: str, update: DeviceGroupUpdate) -> dict:
+    with WriteSessionLocal() as write_db:
+        device = write_db.query(DeviceState).filter(DeviceState.device_id == device_id).first()
+        if device is None:
+            raise HTTPException(status_code=404, detail=f"Device {device_id} not found")
+        if update.group is not None:
+            device.group_name = update.group or None
+        if update.tags is not None:
+            tags = [t.strip() for t in update.tags if t.strip()]
+            if any("," in t for t in tags):
+                raise HTTPException(status_code=400, detail="Tags must not contain ','")
+            device.tags = f",{','.join(tags)}," if tags else None
+        write_db.commit()
+        return {
+            "device_id": device_id,
+            "group": device.group_name,
+            "tags": device.tags.strip(",").split(",") if device.tags else [],
+        }
+
+@router.put("/group")
+@router.put("/{device_id}/group")
+async def update_device_group(
+    update: DeviceGroupUpdate,
+    device_id: str = DEFAULT_DEVICE_ID,
+    current_user: User = Depends(get_current_user)
+):
+    """Gán nhóm / tag cho thiết bị (dùng cho /control/bulk)"""
+    return await run_db(save_device_group, device_id, update)
+
+
+def compression_status(device_id: str) -> dict:
+    return {
+        "device_id": device_id,
+        "config": history_compressor.config_for(device_id),
+        "stats": history_compressor.stats(device_id),
+    }
+
+def save_device_compression(device_id: str, update: CompressionSettings) -> dict:
+    override = update.model_dump(exclude_none=True)
+    with WriteSessionLocal() as write_db:
+        device = write_db.query(DeviceState).filter(DeviceState.device_id == device_id).first()
+        if device is None:
+            raise HTTPException(status_code=404, detail=f"Device {device_id} not found")
+        device.compression = json.dumps(override) if override else None
+        write_db.commit()
+    history_compressor.set_override(device_id, override)
+    return compression_status(device_id)
+
+@router.get("/compression")
+@router.get("/{device_id}/compression")
+async def get_device_compression(
+    device_id: str = DEFAULT_DEVICE_ID,
+    current_user: User = Depends(get_current_user)
 ):
-    """Lấy lịch sử dữ liệu cảm biến"""
-    start_time = datetime.utcnow() - timedelta(hours=hours)
+    """Cấu hình nén lịch sử đang áp dụng và tỉ lệ nén (số mẫu nhận / số dòng lưu) từ lúc khởi động"""
+    return compression_status(device_id)
+
+@router.put("/compression")
+@router.put("/{device_id}/compression")
+async def update_device_compression(
+    update: CompressionSettings,
+    device_id: str = DEFAULT_DEVICE_ID,
+    current_user: User = Depends(get_current_user)
+):
+    """Đặt cấu hình nén riêng cho thiết bị (thay toàn bộ cấu hình riêng cũ; body rỗng = dùng mặc định)"""
+    return await run_db(save_device_compression, device_id, update)
+
+
+# ============ 2. SENSOR HISTORY ============
+
+# Tham số giảm mẫu dùng chung cho các API lịch sử:
+#   resolution -> gom theo khung cố định N giây (min/max/avg, tỉ lệ bật đèn)
+#   max_points -> tối đa N điểm: khoảng ngắn dùng LTTB trên mẫu gốc, khoảng dài
+#                 (mỗi điểm >= 1 phút) trả về các khung gom nhóm từ bảng rollup
+RESOLUTION_QUERY = Query(default=None, ge=1, description="Gom nhóm theo khung N giây")
+MAX_POINTS_QUERY = Query(default=None, ge=3, le=app_settings.HISTORY_MAX_POINTS,
+                         description="Giảm mẫu còn tối đa N điểm")
+# Lịch sử đã nén (compression.py) -> dựng lại chuỗi đều interval giây, ưu tiên hơn resolution/max_points
+RECONSTRUCT_QUERY = Query(default=None, description="Dựng lại chuỗi đã nén: step (deadband) / linear (swinging door)")
+INTERVAL_QUERY = Query(default=60, ge=1, description="Khoảng cách giữa các điểm dựng lại (giây)")
+
+def reconstruct_history(db: Session, device_id: str, start: datetime, end: Optional[datetime],
+                        interval: int, method: str) -> SensorHistoryResponse:
+    end = min(end or datetime.now(), datetime.now())
+    range_seconds = max((end - start).total_seconds(), 0)
+    interval = clamp_resolution(interval, range_seconds, app_settings.HISTORY_MAX_POINTS)
+    # Lùi lại một heartbeat để có điểm lưu trước start (giá trị đầu khoảng)
+    lookback = start - timedelta(seconds=history_compressor.config_for(device_id)["max_interval"])
+    series = recent_history.series(device_id, lookback, end)
+    if series is None:
+        series = load_series(db, device_id, lookback, end)
+    # Mẫu mới nhất có thể còn đang giữ trong bộ nén (chưa ghi xuống DB lẫn vòng đệm)
+    held = history_compressor.pending(device_id)
+    if held is not None and lookback <= held[0] < end and (
+            series["ts"].size == 0 or to_epoch(held[0]) > series["ts"][-1]):
+        record_time, state = held
+        series = {
+            name: np.append(series[name], float(to_epoch(record_time) if name == "ts" else state[name]))
+            for name in ("ts", "sensor_value", "brightness", "is_on", "is_auto_mode")
+        }
+    items = series_to_items(
+        reconstruct_series(series, to_epoch(start), to_epoch(end), interval, method), device_id
+    )
+    return SensorHistoryResponse(data=items, total=len(items))
+
+def downsample_history(db: Session, device_id: str, start: datetime, end: Optional[datetime],
+                       range_seconds: float, resolution: Optional[int], max_points: Optional[int]):
+    """
+    Trả về (items, resolution). resolution = None nghĩa là items là mẫu gốc (LTTB),
+    ngược lại items là các khung gom nhóm. Khoảng thời gian nằm trọn trong recent_history được
+    tính trên mẫu gốc trong bộ nhớ; ngoài ra gom nhóm đọc bảng rollup thô nhất phù hợp nếu có.
+    """
+    recent = recent_history.series(device_id, start, end)
+    if resolution is None:
+        resolution = rollup_resolution(range_seconds, max_points)
+        if resolution is None:
+            series = recent if recent is not None else load_series(db, device_id, start, end)
+            return series_to_items(downsample_lttb(series, max_points), device_id), None
+
+    clamped = clamp_resolution(resolution, range_seconds, app_settings.HISTORY_MAX_POINTS)
+    if clamped != resolution:
+        # Khung đã bị nới rộng: làm tròn lên bội số mức rollup để khoảng dài đọc bảng rollup thay vì quét mẫu gốc
+        clamped = align_to_rollup(clamped)
+    resolution = clamped
+    level = pick_rollup_level(resolution)
+    if recent is not None:
+        buckets = bucket_aggregate(recent, resolution)
+    elif level is not None:
+        _, model = level
+        buckets = rollup_buckets(load_rollup_series(db, model, device_id, start, end), resolution)
+    else:
+        buckets = bucket_aggregate(load_series(db, device_id, start, end), resolution)
+    return buckets_to_items(buckets), resolution
+
+def auto_resolution(db: Session, device_id: str, start: datetime, end: Optional[datetime],
+                    range_seconds: float, limit: int) -> Optional[int]:
+    """
+    Khung gom nhóm tự chọn cho truy vấn không truyền resolution/max_points: khoảng vượt quá thời gian
+    giữ dữ liệu gốc hoặc có nhiều hơn HISTORY_RAW_ROW_BUDGET mẫu thì đọc bảng rollup (tối đa limit khung).
+    None -> khoảng đủ nhỏ, trả về mẫu gốc như cũ.
+    """
+    raw_days = app_settings.RETENTION_RAW_DAYS
+    if raw_days <= 0 or start >= datetime.now() - timedelta(days=raw_days):
+        recent = recent_history.series(device_id, start, end)
+        rows = recent["ts"].size if recent is not None else estimate_history_rows(db, device_id, start, end)
+        if rows <= app_settings.HISTORY_RAW_ROW_BUDGET:
+            return None
+    return rollup_resolution(range_seconds, max(limit, 3)) or ROLLUP_LEVELS[0][0]
+
+def query_history(db: Session, device_id: str, hours: int, limit: int,
+                  resolution: Optional[int], max_points: Optional[int],
+                  reconstruct: Optional[str] = None, interval: int = 60):
+    # Cùng đồng hồ (giờ địa phương) với timestamp mà ingest ghi xuống
+    start_time = datetime.now() - timedelta(hours=hours)
+
+    if reconstruct is not None:
+        return reconstruct_history(db, device_id, start_time, None, interval, reconstruct)
+
+    if resolution is None and max_points is None:
+        resolution = auto_resolution(db, device_id, start_time, None, hours * 3600, limit)
+    if resolution is not None or max_points is not None:
+        items, resolution = downsample_history(
+            db, device_id, start_time, None, hours * 3600, resolution, max_points
+        )
+        if resolution is None:
+            return SensorHistoryResponse(data=items, total=len(items))
+        return SensorHistoryBucketResponse(data=items, total=len(items), resolution=resolution)
+
+    recent = recent_history.series(device_id, start_time)
+    if recent is not None:
+        # limit mẫu mới nhất, lấy thẳng từ bộ nhớ
+        n = recent["ts"].size
+        items = series_to_items(take(recent, slice(max(0, n - limit), n)), device_id)
+        return SensorHistoryResponse(data=items, total=len(items))
+
     query = db.query(SensorHistory).filter(
+        SensorHistory.device_id == device_id,
         SensorHistory.timestamp >= start_time
     ).order_by(desc(SensorHistory.timestamp)).limit(limit)
     
@@ -159,107 +571,305 @@ async def get_sensor_history(
         total=len(history_records)
     )
 
-@router.delete("/history")
-async def clear_sensor_history(
+@router.get("/history", response_model=Union[SensorHistoryResponse, SensorHistoryBucketResponse])
+@router.get("/{device_id}/history", response_model=Union[SensorHistoryResponse, SensorHistoryBucketResponse])
+async def get_sensor_history(
+    device_id: str = DEFAULT_DEVICE_ID,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
+    limit: int = Query(default=100, ge=1, le=1000),
+    hours: Optional[int] = Query(default=24, ge=1, le=168),
+    resolution: Optional[int] = RESOLUTION_QUERY,
+    max_points: Optional[int] = MAX_POINTS_QUERY,
+    reconstruct: Optional[Literal["step", "linear"]] = RECONSTRUCT_QUERY,
+    interval: int = INTERVAL_QUERY
+):
+    """
+    Lấy lịch sử dữ liệu cảm biến (có thể gom nhóm/giảm mẫu/dựng lại, khi đó bỏ qua limit).
+    Khoảng quá nhiều mẫu gốc tự trả về tối đa limit khung rollup (xem auto_resolution).
+    """
+    return await run_db(
+        query_history, db, device_id, hours, limit, resolution, max_points, reconstruct, interval
+    )
+
+@router.delete("/history", status_code=202)
+@router.delete("/{device_id}/history", status_code=202)
+async def clear_sensor_history(
+    device_id: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
     keep_hours: int = Query(default=0, ge=0)
 ):
-    """Xóa lịch sử"""
-    if keep_hours > 0:
-        cutoff = datetime.utcnow() - timedelta(hours=keep_hours)
-        deleted = db.query(SensorHistory).filter(SensorHistory.timestamp < cutoff).delete()
-    else:
-        deleted = db.query(SensorHistory).delete()
-    db.commit()
-    return {"status": "success", "deleted_records": deleted}
+    """
+    Xóa lịch sử (không truyền device_id -> xóa của tất cả thiết bị).
+    Việc xóa chạy nền theo từng lô nhỏ; API trả về job_id ngay để theo dõi tiến độ.
+    """
+    job = retention_engine.schedule_delete(device_id, keep_hours)
+    return {"status": "accepted", **job}
+
+@router.get("/history/jobs/{job_id}")
+async def get_history_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Trạng thái job xóa lịch sử: pending / running / done / failed / interrupted"""
+    job = retention_engine.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 
 # ============ 3. USER SETTINGS ============
 
 @router.get("/settings", response_model=UserSettingsResponse)
 async def get_settings(
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Lấy cài đặt ngưỡng"""
-    settings = db.query(UserSettings).filter(UserSettings.id == 1).first()
-    if not settings:
-        settings = UserSettings(id=1, light_threshold_low=300, light_threshold_high=700, auto_brightness=80)
-        db.add(settings)
-        db.commit()
+    etag = make_etag("settings", state_cache.settings_version())
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    settings = await load_settings(db)
+    response.headers.update(etag_headers(etag))
     return settings
 
+def save_settings(update_data: UserSettingsUpdate):
+    with WriteSessionLocal() as db:
+        settings = db.query(UserSettings).filter(UserSettings.id == 1).first()
+        if not settings:
+            settings = UserSettings(id=1)
+            db.add(settings)
+    
+        if update_data.light_threshold_low is not None: settings.light_threshold_low = update_data.light_threshold_low
+        if update_data.light_threshold_high is not None: settings.light_threshold_high = update_data.light_threshold_high
+        if update_data.auto_brightness is not None: settings.auto_brightness = update_data.auto_brightness
+    
+        db.commit()
+        db.refresh(settings)
+        state_cache.set_settings(settings)
+        rule_engine.configure(state_cache.get_settings())
+        return settings
+
 @router.put("/settings", response_model=UserSettingsResponse)
 async def update_settings(
     update_data: UserSettingsUpdate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_user)
 ):
     """Cập nhật cài đặt ngưỡng"""
-    settings = db.query(UserSettings).filter(UserSettings.id == 1).first()
-    if not settings:
-        settings = UserSettings(id=1)
-        db.add(settings)
-    
-    if update_data.light_threshold_low is not None: settings.light_threshold_low = update_data.light_threshold_low
-    if update_data.light_threshold_high is not None: settings.light_threshold_high = update_data.light_threshold_high
-    if update_data.auto_brightness is not None: settings.auto_brightness = update_data.auto_brightness
-    
-    db.commit()
-    db.refresh(settings)
-    return settings
+    return await run_db(save_settings, update_data)
 
 
 # ============ 4. DASHBOARD ============
 
 @router.get("/dashboard", response_model=DashboardSummary)
+@router.get("/{device_id}/dashboard", response_model=DashboardSummary)
 async def get_dashboard(
+    request: Request,
+    response: Response,
+    device_id: str = DEFAULT_DEVICE_ID,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Tổng quan Dashboard"""
-    device = get_or_create_device_state(db)
-    
-    settings = db.query(UserSettings).filter(UserSettings.id == 1).first()
-    if not settings:
-        settings = UserSettings(id=1, light_threshold_low=300, light_threshold_high=700, auto_brightness=80)
-        db.add(settings)
-        db.commit()
-    
-    start_time = datetime.utcnow() - timedelta(hours=24)
-    history_count = db.query(SensorHistory).filter(SensorHistory.timestamp >= start_time).count()
+    """Tổng quan Dashboard (trạng thái, cài đặt và bộ đếm 24h đều lấy từ cache)"""
+    # Bộ đếm 24h giảm dần theo thời gian mà không có phiên bản nào đổi -> đưa luôn giá trị vào ETag
+    etag = make_etag(
+        "dashboard", state_cache.version(device_id), state_cache.settings_version(),
+        state_cache.history_count_24h(device_id),
+    )
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    response.headers.update(etag_headers(etag))
+    device = await load_device_state(db, device_id)
+    settings = await load_settings(db)
     
     return DashboardSummary(
         device_status=DeviceStatus(
-            is_on=device.is_on,
-            brightness=device.brightness,
-            sensor_value=device.sensor_value,
-            is_auto_mode=device.is_auto_mode
+            is_on=device["is_on"],
+            brightness=device["brightness"],
+            sensor_value=device["sensor_value"],
+            is_auto_mode=device["is_auto_mode"]
         ),
         settings=UserSettingsResponse.model_validate(settings),
-        recent_history_count=history_count
+        recent_history_count=state_cache.history_count_24h(device_id)
     )
 
+def query_history_by_date(db: Session, device_id: str, target_date: date,
+                          resolution: Optional[int], max_points: Optional[int]):
+    day_start = datetime.combine(target_date, datetime.min.time())
+    day_end = day_start + timedelta(days=1)
+    if resolution is not None or max_points is not None:
+        items, _ = downsample_history(
+            db, device_id, day_start, day_end, 86400, resolution, max_points
+        )
+        for item in items:
+            item["timestamp"] = item["timestamp"].strftime("%H:%M:%S")
+        return JSONResponse(items)
+
+    recent = recent_history.series(device_id, day_start, day_end)
+    if recent is not None:
+        return JSONResponse([
+            {"timestamp": ts.strftime("%H:%M:%S"), "sensor_value": sensor_value, "brightness": brightness}
+            for ts, sensor_value, brightness in zip(
+                to_datetimes(recent["ts"]),
+                recent["sensor_value"].astype(int).tolist(), recent["brightness"].astype(int).tolist(),
+            )
+        ])
+
+    # Khoảng nửa mở [00:00, 00:00 ngày sau) trên cột timestamp -> dùng index (device_id, timestamp)
+    rows = db.execute(history_range(
+        (SensorHistory.timestamp, SensorHistory.sensor_value, SensorHistory.brightness),
+        device_id, day_start, day_end
+    ))
+
+    # Serialize JSON ngay trên thread của DB: một ngày dữ liệu gốc có thể tới hàng chục nghìn điểm,
+    # encode trên event loop sẽ làm nghẽn các request khác
+    return JSONResponse([
+        {
+            "timestamp": ts.strftime("%H:%M:%S"), # Chỉ lấy giờ:phút:giây
+            "sensor_value": sensor_value,
+            "brightness": brightness
+        }
+        for ts, sensor_value, brightness in rows
+    ])
+
 @router.get("/history/by-date")
-def get_history_by_date(
+@router.get("/{device_id}/history/by-date")
+async def get_history_by_date(
+    request: Request,
     target_date: date = Query(..., description="Chọn ngày (YYYY-MM-DD)"),
+    device_id: str = DEFAULT_DEVICE_ID,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    resolution: Optional[int] = RESOLUTION_QUERY,
+    max_points: Optional[int] = MAX_POINTS_QUERY
 ):
     """
     Trả về dữ liệu để vẽ biểu đồ cho một ngày cụ thể.
+    Truyền resolution hoặc max_points để giới hạn số điểm bất kể tần suất lấy mẫu.
+    Ngày đã qua: ETag / Last-Modified lấy từ phiên bản của riêng ngày đó (state_cache.day_version),
+    304 trả lời từ bộ nhớ, không chạm DB.
     """
-    # Lọc các bản ghi có ngày trùng với target_date
-    records = db.query(SensorHistory).filter(
-        func.date(SensorHistory.timestamp) == target_date
-    ).order_by(SensorHistory.timestamp.asc()).all()
+    day_end = datetime.combine(target_date, datetime.min.time()) + timedelta(days=1)
+    last_modified = None
+    if day_end + PAST_DAY_MARGIN <= datetime.now():
+        version, last_modified = state_cache.day_version(device_id, target_date)
+        etag = make_etag("history-day", version)
+    else:
+        # Hôm nay: đọc từ recent_history (cập nhật theo từng bản tin) -> phiên bản lịch sử của thiết bị
+        etag = make_etag("history", state_cache.history_version(device_id))
+    cached = not_modified(request, etag, last_modified=last_modified)
+    if cached is not None:
+        return cached
+    result = await run_db(query_history_by_date, db, device_id, target_date, resolution, max_points)
+    result.headers.update(etag_headers(etag, last_modified=last_modified))
+    return result
 
-    return [
-        {
-            "timestamp": r.timestamp.strftime("%H:%M:%S"), # Chỉ lấy giờ:phút:giây
-            "sensor_value": r.sensor_value,
-            "brightness": r.brightness
-        }
-        for r in records
-    ]
\ No newline at end of file
+
+def validate_range(start: datetime, end: Optional[datetime]) -> datetime:
+    end = end or datetime.now()
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    return end
+
+def query_history_range(db: Session, device_id: str, start: datetime, end: datetime, limit: int,
+                        resolution: Optional[int], max_points: Optional[int],
+                        reconstruct: Optional[str] = None, interval: int = 60):
+    if reconstruct is not None:
+        return reconstruct_history(db, device_id, start, end, interval, reconstruct)
+    if resolution is None and max_points is None:
+        resolution = auto_resolution(db, device_id, start, end, (end - start).total_seconds(), limit)
+    if resolution is not None or max_points is not None:
+        items, resolution = downsample_history(
+            db, device_id, start, end, (end - start).total_seconds(), resolution, max_points
+        )
+        if resolution is None:
+            return SensorHistoryResponse(data=items, total=len(items))
+        return SensorHistoryBucketResponse(data=items, total=len(items), resolution=resolution)
+
+    recent = recent_history.series(device_id, start, end)
+    if recent is not None:
+        items = series_to_items(take(recent, slice(0, limit)), device_id)
+        return SensorHistoryResponse(data=items, total=len(items))
+
+    records = db.scalars(history_range((SensorHistory,), device_id, start, end).limit(limit)).all()
+    return SensorHistoryResponse(
+        data=[SensorHistoryItem.model_validate(r) for r in records],
+        total=len(records)
+    )
+
+@router.get("/history/range", response_model=Union[SensorHistoryResponse, SensorHistoryBucketResponse])
+@router.get("/{device_id}/history/range", response_model=Union[SensorHistoryResponse, SensorHistoryBucketResponse])
+async def get_history_range(
+    request: Request,
+    response: Response,
+    start: datetime = Query(..., description="Bắt đầu (bao gồm)"),
+    end: Optional[datetime] = Query(default=None, description="Kết thúc (không bao gồm), mặc định là hiện tại"),
+    device_id: str = DEFAULT_DEVICE_ID,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+    limit: int = Query(default=1000, ge=1, le=app_settings.HISTORY_MAX_POINTS),
+    resolution: Optional[int] = RESOLUTION_QUERY,
+    max_points: Optional[int] = MAX_POINTS_QUERY,
+    reconstruct: Optional[Literal["step", "linear"]] = RECONSTRUCT_QUERY,
+    interval: int = INTERVAL_QUERY
+):
+    """
+    Lịch sử trong khoảng [start, end) bất kỳ. Không giảm mẫu thì trả về tối đa limit bản ghi
+    đầu tiên, riêng khoảng quá nhiều mẫu gốc / vượt thời gian giữ dữ liệu gốc tự trả về tối đa limit
+    khung rollup; cần toàn bộ mẫu gốc thì dùng /history/export.
+    """
+    # Mẫu gốc tới "bây giờ" chỉ đổi khi có mẫu mới (phiên bản lịch sử đổi). Còn giảm mẫu / dựng lại với
+    # end bỏ trống thì độ dài khoảng (số khung, lưới dựng lại) đổi theo thời gian -> không dùng ETag
+    open_ended = end is None
+    stable = not open_ended or (resolution is None and max_points is None and reconstruct is None)
+    etag = make_etag("history", state_cache.history_version(device_id)) if stable else None
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    end = validate_range(start, end)
+    result = await run_db(
+        query_history_range, db, device_id, start, end, limit, resolution, max_points, reconstruct, interval
+    )
+    if open_ended and isinstance(result, SensorHistoryBucketResponse):
+        # Tự chuyển sang khung rollup (auto_resolution): độ dài khung đổi theo thời gian như trên
+        etag = None
+    response.headers.update(etag_headers(etag))
+    return result
+
+@router.get("/history/export")
+@router.get("/{device_id}/history/export")
+async def export_history(
+    start: datetime = Query(..., description="Bắt đầu (bao gồm)"),
+    end: Optional[datetime] = Query(default=None, description="Kết thúc (không bao gồm), mặc định là hiện tại"),
+    format: str = Query(default="ndjson", pattern="^(ndjson|csv)$"),
+    device_id: str = DEFAULT_DEVICE_ID,
+    current_user: User = Depends(get_current_user)
+):
+    """Xuất lịch sử gốc trong khoảng [start, end) dạng NDJSON hoặc CSV, truyền dần từng khối"""
+    end = validate_range(start, end)
+    filename = f"history_{device_id}_{start:%Y%m%dT%H%M%S}_{end:%Y%m%dT%H%M%S}.{format}"
+    return StreamingResponse(
+        aiter_export(device_id, start, end, format),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+# ============ 5. COMMAND ACK (ĐỘ TRỄ LỆNH) ============
+
+@router.get("/commands")
+async def get_command_latency_all(current_user: User = Depends(get_current_user)):
+    """Độ trễ round-trip (gửi lệnh -> thiết bị báo trạng thái mới) và số lệnh timeout của mọi thiết bị"""
+    return {"timeout_s": app_settings.COMMAND_ACK_TIMEOUT, "devices": command_tracker.report()}
+
+@router.get("/{device_id}/commands")
+async def get_command_latency(device_id: str, current_user: User = Depends(get_current_user)):
+    """Độ trễ round-trip và số lệnh timeout của một thiết bị"""
+    report = command_tracker.report(device_id)
+    if device_id not in report:
+        raise HTTPException(status_code=404, detail=f"No commands sent to device {device_id}")
+    return {"timeout_s": app_settings.COMMAND_ACK_TIMEOUT, "device_id": device_id, **report[device_id]}
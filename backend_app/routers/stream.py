@@ -0,0 +1,77 @@
+import asyncio
+from typing import Optional
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query, status
+from ..database import SessionLocal, run_db
+from ..config import settings as app_settings
+from ..broadcast import broadcast_hub
+from ..state_cache import state_cache
+from ..token_cache import token_cache
+from .auth import verify_token
+
+router = APIRouter(
+    prefix="/api/device",
+    tags=["stream"],
+)
+
+# ============ LUỒNG TRẠNG THÁI THỜI GIAN THỰC (WEBSOCKET) ============
+# Trình duyệt không gửi được header Authorization qua WebSocket nên token đi qua query string.
+#   /api/device/stream              -> thiết bị mặc định
+#   /api/device/{device_id}/stream  -> một thiết bị
+#   /api/device/stream/all          -> toàn bộ thiết bị
+
+def _verify_token(token: str):
+    with SessionLocal() as db:
+        return verify_token(token, db)
+
+async def _serve_stream(websocket: WebSocket, token: str, device_id: Optional[str]):
+    user = token_cache.get(token) or await run_db(_verify_token, token)
+    if user is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    sub = broadcast_hub.subscribe(device_id)
+    try:
+        # Gửi ngay snapshot hiện tại để client không phải đợi thay đổi tiếp theo
+        if device_id is not None:
+            snapshot = state_cache.get(device_id)
+            if snapshot is not None:
+                await websocket.send_text(broadcast_hub.encode(snapshot))
+
+        receiver = asyncio.create_task(_drain_incoming(websocket))
+        try:
+            while True:
+                getter = asyncio.ensure_future(sub.queue.get())
+                done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+                if receiver in done:
+                    getter.cancel()
+                    break
+                message = getter.result()
+                if message is None:
+                    # Client quá chậm, hub đã loại khỏi danh sách
+                    await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+                    break
+                await websocket.send_text(message)
+        finally:
+            receiver.cancel()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        broadcast_hub.unsubscribe(sub)
+
+async def _drain_incoming(websocket: WebSocket):
+    """Đọc (và bỏ qua) dữ liệu từ client, kết thúc khi client ngắt kết nối"""
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+
+@router.websocket("/stream/all")
+async def stream_all_devices(websocket: WebSocket, token: str = Query(...)):
+    await _serve_stream(websocket, token, None)
+
+@router.websocket("/stream")
+@router.websocket("/{device_id}/stream")
+async def stream_device(websocket: WebSocket, token: str = Query(...), device_id: str = app_settings.DEFAULT_DEVICE_ID):
+    await _serve_stream(websocket, token, device_id)
@@ -0,0 +1,149 @@
+import threading
+from datetime import datetime
+from .config import settings
+from .state_cache import state_cache
+
+# Vùng ánh sáng theo cảm biến LDR (giá trị càng lớn càng tối)
+BRIGHT = "BRIGHT"   # sensor < light_threshold_low  -> tắt đèn
+DARK = "DARK"       # sensor > light_threshold_high -> bật chế độ AUTO của ESP32
+
+
+class _DeviceRuleState:
+    __slots__ = ("zone", "candidate", "candidate_since", "last_action_at", "first_armed")
+
+    def __init__(self, first_armed: bool):
+        self.zone = None                # Vùng đã xác nhận (sau debounce)
+        self.candidate = None           # Vùng mới đang chờ đủ thời gian debounce
+        self.candidate_since = None
+        self.last_action_at = None      # Lần cuối gửi lệnh (tính thời gian dwell)
+        self.first_armed = first_armed  # is_auto_mode lúc gặp lần đầu, dùng khi trạng thái chưa có rules_armed
+
+
+class RuleEngine:
+    """
+    Điều khiển tự động phía server, chạy trong on_message (không truy vấn DB):
+    - Ngưỡng low/high giữ trong bộ nhớ, nạp lại khi cài đặt thay đổi (configure).
+    - Trễ (hysteresis): giữa low và high là vùng đệm, giữ nguyên vùng hiện tại.
+    - Debounce: vùng mới phải giữ liên tục debounce_seconds mới được xác nhận.
+    - Dwell: sau mỗi lệnh phải chờ ít nhất min_dwell_seconds mới gửi lệnh tiếp theo cho thiết bị đó.
+    - Người dùng điều khiển tay thì tạm ngưng luật cho thiết bị đó tới khi bật lại AUTO: cờ rules_armed
+      nằm trong trạng thái thiết bị (lưu xuống device_state), lệnh của chính luật không ghi đè được.
+    """
+
+    def __init__(self, enabled: bool, debounce_seconds: float, min_dwell_seconds: float):
+        self.enabled = enabled
+        self._debounce = debounce_seconds
+        self._min_dwell = min_dwell_seconds
+        self._low = None
+        self._high = None
+        self._devices = {}      # device_id -> _DeviceRuleState
+        self._lock = threading.Lock()
+
+        # Thống kê
+        self.evaluations = 0
+        self.commands_sent = 0
+        self.debounced = 0
+        self.dwell_suppressed = 0
+
+    def configure(self, user_settings: dict):
+        """Cập nhật ngưỡng từ cài đặt (dict giống state_cache.get_settings())"""
+        if not user_settings:
+            return
+        with self._lock:
+            self._low = user_settings["light_threshold_low"]
+            self._high = user_settings["light_threshold_high"]
+
+    def reload(self, db=None):
+        """Nạp lại ngưỡng từ state_cache (listener khi DB bị sửa từ tiến trình khác)"""
+        self.configure(state_cache.get_settings())
+
+    def evaluate(self, device_id: str, state: dict, record_time: datetime):
+        """
+        Xét một mẫu telemetry (trạng thái đã gộp trong cache). Trả về payload lệnh MQTT
+        cần gửi, hoặc None nếu không cần làm gì.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            if self._low is None:
+                return None
+            self.evaluations += 1
+            rule = self._get(device_id, bool(state["is_auto_mode"]))
+            armed = state.get("rules_armed")
+            if armed is None:
+                # Chưa quyết định: theo chế độ AUTO lúc gặp lần đầu và ghi nhận vào trạng thái thiết bị,
+                # để lệnh tắt đèn của chính luật (làm mất is_auto_mode) hay khởi động lại không tắt luật
+                armed = rule.first_armed
+                state_cache.init_rules_armed(device_id, armed)
+            if not armed:
+                return None
+
+            sensor = state["sensor_value"]
+            if sensor < self._low:
+                observed = BRIGHT
+            elif sensor > self._high:
+                observed = DARK
+            else:
+                observed = rule.zone     # Vùng đệm: giữ nguyên
+
+            if observed is None or observed == rule.zone:
+                rule.candidate = None
+                return None
+
+            # Debounce: vùng mới phải ổn định đủ lâu
+            if rule.candidate != observed:
+                rule.candidate = observed
+                rule.candidate_since = record_time
+            if (record_time - rule.candidate_since).total_seconds() < self._debounce:
+                self.debounced += 1
+                return None
+
+            command = self._command_for(observed, state)
+            if command is not None and rule.last_action_at is not None and \
+                    (record_time - rule.last_action_at).total_seconds() < self._min_dwell:
+                self.dwell_suppressed += 1
+                return None
+
+            rule.zone = observed
+            rule.candidate = None
+            if command is not None:
+                rule.last_action_at = record_time
+                self.commands_sent += 1
+            return command
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "threshold_low": self._low,
+            "threshold_high": self._high,
+            "devices": len(self._devices),
+            "evaluations": self.evaluations,
+            "commands_sent": self.commands_sent,
+            "debounced": self.debounced,
+            "dwell_suppressed": self.dwell_suppressed,
+        }
+
+    # ============ Nội bộ (gọi khi đã giữ lock) ============
+    def _get(self, device_id: str, first_armed: bool) -> _DeviceRuleState:
+        rule = self._devices.get(device_id)
+        if rule is None:
+            rule = self._devices[device_id] = _DeviceRuleState(first_armed)
+        return rule
+
+    @staticmethod
+    def _command_for(zone: str, state: dict):
+        """Lệnh cần gửi khi vào vùng mới, None nếu đèn đã ở trạng thái đúng"""
+        if zone == BRIGHT and state["is_on"]:
+            # Trời sáng -> tắt hẳn đèn
+            return {"type": "MANUAL", "state": "OFF", "brightness": 0}
+        if zone == DARK and (not state["is_on"] or not state["is_auto_mode"]):
+            # Trời tối -> để ESP32 tự dimming theo cảm biến
+            return {"type": "AUTO", "enable": True}
+        return None
+
+
+rule_engine = RuleEngine(
+    enabled=settings.RULE_ENGINE_ENABLED,
+    debounce_seconds=settings.RULE_DEBOUNCE_SECONDS,
+    min_dwell_seconds=settings.RULE_MIN_DWELL_SECONDS,
+)
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional, List
+from pydantic import BaseModel, Field
+from typing import Optional, List, Literal
 from datetime import datetime
 
 # ============ Authentication Schemas ============
@@ -19,6 +19,7 @@ class DeviceStatus(BaseModel):
 
 class DeviceStatusFull(DeviceStatus):
     """Extended device status with timestamp"""
+    device_id: Optional[str] = None
     last_updated: Optional[datetime] = None
 
     class Config:
@@ -31,9 +32,27 @@ class ControlRequest(BaseModel):
     enable: Optional[bool] = None  # For auto mode
     state: Optional[bool] = None  # For power
 
+class BulkControlRequest(ControlRequest):
+    """Cùng một lệnh cho nhiều thiết bị: hợp của danh sách devices, nhóm group và tag"""
+    devices: Optional[List[str]] = None
+    group: Optional[str] = None
+    tag: Optional[str] = None
+
+class DeviceGroupUpdate(BaseModel):
+    group: Optional[str] = None  # Chuỗi rỗng để bỏ nhóm
+    tags: Optional[List[str]] = None  # Danh sách rỗng để xóa hết tag
+
+class CompressionSettings(BaseModel):
+    """Cấu hình nén lịch sử riêng của thiết bị, trường None = dùng mặc định trong config"""
+    method: Optional[Literal["off", "deadband", "swinging_door"]] = None
+    deadband: Optional[float] = Field(default=None, ge=0)
+    deviation: Optional[float] = Field(default=None, ge=0)
+    max_interval: Optional[float] = Field(default=None, gt=0)
+
 # ============ Sensor History Schemas ============
 class SensorHistoryItem(BaseModel):
-    id: int
+    id: Optional[int] = None    # None khi dữ liệu lấy từ bộ nhớ (recent_history), không qua DB
+    device_id: Optional[str] = None
     sensor_value: int
     brightness: int
     is_on: bool
@@ -47,6 +66,24 @@ class SensorHistoryResponse(BaseModel):
     data: List[SensorHistoryItem]
     total: int
 
+class SensorHistoryBucket(BaseModel):
+    """Một khung thời gian đã gom nhóm (sensor_value/brightness là giá trị trung bình)"""
+    timestamp: datetime
+    count: int
+    sensor_value: float
+    sensor_min: int
+    sensor_max: int
+    brightness: float
+    brightness_min: int
+    brightness_max: int
+    on_ratio: float  # Tỉ lệ số mẫu đèn đang bật
+    on_seconds: float  # Tổng thời gian đèn bật trong khung (giây)
+
+class SensorHistoryBucketResponse(BaseModel):
+    data: List[SensorHistoryBucket]
+    total: int
+    resolution: int  # Độ dài mỗi khung (giây)
+
 # ============ User Settings Schemas ============
 class UserSettingsBase(BaseModel):
     light_threshold_low: int = 300  # Ngưỡng tối (dưới mức này bật đèn)
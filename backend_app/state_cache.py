@@ -0,0 +1,500 @@
+import itertools
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from sqlalchemy import event, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from .config import settings
+from .database import SessionLocal, write_engine, watch_engine
+from .models.device import DeviceState, SensorHistory, UserSettings
+
+logger = logging.getLogger(__name__)
+
+# Các trường trạng thái thiết bị được giữ trong cache (và ghi xuống bảng device_state)
+STATE_FIELDS = ("device_id", "is_on", "brightness", "sensor_value", "is_auto_mode", "last_updated", "rules_armed")
+SETTINGS_FIELDS = ("id", "light_threshold_low", "light_threshold_high", "auto_brightness", "last_updated")
+
+HISTORY_WINDOW_MINUTES = 24 * 60
+
+
+def _minute_key(ts: datetime) -> int:
+    return int(ts.timestamp() // 60)
+
+
+class DeviceStateCache:
+    """
+    Cache trạng thái thiết bị trong bộ nhớ - nguồn dữ liệu chính cho các API đọc.
+    - on_message và control_device ghi xuyên (write-through) vào cache trước, DB ghi sau.
+    - Số bản ghi lịch sử 24h được đếm tăng dần theo từng phút, không cần COUNT(*).
+    - Thread nền theo dõi PRAGMA data_version trên một connection riêng (watch_engine) để phát hiện
+      DB bị sửa từ tiến trình khác (ví dụ create_user.py) và đồng bộ lại cache. Commit của chính
+      tiến trình này được nhận ra qua hook checkout/checkin của write_engine.
+    """
+
+    def __init__(self, revalidate_interval: float):
+        self._lock = threading.Lock()
+        # Giữ trong suốt quá trình ghi device_state + commit, để _reconcile không đọc
+        # phải trạng thái "đã note_written nhưng chưa commit"
+        self.write_lock = threading.Lock()
+        self._devices = {}      # device_id -> dict trạng thái
+        self._written = {}      # device_id -> last_updated mà tiến trình này đã ghi xuống DB
+        self._minutes = {}      # device_id -> deque[[minute_key, count]]
+        self._counts = {}       # device_id -> tổng số bản ghi trong cửa sổ 24h
+        self._settings = None
+        self._revalidate_interval = revalidate_interval
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._watch_conn = None     # Connection riêng của thread theo dõi (watch_engine)
+        self._data_version = None
+        # Trạng thái connection ghi, cập nhật bởi hook pool của write_engine (dưới _watch_lock)
+        self._watch_lock = threading.Lock()
+        self._writer_busy = False   # Connection ghi đang được mượn
+        self._writer_uses = 0       # Số lần trả connection ghi kể từ chu kỳ theo dõi trước
+        self._writer_version = None # data_version của connection ghi lần trả gần nhất
+        self._external = False      # Connection ghi thấy data_version đổi -> tiến trình khác đã commit
+        self._unsure = False        # data_version đổi lẫn với commit của chính ta, chưa phân định được
+        self._listeners = []    # callback(db) gọi khi DB bị sửa từ connection khác
+        # Phiên bản (dùng làm ETag cho các API đọc): lấy từ một bộ đếm chung, tăng mỗi lần thay đổi
+        self._counter = itertools.count(1)
+        self._versions = {}         # device_id -> phiên bản trạng thái
+        self._history_versions = {} # device_id -> phiên bản lịch sử (mẫu mới, mẫu gửi bù, xóa lịch sử)
+        self._history_all = 0       # Phiên bản lịch sử chung (xóa theo chính sách retention)
+        # Lịch sử trong DB theo từng ngày (ETag / Last-Modified của /history/by-date cho ngày đã qua):
+        # (phiên bản, thời điểm đổi), ingest đánh dấu các ngày vừa ghi, retention đánh dấu khi xóa
+        self._day_versions = {}     # (device_id, date) -> (phiên bản, thời điểm)
+        self._deleted = {}          # device_id (None = mọi thiết bị) -> (phiên bản, thời điểm) lần xóa cuối
+        self._settings_version = 0
+
+    # ============ Khởi tạo / Đồng bộ từ DB ============
+    def load(self):
+        """Nạp toàn bộ trạng thái thiết bị, cài đặt và bộ đếm lịch sử 24h từ DB."""
+        db = SessionLocal()
+        try:
+            with self._lock:
+                self._devices.clear()
+                self._written.clear()
+                for row in db.query(DeviceState):
+                    self._store(row.device_id, self._row_to_state(row))
+                    self._written[row.device_id] = row.last_updated
+                self._store_settings(self._load_settings(db))
+                self._history_all = next(self._counter)
+                # Không biết DB đã đổi gì trước khi khởi động: mọi ngày tính như vừa đổi lúc nạp
+                self._day_versions.clear()
+                self._deleted = {None: (self._history_all, datetime.now())}
+            self.reload_history_counts(db)
+        finally:
+            db.close()
+
+    def reload_history_counts(self, db, device_id: str = None):
+        """Đếm lại lịch sử 24h từ DB (gom theo phút). Dùng khi khởi động hoặc sau khi xóa lịch sử."""
+        cutoff = datetime.now() - timedelta(minutes=HISTORY_WINDOW_MINUTES)
+        minute = func.strftime("%Y-%m-%d %H:%M", SensorHistory.timestamp)
+        query = db.query(SensorHistory.device_id, minute, func.count()).filter(
+            SensorHistory.timestamp >= cutoff
+        )
+        if device_id is not None:
+            query = query.filter(SensorHistory.device_id == device_id)
+        rows = query.group_by(SensorHistory.device_id, minute).order_by(SensorHistory.device_id, minute).all()
+
+        with self._lock:
+            target = [device_id] if device_id is not None else list(self._minutes)
+            for d in target:
+                self._minutes.pop(d, None)
+                self._counts.pop(d, None)
+            for d, minute_str, count in rows:
+                key = _minute_key(datetime.strptime(minute_str, "%Y-%m-%d %H:%M"))
+                self._minutes.setdefault(d, deque()).append([key, count])
+                self._counts[d] = self._counts.get(d, 0) + count
+
+    def invalidate(self, device_id: str = None):
+        """Xóa cache (một thiết bị hoặc toàn bộ) và nạp lại từ DB."""
+        if device_id is None:
+            self.load()
+            return
+        db = SessionLocal()
+        try:
+            row = db.query(DeviceState).filter(DeviceState.device_id == device_id).first()
+            with self._lock:
+                if row is None:
+                    self._devices.pop(device_id, None)
+                    self._written.pop(device_id, None)
+                else:
+                    self._store(device_id, self._row_to_state(row))
+                    self._written[device_id] = row.last_updated
+            self.reload_history_counts(db, device_id)
+        finally:
+            db.close()
+
+    # ============ Đọc ============
+    def get(self, device_id: str):
+        """Trả về bản sao trạng thái thiết bị, None nếu thiết bị chưa tồn tại."""
+        with self._lock:
+            state = self._devices.get(device_id)
+            return dict(state) if state is not None else None
+
+    def get_settings(self):
+        with self._lock:
+            return dict(self._settings) if self._settings is not None else None
+
+    def version(self, device_id: str):
+        """Phiên bản trạng thái thiết bị (đổi mỗi khi trạng thái đổi), None nếu thiết bị chưa có trong cache"""
+        with self._lock:
+            return self._versions.get(device_id) if device_id in self._devices else None
+
+    def history_version(self, device_id: str) -> int:
+        """Phiên bản lịch sử của thiết bị: đổi khi có mẫu mới (kể cả gửi bù), khi ghi xuống DB và khi xóa lịch sử"""
+        with self._lock:
+            return max(self._history_versions.get(device_id, 0), self._history_all)
+
+    def settings_version(self):
+        """Phiên bản cài đặt, None nếu chưa nạp được cài đặt"""
+        with self._lock:
+            return self._settings_version if self._settings is not None else None
+
+    def touch_history(self, device_ids):
+        """Đánh dấu lịch sử của các thiết bị đã đổi trong DB (sau khi ingest commit)"""
+        with self._lock:
+            for device_id in device_ids:
+                self._history_versions[device_id] = next(self._counter)
+
+    def history_deleted(self, device_id: str = None):
+        """Lịch sử của một thiết bị (None = mọi thiết bị) vừa bị xóa trong DB (retention)"""
+        with self._lock:
+            version = next(self._counter)
+            self._deleted[device_id] = (version, datetime.now())
+            if device_id is None:
+                self._history_all = version
+                self._day_versions.clear()  # Đã bị _deleted[None] thay thế
+            else:
+                self._history_versions[device_id] = version
+
+    def touch_days(self, keys):
+        """Ingest vừa commit mẫu của các ngày (device_id, date), kể cả lô gửi bù cho ngày cũ"""
+        now = datetime.now()
+        with self._lock:
+            for key in keys:
+                self._day_versions[key] = (next(self._counter), now)
+
+    def day_version(self, device_id: str, day) -> tuple:
+        """(phiên bản, thời điểm đổi cuối) của lịch sử một ngày trong DB, không chạm DB"""
+        with self._lock:
+            marks = (self._day_versions.get((device_id, day)), self._deleted.get(device_id), self._deleted.get(None))
+            return max((m for m in marks if m is not None), default=(0, datetime.now()))
+
+    def history_count_24h(self, device_id: str) -> int:
+        with self._lock:
+            self._prune(device_id, _minute_key(datetime.now()))
+            return self._counts.get(device_id, 0)
+
+    # ============ Ghi xuyên ============
+    def apply_telemetry(self, device_id: str, data: dict, record_time: datetime) -> dict:
+        """Gộp bản tin telemetry vào trạng thái thiết bị, đếm thêm 1 bản ghi lịch sử."""
+        changes = {k: data[k] for k in ("is_on", "brightness", "sensor_value", "is_auto_mode") if k in data}
+        with self._lock:
+            state = self._merge(device_id, changes, record_time)
+            self._count_sample(device_id, record_time)
+            return dict(state)
+
+    def apply_samples(self, device_id: str, samples: list):
+        """
+        Gộp lô mẫu [(record_time, data)] đã sắp xếp theo thời gian: mỗi mẫu gộp lên mẫu trước thành một
+        trạng thái đầy đủ cho lịch sử, nhưng trạng thái thiết bị chỉ nhận mẫu mới nhất và chỉ khi nó mới hơn
+        last_updated hiện tại. Trả về (rows [(record_time, state)], state mới hoặc None nếu cả lô đã cũ).
+        """
+        with self._lock:
+            current = self._devices.get(device_id)
+            running = dict(current) if current is not None else self._empty_state(device_id)
+            rows = []
+            for record_time, data in samples:
+                running.update((k, data[k]) for k in ("is_on", "brightness", "sensor_value", "is_auto_mode") if k in data)
+                running["last_updated"] = record_time
+                rows.append((record_time, dict(running)))
+                self._count_sample(device_id, record_time)
+
+            newest_time, newest = rows[-1]
+            if current is not None and current["last_updated"] is not None and newest_time < current["last_updated"]:
+                return rows, None
+            self._store(device_id, newest)
+            return rows, dict(newest)
+
+    def apply_changes(self, device_id: str, changes: dict, record_time: datetime) -> dict:
+        """Cập nhật trạng thái thiết bị từ lệnh điều khiển (không sinh bản ghi lịch sử)."""
+        with self._lock:
+            return dict(self._merge(device_id, changes, record_time))
+
+    def init_rules_armed(self, device_id: str, armed: bool):
+        """
+        Ghi nhận quyết định đầu tiên của rule_engine cho thiết bị chưa có rules_armed (không đổi last_updated,
+        được lưu xuống DB cùng lần ghi trạng thái kế tiếp của thiết bị).
+        """
+        with self._lock:
+            state = self._devices.get(device_id)
+            if state is not None and state.get("rules_armed") is None:
+                self._store(device_id, dict(state, rules_armed=armed))
+
+    def put_row(self, row: DeviceState) -> dict:
+        with self._lock:
+            state = self._row_to_state(row)
+            self._store(row.device_id, state)
+            self._written[row.device_id] = row.last_updated
+            return dict(state)
+
+    def set_settings(self, row: UserSettings):
+        with self._lock:
+            self._store_settings({k: getattr(row, k) for k in SETTINGS_FIELDS})
+
+    def note_written(self, device_id: str, last_updated: datetime):
+        """Ghi nhận giá trị mà tiến trình này ghi xuống DB (gọi TRƯỚC khi commit)."""
+        with self._lock:
+            # upsert_device_states bỏ qua giá trị cũ hơn DB nên chỉ giữ giá trị mới nhất
+            current = self._written.get(device_id)
+            if current is None or last_updated is None or last_updated >= current:
+                self._written[device_id] = last_updated
+
+    # ============ Thread theo dõi thay đổi ngoài tiến trình ============
+    def add_listener(self, callback):
+        """Đăng ký callback(db) chạy trên thread theo dõi mỗi khi phát hiện DB thay đổi từ bên ngoài"""
+        self._listeners.append(callback)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        if not event.contains(write_engine, "checkin", self._on_writer_checkin):
+            event.listen(write_engine, "checkout", self._on_writer_checkout)
+            event.listen(write_engine, "checkin", self._on_writer_checkin)
+        self._watch_conn = watch_engine.raw_connection()
+        self._data_version = self._read_data_version()
+        self._probe_writer()
+        self._thread = threading.Thread(target=self._watch, name="state-cache-watch", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(self._revalidate_interval + 1)
+            self._thread = None
+        if event.contains(write_engine, "checkin", self._on_writer_checkin):
+            event.remove(write_engine, "checkout", self._on_writer_checkout)
+            event.remove(write_engine, "checkin", self._on_writer_checkin)
+        if self._watch_conn is not None:
+            self._watch_conn.close()
+            self._watch_conn = None
+
+    def _read_data_version(self) -> int:
+        cursor = self._watch_conn.cursor()
+        try:
+            return cursor.execute("PRAGMA data_version").fetchone()[0]
+        finally:
+            cursor.close()
+
+    # Hook pool của write_engine: chạy trên thread đang ghi, mỗi lần mượn / trả connection ghi
+    def _on_writer_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._watch_lock:
+            self._writer_busy = True
+
+    def _on_writer_checkin(self, dbapi_connection, connection_record):
+        # data_version của một connection không đổi khi chính nó commit: connection ghi thấy giá trị
+        # đổi nghĩa là có tiến trình khác đã commit kể từ lần trả trước
+        version = None
+        if dbapi_connection is not None:
+            cursor = dbapi_connection.cursor()
+            try:
+                version = cursor.execute("PRAGMA data_version").fetchone()[0]
+            except Exception as e:
+                logger.error("Cannot read writer data_version: %s", e)
+            finally:
+                cursor.close()
+        with self._watch_lock:
+            self._writer_busy = False
+            self._writer_uses += 1
+            if version is None or (self._writer_version is not None and version != self._writer_version):
+                self._external = True
+            self._writer_version = version
+
+    def _probe_writer(self):
+        # Mượn rồi trả ngay connection ghi: hook checkin đọc data_version của nó
+        write_engine.raw_connection().close()
+        with self._watch_lock:
+            self._writer_uses -= 1
+
+    def _external_change(self) -> bool:
+        """
+        Có tiến trình khác commit kể từ chu kỳ trước? data_version của connection theo dõi đổi khi BẤT KỲ
+        connection nào khác commit, kể cả connection ghi của ta (ingest, lệnh điều khiển):
+        - đổi trong lúc connection ghi không được dùng -> chắc chắn từ bên ngoài;
+        - đổi lẫn với commit của ta -> lần trả connection ghi kế tiếp sẽ phân định (hook checkin),
+          nếu connection ghi rảnh suốt một chu kỳ thì mượn nó để hỏi thẳng (không phải chờ ingest).
+        """
+        version = self._read_data_version()
+        changed = version != self._data_version
+        self._data_version = version
+        with self._watch_lock:
+            busy = self._writer_busy or self._writer_uses > 0
+            self._writer_uses = 0
+            external, self._external = self._external, False
+        if external:
+            self._unsure = False
+            return True
+        if changed and busy:
+            self._unsure = True
+        elif changed or (self._unsure and not busy):
+            # Connection ghi rảnh: hỏi thẳng (đồng thời cập nhật data_version của nó để lần trả
+            # kế tiếp không báo lại đúng thay đổi này)
+            self._unsure = False
+            self._probe_writer()
+            with self._watch_lock:
+                external, self._external = self._external, False
+            return external or changed
+        return False
+
+    def _watch(self):
+        while not self._stop_event.wait(self._revalidate_interval):
+            try:
+                if self._external_change():
+                    self._reconcile()
+                    self._notify_listeners()
+            except Exception as e:
+                logger.error("Revalidation error: %s", e)
+
+    def _notify_listeners(self):
+        if not self._listeners:
+            return
+        db = SessionLocal()
+        try:
+            for callback in self._listeners:
+                try:
+                    callback(db)
+                except Exception as e:
+                    logger.error("Listener error: %s", e)
+        finally:
+            db.close()
+
+    def _reconcile(self):
+        """
+        Có connection khác đã commit. Dòng nào trong DB khác với giá trị tiến trình này đã ghi
+        thì là thay đổi từ bên ngoài -> lấy theo DB. Các dòng do chính ta ghi thì giữ cache
+        (cache luôn mới hơn hoặc bằng DB vì ghi trễ).
+        """
+        db = SessionLocal()
+        try:
+            with self.write_lock:
+                rows = db.query(DeviceState).all()
+                settings_row = db.query(UserSettings).filter(UserSettings.id == 1).first()
+        finally:
+            db.close()
+
+        with self._lock:
+            seen = set()
+            for row in rows:
+                seen.add(row.device_id)
+                if row.device_id not in self._devices or self._written.get(row.device_id) != row.last_updated:
+                    self._store(row.device_id, self._row_to_state(row))
+                    self._written[row.device_id] = row.last_updated
+            # Dòng đã từng được ghi nhưng không còn trong DB -> bị xóa từ bên ngoài
+            for device_id in [d for d in self._written if d not in seen]:
+                self._devices.pop(device_id, None)
+                self._written.pop(device_id, None)
+            if settings_row is not None:
+                settings_state = {k: getattr(settings_row, k) for k in SETTINGS_FIELDS}
+                if settings_state != self._settings:
+                    self._store_settings(settings_state)
+
+    # ============ Nội bộ (gọi khi đã giữ lock) ============
+    def _merge(self, device_id: str, changes: dict, record_time: datetime) -> dict:
+        state = self._devices.get(device_id)
+        state = dict(state) if state is not None else self._empty_state(device_id)
+        state.update(changes)
+        state["last_updated"] = record_time
+        self._store(device_id, state)
+        return state
+
+    def _store(self, device_id: str, state: dict):
+        self._devices[device_id] = state
+        self._versions[device_id] = next(self._counter)
+
+    def _store_settings(self, settings_state: dict):
+        self._settings = settings_state
+        self._settings_version = next(self._counter)
+
+    def _count_sample(self, device_id: str, record_time: datetime):
+        self._history_versions[device_id] = next(self._counter)
+        key = _minute_key(record_time)
+        buckets = self._minutes.setdefault(device_id, deque())
+        if buckets and buckets[-1][0] == key:
+            buckets[-1][1] += 1
+        elif not buckets or buckets[-1][0] < key:
+            buckets.append([key, 1])
+        else:
+            # Mẫu tới muộn (lô gửi bù): cộng vào đúng phút của nó, bỏ qua nếu đã ngoài cửa sổ 24h
+            if key < _minute_key(datetime.now()) - HISTORY_WINDOW_MINUTES:
+                return
+            i = len(buckets)
+            while i > 0 and buckets[i - 1][0] > key:
+                i -= 1
+            if i > 0 and buckets[i - 1][0] == key:
+                buckets[i - 1][1] += 1
+            else:
+                buckets.insert(i, [key, 1])
+        self._counts[device_id] = self._counts.get(device_id, 0) + 1
+        self._prune(device_id, key)
+
+    def _prune(self, device_id: str, now_key: int):
+        buckets = self._minutes.get(device_id)
+        if not buckets:
+            return
+        oldest_allowed = now_key - HISTORY_WINDOW_MINUTES
+        while buckets and buckets[0][0] < oldest_allowed:
+            _, count = buckets.popleft()
+            self._counts[device_id] -= count
+
+    @staticmethod
+    def _empty_state(device_id: str) -> dict:
+        return {
+            "device_id": device_id, "is_on": False, "brightness": 0,
+            "sensor_value": 0, "is_auto_mode": False, "last_updated": None, "rules_armed": None,
+        }
+
+    @staticmethod
+    def _row_to_state(row: DeviceState) -> dict:
+        return {
+            "device_id": row.device_id,
+            "is_on": bool(row.is_on),
+            "brightness": row.brightness or 0,
+            "sensor_value": row.sensor_value or 0,
+            "is_auto_mode": bool(row.is_auto_mode),
+            "last_updated": row.last_updated,
+            "rules_armed": None if row.rules_armed is None else bool(row.rules_armed),
+        }
+
+    @staticmethod
+    def _load_settings(db):
+        row = db.query(UserSettings).filter(UserSettings.id == 1).first()
+        if row is None:
+            return None
+        return {k: getattr(row, k) for k in SETTINGS_FIELDS}
+
+
+def upsert_device_states(db, states):
+    """
+    Ghi danh sách trạng thái thiết bị xuống bảng device_state bằng MỘT câu lệnh
+    INSERT ... ON CONFLICT(device_id) DO UPDATE (không cần SELECT trước), chỉ khi last_updated mới hơn.
+    Caller phải giữ state_cache.write_lock cho tới khi commit xong.
+    """
+    rows = [{k: s[k] for k in STATE_FIELDS} for s in states]
+    if not rows:
+        return
+    for row in rows:
+        state_cache.note_written(row["device_id"], row["last_updated"])
+    stmt = sqlite_insert(DeviceState)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[DeviceState.device_id],
+        set_={k: stmt.excluded[k] for k in STATE_FIELDS if k != "device_id"},
+        # Lô ingest (telemetry cũ hơn) ghi sau lệnh điều khiển không được đè trạng thái mới hơn
+        where=(DeviceState.last_updated.is_(None)) | (stmt.excluded.last_updated >= DeviceState.last_updated),
+    )
+    db.execute(stmt, rows)
+
+
+state_cache = DeviceStateCache(revalidate_interval=settings.STATE_CACHE_REVALIDATE_INTERVAL)
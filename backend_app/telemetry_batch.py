@@ -0,0 +1,81 @@
+import threading
+from collections import deque
+from datetime import datetime
+from operator import itemgetter
+from .config import settings
+
+
+class ClockSync:
+    """
+    Độ lệch đồng hồ của từng thiết bị so với server (giây): giờ server = giờ thiết bị + offset.
+    Mỗi lô có sent_at cho một lần đo offset = giờ nhận - sent_at, luôn lớn hơn offset thật đúng bằng
+    độ trễ mạng, nên lấy giá trị nhỏ nhất trong `window` lần đo gần nhất. Đồng hồ thiết bị nhảy
+    (khởi động lại khi dùng uptime, NTP chỉnh giờ) lệch quá resync_seconds thì bỏ các lần đo cũ.
+    """
+
+    def __init__(self, window: int, resync_seconds: float):
+        self._window = max(1, window)
+        self._resync = resync_seconds
+        self._measured = {}         # device_id -> deque các lần đo offset
+        self._lock = threading.Lock()
+        self.resyncs = 0
+
+    def observe(self, device_id: str, device_time: float, received: float) -> float:
+        """Ghi nhận một lần đo (device_time theo đồng hồ thiết bị, received = time.time()), trả về offset ước lượng"""
+        measured = received - device_time
+        with self._lock:
+            history = self._measured.get(device_id)
+            if history is None:
+                history = self._measured[device_id] = deque(maxlen=self._window)
+            elif abs(measured - min(history)) > self._resync:
+                history.clear()
+                self.resyncs += 1
+            history.append(measured)
+            return min(history)
+
+    def offset(self, device_id: str):
+        with self._lock:
+            history = self._measured.get(device_id)
+            return min(history) if history else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            devices = len(self._measured)
+        return {"devices": devices, "resyncs": self.resyncs}
+
+
+def batch_samples(device_id: str, data: dict, received: float) -> list:
+    """
+    Bản tin nhiều mẫu {"samples": [...], "sent_at": ...} -> [(record_time, mẫu)] sắp xếp theo thời gian.
+    Mỗi mẫu có "t" (giờ theo đồng hồ thiết bị: epoch hay uptime đều được, hiệu chỉnh bằng ClockSync)
+    hoặc "age" (số giây trước lúc nhận); không có cả hai thì lấy giờ nhận. Không có sent_at thì coi
+    mẫu có "t" lớn nhất là lúc gửi. Giờ sau thời điểm nhận bị kẹp lại bằng giờ nhận.
+    """
+    samples = data["samples"]
+    if not isinstance(samples, list) or not samples:
+        raise ValueError("samples must be a non-empty list")
+    if len(samples) > settings.TELEMETRY_BATCH_MAX_SAMPLES:
+        raise ValueError(f"batch has {len(samples)} samples, limit is {settings.TELEMETRY_BATCH_MAX_SAMPLES}")
+
+    device_times = [sample["t"] for sample in samples if "t" in sample]
+    sent_at = data.get("sent_at", max(device_times, default=None))
+    offset = clock_sync.observe(device_id, sent_at, received) if sent_at is not None else None
+
+    timed = []
+    for sample in samples:
+        if "t" in sample and offset is not None:
+            ts = sample["t"] + offset
+        elif "age" in sample:
+            ts = received - sample["age"]
+        else:
+            ts = received
+        timed.append((min(ts, received), sample))
+    # Mẫu có thể tới không theo thứ tự (thiết bị gửi lại phần đệm sau khi mất kết nối)
+    timed.sort(key=itemgetter(0))
+    return [(datetime.fromtimestamp(ts), sample) for ts, sample in timed]
+
+
+clock_sync = ClockSync(
+    window=settings.CLOCK_SYNC_WINDOW,
+    resync_seconds=settings.CLOCK_RESYNC_SECONDS,
+)
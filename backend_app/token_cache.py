@@ -0,0 +1,112 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event, inspect
+from .config import settings
+from .models.device import User
+
+
+class TokenCache:
+    """
+    Cache LRU/TTL cho token đã xác thực: token -> User (đã tách khỏi session).
+    - Mỗi mục hết hạn sau ttl giây nhưng không bao giờ muộn hơn exp của JWT.
+    - Bị xóa ngay khi User bị sửa/xóa trong tiến trình (ORM event) và được kiểm tra lại
+      khi bảng users thay đổi từ tiến trình khác (create_user.py) qua thread theo dõi của state_cache.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # token -> (hết hạn - epoch giây, User)
+        self._by_user = {}              # username -> set[token]
+        self._users_fingerprint = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, token: str):
+        """User đã xác thực cho token, None nếu chưa có trong cache hoặc đã hết hạn."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    self._remove(token)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, token: str, user: User, exp: float):
+        expires_at = min(time.time() + self._ttl, exp)
+        with self._lock:
+            if token in self._entries:
+                self._remove(token)
+            self._entries[token] = (expires_at, user)
+            self._by_user.setdefault(user.username, set()).add(token)
+            while len(self._entries) > self._max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_user(self, username: str):
+        with self._lock:
+            for token in list(self._by_user.get(username, ())):
+                self._remove(token)
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+            self.invalidations += 1
+
+    def revalidate(self, db):
+        """
+        Gọi khi DB bị sửa từ connection khác: so dấu vân tay của bảng users (nhỏ), có thay đổi
+        thì xóa toàn bộ cache. Thay đổi ở các bảng khác (ingest, control) không làm mất cache.
+        """
+        digest = hashlib.sha1()
+        for row in db.query(User.id, User.username, User.hashed_password).order_by(User.id):
+            digest.update(repr(tuple(row)).encode())
+        fingerprint = digest.hexdigest()
+        if self._users_fingerprint is not None and fingerprint != self._users_fingerprint:
+            self.clear()
+        self._users_fingerprint = fingerprint
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self._max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def _remove(self, token: str):
+        """Gọi khi đã giữ lock"""
+        _, user = self._entries.pop(token)
+        tokens = self._by_user.get(user.username)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._by_user[user.username]
+
+
+token_cache = TokenCache(max_size=settings.TOKEN_CACHE_MAX_SIZE, ttl=settings.TOKEN_CACHE_TTL)
+
+
+# ============ Xóa cache khi User bị sửa/xóa trong tiến trình ============
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_user_tokens(mapper, connection, target):
+    # Đổi username thì token cũ gắn với username trước đó
+    for username in inspect(target).attrs.username.history.deleted or ():
+        token_cache.invalidate_user(username)
+    token_cache.invalidate_user(target.username)
@@ -0,0 +1,38 @@
+"""
+Script tính lại các bảng rollup (phút/giờ/ngày) từ dữ liệu sensor_history có sẵn trong smartlight.db.
+Nên chạy khi server đang tắt (server sẽ tự cập nhật rollup tăng dần cho dữ liệu mới).
+
+    python backfill_rollups.py              # tất cả thiết bị
+    python backfill_rollups.py <device_id>  # một thiết bị
+"""
+import sys
+import time
+from backend_app.database import SessionLocal, engine, Base, migrate_schema
+from backend_app.models.device import SensorRollupMinute, SensorRollupHour, SensorRollupDay
+from backend_app.rollups import backfill
+
+def main():
+    device_id = sys.argv[1] if len(sys.argv) > 1 else None
+
+    print("=" * 50)
+    print("📊 BACKFILL ROLLUP LỊCH SỬ CẢM BIẾN")
+    print("=" * 50)
+
+    Base.metadata.create_all(bind=engine)
+    migrate_schema()
+
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        backfill(db, device_id)
+        db.commit()
+        elapsed = time.perf_counter() - started
+
+        print(f"✅ Hoàn tất trong {elapsed:.2f}s ({'thiết bị ' + device_id if device_id else 'tất cả thiết bị'})")
+        for model in (SensorRollupMinute, SensorRollupHour, SensorRollupDay):
+            print(f"   - {model.__tablename__}: {db.query(model).count()} dòng")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
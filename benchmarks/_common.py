@@ -0,0 +1,11 @@
+"""Hàm dùng chung cho các script benchmark (chạy trực tiếp: python benchmarks/bench_*.py)."""
+
+
+def percentile(values, p):
+    """Phân vị p (0-100) có nội suy tuyến tính, 0.0 nếu không có mẫu"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
@@ -0,0 +1,106 @@
+"""
+Benchmark: tốc độ giải mã payload status theo từng codec (backend_app/payload_codecs.py).
+
+Mỗi codec giải mã cùng một tập --messages bản tin ngẫu nhiên (4 trường is_on, brightness, sensor_value,
+is_auto_mode) qua decode_payload, giống on_message: nhận diện theo byte đầu payload ("auto": byte định dạng, hoặc '{' với JSON) hoặc
+chọn bằng hậu tố topic ("topic"). "json-legacy" là cách cũ msg.payload.decode() + json.loads để so sánh.
+Codec thiếu thư viện (msgpack, cbor2) được bỏ qua.
+
+    python benchmarks/bench_codecs.py
+    python benchmarks/bench_codecs.py --messages 200000 --repeat 7 --json codecs.json
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from _common import percentile
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from backend_app.payload_codecs import CODECS, decode_payload, encode_payload  # noqa: E402
+
+
+def make_samples(count: int) -> list:
+    return [
+        {
+            "is_on": random.random() < 0.5, "brightness": random.randint(0, 100),
+            "sensor_value": random.randint(0, 1023), "is_auto_mode": random.random() < 0.5,
+        }
+        for _ in range(count)
+    ]
+
+
+def decode_legacy(payloads: list):
+    for payload in payloads:
+        json.loads(payload.decode())
+
+
+def decode_by_byte(payloads: list):
+    for payload in payloads:
+        decode_payload(payload)
+
+
+def decode_by_topic(payloads: list, name: str):
+    for payload in payloads:
+        decode_payload(payload, name)
+
+
+def measure(fn, payloads: list, repeat: int) -> dict:
+    """Chạy fn trên cả tập bản tin `repeat` lần, trả về thông lượng và thời gian mỗi bản tin"""
+    rates = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(payloads)
+        rates.append(len(payloads) / (time.perf_counter() - started))
+    per_message_ns = [1e9 / rate for rate in rates]
+    return {
+        "msgs_per_s": round(statistics.median(rates)),
+        "best_msgs_per_s": round(max(rates)),
+        "ns_per_msg_p50": round(percentile(per_message_ns, 50), 1),
+        "ns_per_msg_max": round(max(per_message_ns), 1),
+        "bytes_per_msg": round(sum(len(p) for p in payloads) / len(payloads), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=100000, help="Số bản tin mỗi lượt đo")
+    parser.add_argument("--repeat", type=int, default=5, help="Số lượt đo mỗi codec (lấy trung vị)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    samples = make_samples(args.messages)
+    # Bản tin JSON giống firmware hiện tại (json.dumps mặc định, có khoảng trắng)
+    legacy = [json.dumps(s).encode() for s in samples]
+
+    results = {"json-legacy": measure(decode_legacy, legacy, args.repeat)}
+    for name in CODECS:
+        with_byte = [encode_payload(s, name) for s in samples]
+        results[f"{name}/auto"] = measure(decode_by_byte, with_byte, args.repeat)
+        plain = [encode_payload(s, name, format_byte=False) for s in samples]
+        results[f"{name}/topic"] = measure(lambda p, name=name: decode_by_topic(p, name), plain, args.repeat)
+
+    baseline = results["json-legacy"]["msgs_per_s"]
+    print(f"{'codec':<22} {'msgs/s':>11} {'best':>11} {'ns/msg':>9} {'bytes':>7} {'speedup':>8}"
+          f"   messages={args.messages}, repeat={args.repeat}")
+    for name, r in results.items():
+        print(f"{name:<22} {r['msgs_per_s']:>11} {r['best_msgs_per_s']:>11} {r['ns_per_msg_p50']:>9} "
+              f"{r['bytes_per_msg']:>7} {r['msgs_per_s'] / baseline:>7.2f}x")
+    missing = {"msgpack", "cbor"} - set(CODECS)
+    if missing:
+        print(f"skipped (library not installed): {', '.join(sorted(missing))}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"params": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Benchmark: thông lượng đọc/ghi đồng thời của từng storage profile (settings.DB_PROFILES).
+
+Mỗi profile chạy trên một file DB tạm riêng (không đụng smartlight.db):
+    - 1 writer  : giống ingest writer, mỗi transaction insert một lô bản ghi lịch sử qua connection ghi
+    - N reader  : giống API lịch sử, truy vấn khoảng 10 phút gần nhất qua pool connection đọc
+
+    python benchmarks/bench_db_profiles.py
+    python benchmarks/bench_db_profiles.py --readers 8 --batch 50 --duration 15 --json result.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from _common import percentile
+
+ROOT = Path(__file__).resolve().parent.parent
+WORKDIR = tempfile.mkdtemp(prefix="bench_profiles_")
+# Engine mặc định của backend_app trỏ vào DB tạm, tránh tạo/sửa smartlight.db khi import
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{WORKDIR}/unused.db")
+sys.path.insert(0, str(ROOT))
+
+from sqlalchemy import insert, select, func  # noqa: E402
+from backend_app.config import settings  # noqa: E402
+from backend_app.database import Base, create_db_engine  # noqa: E402
+from backend_app.models.device import SensorHistory  # noqa: E402
+
+
+def make_rows(start: datetime, count: int, offset: int = 0):
+    return [
+        {
+            "device_id": str((offset + i) % 10), "sensor_value": (offset + i) % 1024,
+            "brightness": (offset + i) % 101, "is_on": True, "is_auto_mode": False,
+            "timestamp": start + timedelta(milliseconds=100 * (offset + i)),
+        }
+        for i in range(count)
+    ]
+
+
+def run_profile(profile: str, args) -> dict:
+    url = f"sqlite:///{WORKDIR}/{profile}.db"
+    write_engine = create_db_engine(url, profile, pool_size=1, max_overflow=0)
+    read_engine = create_db_engine(url, profile, pool_size=args.readers, max_overflow=0)
+    Base.metadata.create_all(bind=write_engine)
+
+    base = datetime.now() - timedelta(milliseconds=100 * args.seed_rows)
+    with write_engine.begin() as conn:
+        for offset in range(0, args.seed_rows, 10000):
+            conn.execute(insert(SensorHistory), make_rows(base, min(10000, args.seed_rows - offset), offset))
+
+    stop = threading.Event()
+    written = [0, 0]            # [số dòng, số transaction]
+    write_latencies = []
+    read_latencies = [[] for _ in range(args.readers)]
+    errors = []
+
+    def writer():
+        offset = args.seed_rows
+        while not stop.is_set():
+            rows = make_rows(base, args.batch, offset)
+            offset += args.batch
+            started = time.perf_counter()
+            try:
+                with write_engine.begin() as conn:
+                    conn.execute(insert(SensorHistory), rows)
+            except Exception as e:
+                errors.append(repr(e))
+                continue
+            write_latencies.append((time.perf_counter() - started) * 1000)
+            written[0] += args.batch
+            written[1] += 1
+
+    def reader(i: int):
+        device_id = str(i % 10)
+        while not stop.is_set():
+            since = datetime.now() - timedelta(minutes=10)
+            started = time.perf_counter()
+            try:
+                with read_engine.connect() as conn:
+                    conn.execute(
+                        select(SensorHistory.timestamp, SensorHistory.sensor_value, SensorHistory.brightness)
+                        .where(SensorHistory.device_id == device_id, SensorHistory.timestamp >= since)
+                        .order_by(SensorHistory.timestamp)
+                    ).all()
+            except Exception as e:
+                errors.append(repr(e))
+                continue
+            read_latencies[i].append((time.perf_counter() - started) * 1000)
+
+    threads = [threading.Thread(target=writer)] + [
+        threading.Thread(target=reader, args=(i,)) for i in range(args.readers)
+    ]
+    for t in threads:
+        t.start()
+    time.sleep(args.duration)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    with read_engine.connect() as conn:
+        journal = conn.exec_driver_sql("PRAGMA journal_mode").scalar()
+        total_rows = conn.execute(select(func.count()).select_from(SensorHistory)).scalar()
+    write_engine.dispose()
+    read_engine.dispose()
+
+    reads = [x for lat in read_latencies for x in lat]
+    return {
+        "journal_mode": journal,
+        "writes_rows_per_s": round(written[0] / args.duration, 1),
+        "write_tx_per_s": round(written[1] / args.duration, 1),
+        "write_p99_ms": round(percentile(write_latencies, 99), 2),
+        "reads_per_s": round(len(reads) / args.duration, 1),
+        "read_p50_ms": round(percentile(reads, 50), 2),
+        "read_p99_ms": round(percentile(reads, 99), 2),
+        "errors": len(errors),
+        "total_rows": total_rows,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", nargs="+", default=list(settings.DB_PROFILES), help="Các profile cần đo")
+    parser.add_argument("--readers", type=int, default=4, help="Số thread đọc đồng thời")
+    parser.add_argument("--batch", type=int, default=20, help="Số bản ghi mỗi transaction ghi")
+    parser.add_argument("--seed-rows", type=int, default=200000, help="Số bản ghi có sẵn trước khi đo")
+    parser.add_argument("--duration", type=float, default=10.0, help="Thời gian đo mỗi profile (giây)")
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    print(f"DB files in {WORKDIR}")
+    results = {}
+    for profile in args.profiles:
+        results[profile] = run_profile(profile, args)
+        print(f"[{profile}] {results[profile]}")
+
+    print()
+    print(f"{'profile':<12} {'journal':>8} {'rows/s':>10} {'tx/s':>8} {'w p99':>8} {'reads/s':>9} {'r p50':>8} {'r p99':>8} {'errors':>7}")
+    for profile, r in results.items():
+        print(f"{profile:<12} {r['journal_mode']:>8} {r['writes_rows_per_s']:>10} {r['write_tx_per_s']:>8} "
+              f"{r['write_p99_ms']:>8} {r['reads_per_s']:>9} {r['read_p50_ms']:>8} {r['read_p99_ms']:>8} {r['errors']:>7}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"params": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
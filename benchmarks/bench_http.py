@@ -0,0 +1,244 @@
+"""
+Benchmark: độ trễ và thông lượng của REST API, chạy trong tiến trình với FastAPI `app` (backend_app/main.py).
+
+Gửi request qua httpx.ASGITransport (không qua mạng), N client đồng thời, mỗi request chọn ngẫu nhiên
+một endpoint theo tỉ lệ --mix. DB được seed ở file tạm (hoặc --db, dùng lại nếu đã có dữ liệu) với
+--rows bản ghi SensorHistory trải đều trong --days ngày gần nhất, sau đó backfill rollup.
+
+    python benchmarks/bench_http.py
+    python benchmarks/bench_http.py --rows 10000000 --db /tmp/bench_10m.db --concurrency 32 --duration 30
+    python benchmarks/bench_http.py --mix status=60,dashboard=20,history=10,by-date=10 --profile slowest.prof
+
+--profile: sau khi đo, chạy lại endpoint chậm nhất (p99) tuần tự dưới cProfile và ghi file .prof
+(xem bằng `python -m pstats slowest.prof` hoặc snakeviz). Trong lúc profile, truy vấn DB chạy thẳng
+trên event loop (DB_OFFLOAD tắt) để cProfile thấy được cả phần việc của thread pool.
+"""
+import argparse
+import asyncio
+import contextlib
+import cProfile
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import httpx
+
+from _common import percentile
+
+ROOT = Path(__file__).resolve().parent.parent
+USERNAME, PASSWORD = "bench", "bench"
+DEFAULT_MIX = "token=2,status=50,dashboard=20,history=18,by-date=10"
+SEED_BATCH = 10000
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - set(ENDPOINTS)
+    if unknown:
+        raise SystemExit(f"unknown endpoints in --mix: {', '.join(sorted(unknown))} (available: {', '.join(ENDPOINTS)})")
+    return mix
+
+
+# ============ Endpoint ============
+# Mỗi endpoint: (method, hàm tạo (url, tham số) từ danh sách ngày có dữ liệu)
+ENDPOINTS = {
+    "token": ("POST", lambda days: ("/token", None)),
+    "status": ("GET", lambda days: ("/api/device/status", None)),
+    "dashboard": ("GET", lambda days: ("/api/device/dashboard", None)),
+    "history": ("GET", lambda days: ("/api/device/history", {"hours": 24, "limit": 100})),
+    "by-date": ("GET", lambda days: ("/api/device/history/by-date", {"target_date": random.choice(days).isoformat()})),
+}
+
+
+async def call(client: httpx.AsyncClient, name: str, days: list):
+    method, build = ENDPOINTS[name]
+    url, params = build(days)
+    if method == "POST":
+        response = await client.post(url, data={"username": USERNAME, "password": PASSWORD})
+    else:
+        response = await client.get(url, params=params)
+    response.raise_for_status()
+
+
+# ============ Seed DB ============
+def seed(rows: int, devices: int, days: int):
+    """Tạo user benchmark + `rows` mẫu cảm biến của `devices` thiết bị trong `days` ngày gần nhất"""
+    from sqlalchemy import insert, select, func
+    from backend_app.config import settings
+    from backend_app.database import write_engine, Base, SessionLocal, migrate_schema
+    from backend_app.models.device import SensorHistory, User
+    from backend_app.routers.auth import get_password_hash
+    from backend_app.rollups import backfill
+
+    Base.metadata.create_all(bind=write_engine)
+    migrate_schema()
+    with SessionLocal() as db:
+        existing = db.execute(select(func.count()).select_from(SensorHistory)).scalar()
+        has_user = db.query(User).filter(User.username == USERNAME).first() is not None
+    if not has_user:
+        with SessionLocal() as db:
+            db.add(User(username=USERNAME, hashed_password=get_password_hash(PASSWORD)))
+            db.commit()
+    if existing:
+        print(f"Reusing existing DB with {existing} rows")
+        return
+
+    device_ids = [settings.DEFAULT_DEVICE_ID] + [f"bench{i}" for i in range(1, devices)]
+    end = datetime.now()
+    start = end - timedelta(days=days)
+    step = (end - start) / rows
+    started = time.perf_counter()
+    with write_engine.begin() as conn:
+        batch = []
+        for i in range(rows):
+            batch.append({
+                "device_id": device_ids[i % len(device_ids)], "sensor_value": (i * 7) % 1024,
+                "brightness": (i // 600) % 101, "is_on": (i // 3600) % 2 == 0, "is_auto_mode": False,
+                "timestamp": start + step * i,
+            })
+            if len(batch) == SEED_BATCH:
+                conn.execute(insert(SensorHistory), batch)
+                batch = []
+                if (i + 1) % 1000000 == 0:
+                    print(f"  {i + 1} rows ({time.perf_counter() - started:.0f}s)")
+        if batch:
+            conn.execute(insert(SensorHistory), batch)
+    print(f"Seeded {rows} rows in {time.perf_counter() - started:.1f}s, backfilling rollups ...")
+    with SessionLocal() as db:
+        backfill(db)
+        db.commit()
+
+
+# ============ Đo ============
+async def run_load(app, mix: dict, concurrency: int, duration: float, days: list) -> dict:
+    names, weights = list(mix), list(mix.values())
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+        token = (await client.post("/token", data={"username": USERNAME, "password": PASSWORD})).json()["access_token"]
+        client.headers["Authorization"] = f"Bearer {token}"
+        # Làm nóng cache (token, trạng thái, cài đặt) trước khi đo
+        for name in names:
+            await call(client, name, days)
+
+        stop_at = time.monotonic() + duration
+
+        async def worker():
+            while time.monotonic() < stop_at:
+                name = random.choices(names, weights)[0]
+                started = time.perf_counter()
+                try:
+                    await call(client, name, days)
+                except Exception:
+                    errors[name] += 1
+                    continue
+                latencies[name].append((time.perf_counter() - started) * 1000)
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.monotonic() - started
+
+    return {
+        name: {
+            "requests": len(latencies[name]),
+            "errors": errors[name],
+            "rps": round(len(latencies[name]) / elapsed, 1),
+            "p50_ms": round(percentile(latencies[name], 50), 2),
+            "p95_ms": round(percentile(latencies[name], 95), 2),
+            "p99_ms": round(percentile(latencies[name], 99), 2),
+            "max_ms": round(max(latencies[name], default=0.0), 2),
+        }
+        for name in names
+    }
+
+
+async def profile_endpoint(app, name: str, iterations: int, days: list, path: str):
+    from backend_app.config import settings
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+        token = (await client.post("/token", data={"username": USERNAME, "password": PASSWORD})).json()["access_token"]
+        client.headers["Authorization"] = f"Bearer {token}"
+        offload = settings.DB_OFFLOAD
+        settings.DB_OFFLOAD = False
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            for _ in range(iterations):
+                await call(client, name, days)
+            profiler.disable()
+        finally:
+            settings.DB_OFFLOAD = offload
+    profiler.dump_stats(path)
+
+
+async def bench(args, mix: dict) -> dict:
+    from backend_app.main import app
+
+    today = datetime.now().date()
+    days = [today - timedelta(days=i) for i in range(1, args.days)] or [today]
+    quiet = contextlib.redirect_stdout(io.StringIO()) if not args.verbose else contextlib.nullcontext()
+    with quiet:
+        async with app.router.lifespan_context(app):
+            results = await run_load(app, mix, args.concurrency, args.duration, days)
+            slowest = max(results, key=lambda name: results[name]["p99_ms"])
+            if args.profile:
+                await profile_endpoint(app, slowest, args.profile_iterations, days, args.profile)
+    return {"results": results, "slowest": slowest}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000, help="Số bản ghi SensorHistory cần seed")
+    parser.add_argument("--devices", type=int, default=1, help="Số thiết bị chia nhau các bản ghi (thiết bị mặc định luôn có)")
+    parser.add_argument("--days", type=int, default=30, help="Dữ liệu trải đều trong số ngày gần nhất này")
+    parser.add_argument("--db", help="File DB (mặc định: file tạm). Đã có dữ liệu thì dùng lại, không seed")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Tỉ lệ endpoint, mặc định {DEFAULT_MIX}")
+    parser.add_argument("--concurrency", type=int, default=16, help="Số client đồng thời")
+    parser.add_argument("--duration", type=float, default=20.0, help="Thời gian đo (giây)")
+    parser.add_argument("--profile", help="Ghi cProfile của endpoint chậm nhất ra file .prof")
+    parser.add_argument("--profile-iterations", type=int, default=20, help="Số request khi profile")
+    parser.add_argument("--verbose", action="store_true", help="Giữ log của server")
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="bench_http_"), "smartlight.db")
+    # Phải đặt trước khi import backend_app: engine trỏ vào DB benchmark
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    sys.path.insert(0, str(ROOT))
+
+    print(f"DB: {db_path}")
+    seed(args.rows, args.devices, args.days)
+    report = asyncio.run(bench(args, mix))
+    results = report["results"]
+
+    print()
+    print(f"{'endpoint':<10} {'requests':>9} {'rps':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9} {'errors':>7}"
+          f"   ms, concurrency={args.concurrency}, rows={args.rows}")
+    for name, r in results.items():
+        print(f"{name:<10} {r['requests']:>9} {r['rps']:>8} {r['p50_ms']:>9} {r['p95_ms']:>9} "
+              f"{r['p99_ms']:>9} {r['max_ms']:>9} {r['errors']:>7}")
+    total = sum(r["requests"] for r in results.values())
+    print(f"total {total} requests, {round(total / args.duration, 1)} req/s; slowest p99: {report['slowest']}")
+    if args.profile:
+        print(f"cProfile of '{report['slowest']}' written to {args.profile}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"params": vars(args), **report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
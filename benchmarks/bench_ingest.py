@@ -0,0 +1,271 @@
+"""
+Benchmark: thông lượng ingest MQTT -> DB khi có hàng nghìn đèn ảo gửi telemetry cùng lúc.
+
+Các đèn ảo là coroutine asyncio, mỗi đèn gửi bản tin status giống MockESP32 (test_integration.py)
+lên topic iot/light/<device_id>/status, tổng tần suất cố định (--rate bản tin/giây).
+Phía server là MQTTService.on_message + ingest pipeline thật, ghi vào DB tạm (không đụng smartlight.db).
+
+Hai chế độ vận chuyển:
+    --transport inproc  : broker giả trong tiến trình, một thread duy nhất gọi on_message (giống
+                          network thread của paho). Không cần broker, đo riêng phần server.
+    --transport broker  : broker thật tại settings.MQTT_BROKER:MQTT_PORT (ví dụ mosquitto local),
+                          mqtt_service.connect() như khi chạy server, đèn ảo gửi qua --connections client.
+
+Đo được:
+    - Thông lượng bền vững (bản tin đã commit vào DB mỗi giây) trong thời gian gửi
+    - Độ trễ từ lúc đèn publish tới lúc bản ghi đã commit (p50/p95/p99/max)
+    - Dung lượng DB tăng thêm (tổng và byte/bản ghi)
+
+    python benchmarks/bench_ingest.py
+    python benchmarks/bench_ingest.py --lamps 5000 --rate 10000 --duration 30 --json ingest.json
+    python benchmarks/bench_ingest.py --transport broker --connections 8
+    python benchmarks/bench_ingest.py --codec struct      # payload nhị phân (backend_app/payload_codecs.py)
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import queue
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from _common import percentile
+
+ROOT = Path(__file__).resolve().parent.parent
+WORKDIR = tempfile.mkdtemp(prefix="bench_ingest_")
+DB_PATH = Path(WORKDIR) / "ingest.db"
+# Phải đặt trước khi import backend_app: engine trỏ vào DB tạm
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+sys.path.insert(0, str(ROOT))
+
+import paho.mqtt.client as mqtt  # noqa: E402
+from sqlalchemy import select, func  # noqa: E402
+from backend_app.config import settings  # noqa: E402
+from backend_app.database import write_engine, Base, SessionLocal, migrate_schema  # noqa: E402
+from backend_app.models.device import SensorHistory  # noqa: E402
+from backend_app.mqtt_service import mqtt_service  # noqa: E402
+from backend_app.ingest_service import ingest_pipeline  # noqa: E402
+from backend_app.state_cache import state_cache  # noqa: E402
+from backend_app.rollups import rollup_aggregator  # noqa: E402
+from backend_app.payload_codecs import CODECS, encode_payload  # noqa: E402
+
+
+def db_size() -> int:
+    return sum(p.stat().st_size for p in DB_PATH.parent.glob(DB_PATH.name + "*"))
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+# ============ Vận chuyển bản tin ============
+class InProcessBroker:
+    """Broker giả: hàng đợi FIFO + một thread gọi on_message, giống network thread của paho"""
+
+    def __init__(self, on_message):
+        self._on_message = on_message
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="fake-paho", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def publish(self, topic: str, payload: bytes):
+        self._queue.put(SimpleNamespace(topic=topic, payload=payload))
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            msg = self._queue.get()
+            if msg is None:
+                return
+            self._on_message(None, None, msg)
+
+
+class BrokerPublisher:
+    """Đèn ảo gửi qua broker thật, chia đều trên một số kết nối paho"""
+
+    def __init__(self, connections: int):
+        self._clients = []
+        for i in range(connections):
+            client = mqtt.Client(client_id=f"bench_lamps_{os.getpid()}_{i}")
+            if settings.MQTT_USERNAME and settings.MQTT_PASSWORD:
+                client.username_pw_set(settings.MQTT_USERNAME, settings.MQTT_PASSWORD)
+            client.connect(settings.MQTT_BROKER, settings.MQTT_PORT, 60)
+            client.loop_start()
+            self._clients.append(client)
+        self._next = 0
+
+    def start(self):
+        # Server: MQTTService thật, subscribe topic wildcard trong on_connect
+        mqtt_service.connect()
+        deadline = time.monotonic() + 10
+        while not mqtt_service.connected and time.monotonic() < deadline:
+            time.sleep(0.05)
+        if not mqtt_service.connected:
+            raise RuntimeError(f"cannot connect to broker {settings.MQTT_BROKER}:{settings.MQTT_PORT}")
+
+    def publish(self, topic: str, payload: bytes):
+        client = self._clients[self._next]
+        self._next = (self._next + 1) % len(self._clients)
+        client.publish(topic, payload)
+
+    def stop(self):
+        for client in self._clients:
+            client.loop_stop()
+            client.disconnect()
+        mqtt_service.client.loop_stop()
+
+
+# ============ Đèn ảo ============
+async def lamp(device_id: str, interval: float, stop_at: float, transport, publish_times: list, codec: str):
+    topic = f"iot/light/{device_id}/status"
+    sensor = random.randint(0, 1023)
+    brightness = random.randint(0, 100)
+    await asyncio.sleep(random.uniform(0, interval))     # Trải đều pha để tổng tần suất ổn định
+    next_at = time.monotonic()
+    while next_at < stop_at:
+        sensor = min(1023, max(0, sensor + random.randint(-20, 20)))
+        if codec == "json":
+            payload = json.dumps({
+                "is_on": brightness > 0, "brightness": brightness, "sensor_value": sensor,
+                "is_auto_mode": False, "timestamp": int(time.time()),
+            }).encode()
+        else:
+            payload = encode_payload({
+                "is_on": brightness > 0, "brightness": brightness, "sensor_value": sensor, "is_auto_mode": False,
+            }, codec)
+        publish_times.append(time.perf_counter())
+        transport.publish(topic, payload)
+        next_at += interval
+        await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+
+
+async def run_lamps(args, transport, publish_times: list) -> float:
+    interval = args.lamps / args.rate
+    started = time.monotonic()
+    stop_at = started + args.duration
+    await asyncio.gather(*(
+        lamp(f"bench{i}", interval, stop_at, transport, publish_times, args.codec) for i in range(args.lamps)
+    ))
+    return time.monotonic() - started
+
+
+def watch_commits(publish_times: list, lags: list, timeline: list, stop: threading.Event):
+    """
+    Theo dõi số bản tin đã commit (ingest_pipeline.flushed_messages). Bản tin đi qua hàng đợi FIFO
+    nên bản tin commit thứ k là bản tin publish thứ k: độ trễ = lúc thấy commit - lúc publish.
+    """
+    seen = 0
+    started = time.perf_counter()
+    while not stop.is_set():
+        flushed = ingest_pipeline.flushed_messages + ingest_pipeline.dropped
+        now = time.perf_counter()
+        if flushed > seen:
+            upto = min(flushed, len(publish_times))
+            lags.extend((now - publish_times[k]) * 1000 for k in range(seen, upto))
+            seen = upto
+            timeline.append((round(now - started, 3), ingest_pipeline.flushed_messages))
+        time.sleep(0.005)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lamps", type=int, default=2000, help="Số đèn ảo")
+    parser.add_argument("--rate", type=float, default=4000, help="Tổng số bản tin mỗi giây của cả hệ thống")
+    parser.add_argument("--duration", type=float, default=15.0, help="Thời gian gửi (giây)")
+    parser.add_argument("--transport", choices=("inproc", "broker"), default="inproc")
+    parser.add_argument("--codec", choices=sorted(CODECS), default="json", help="Định dạng payload của đèn ảo")
+    parser.add_argument("--connections", type=int, default=4, help="Số kết nối paho cho đèn ảo (chế độ broker)")
+    parser.add_argument("--drain-timeout", type=float, default=30.0, help="Thời gian chờ ghi nốt sau khi ngừng gửi (giây)")
+    parser.add_argument("--verbose", action="store_true", help="Giữ log của server (mặc định tắt để không đo chi phí in ra màn hình)")
+    parser.add_argument("--json", help="Ghi báo cáo ra file JSON")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=write_engine)
+    migrate_schema()
+    state_cache.load()
+    with SessionLocal() as db:
+        rollup_aggregator.warm(db)
+    ingest_pipeline.start()
+    size_before = db_size()
+
+    transport = InProcessBroker(mqtt_service.on_message) if args.transport == "inproc" else BrokerPublisher(args.connections)
+    publish_times, lags, timeline = [], [], []
+    stop_watch = threading.Event()
+    watcher = threading.Thread(target=watch_commits, args=(publish_times, lags, timeline, stop_watch), daemon=True)
+
+    print(f"DB: {DB_PATH}")
+    print(f"{args.lamps} lamps, {args.rate:.0f} msg/s target, {args.duration}s, transport={args.transport}")
+    quiet = contextlib.redirect_stdout(io.StringIO()) if not args.verbose else contextlib.nullcontext()
+    with quiet:
+        transport.start()
+        watcher.start()
+        send_seconds = asyncio.run(run_lamps(args, transport, publish_times))
+        committed_during_send = ingest_pipeline.flushed_messages
+
+        # Chờ ghi nốt phần còn lại
+        deadline = time.monotonic() + args.drain_timeout
+        while ingest_pipeline.flushed_messages + ingest_pipeline.dropped < len(publish_times) \
+                and time.monotonic() < deadline:
+            time.sleep(0.05)
+        drain_seconds = time.monotonic() - (deadline - args.drain_timeout)
+        transport.stop()
+        stop_watch.set()
+        watcher.join()
+        ingest_pipeline.stop()
+
+    with SessionLocal() as db:
+        rows = db.execute(select(func.count()).select_from(SensorHistory)).scalar()
+    size_after = db_size()
+    published = len(publish_times)
+    stats = ingest_pipeline.stats()
+
+    report = {
+        "revision": git_revision(),
+        "params": vars(args),
+        "published": published,
+        "publish_rate": round(published / send_seconds, 1),
+        "committed_rows": rows,
+        "dropped": stats["dropped"],
+        "lost": published - rows - stats["dropped"],
+        "sustained_rows_per_s": round(committed_during_send / send_seconds, 1),
+        "drain_seconds": round(drain_seconds, 3),
+        "lag_p50_ms": round(percentile(lags, 50), 2),
+        "lag_p95_ms": round(percentile(lags, 95), 2),
+        "lag_p99_ms": round(percentile(lags, 99), 2),
+        "lag_max_ms": round(max(lags, default=0.0), 2),
+        "db_growth_bytes": size_after - size_before,
+        "db_bytes_per_row": round((size_after - size_before) / rows, 1) if rows else 0.0,
+        "ingest": stats,
+        "commit_timeline": timeline,
+    }
+
+    print()
+    for key in ("published", "publish_rate", "committed_rows", "dropped", "lost", "sustained_rows_per_s",
+                "drain_seconds", "lag_p50_ms", "lag_p95_ms", "lag_p99_ms", "lag_max_ms",
+                "db_growth_bytes", "db_bytes_per_row"):
+        print(f"{key:<22} {report[key]}")
+    print(f"{'flush batches':<22} {stats['flushed_batches']} (avg {stats['avg_flush_ms']} ms, max {stats['max_flush_ms']} ms)")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Benchmark: độ trễ của GET /api/device/status khi có nhiều request /history/by-date nặng chạy song song.
+
+So sánh 2 chế độ của server (biến môi trường DB_OFFLOAD):
+    DB_OFFLOAD=0  -> truy vấn DB chạy thẳng trên event loop (cách cũ)
+    DB_OFFLOAD=1  -> truy vấn DB chạy trên thread pool riêng (run_db)
+
+Mỗi chế độ khởi động một server uvicorn thật trên DB tạm (không đụng smartlight.db).
+
+    python benchmarks/bench_status_latency.py
+    python benchmarks/bench_status_latency.py --rows 172800 --loaders 8 --duration 20 --json result.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import httpx
+
+from _common import percentile
+
+ROOT = Path(__file__).resolve().parent.parent
+USERNAME, PASSWORD = "bench", "bench"
+
+
+def seed(db_url: str, rows: int, day: datetime):
+    """Tạo DB tạm: user benchmark + `rows` mẫu cảm biến trải đều trong ngày `day`"""
+    os.environ["DATABASE_URL"] = db_url
+    sys.path.insert(0, str(ROOT))
+    from sqlalchemy import insert
+    from backend_app.database import engine, Base, SessionLocal, migrate_schema
+    from backend_app.models.device import SensorHistory, User
+    from backend_app.routers.auth import get_password_hash
+
+    Base.metadata.create_all(bind=engine)
+    migrate_schema()
+    with SessionLocal() as db:
+        db.add(User(username=USERNAME, hashed_password=get_password_hash(PASSWORD)))
+        db.commit()
+    step = 86400 / rows
+    batch = []
+    with engine.begin() as conn:
+        for i in range(rows):
+            batch.append({
+                "device_id": "1", "sensor_value": (i * 7) % 1024, "brightness": (i // 600) % 101,
+                "is_on": (i // 3600) % 2 == 0, "is_auto_mode": False,
+                "timestamp": day + timedelta(seconds=i * step),
+            })
+            if len(batch) == 10000:
+                conn.execute(insert(SensorHistory), batch)
+                batch = []
+        if batch:
+            conn.execute(insert(SensorHistory), batch)
+    engine.dispose()
+
+
+def start_server(db_url: str, port: int, offload: bool):
+    env = dict(os.environ, DATABASE_URL=db_url, DB_OFFLOAD="1" if offload else "0")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend_app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=str(ROOT), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+async def run_load(base_url: str, day: datetime, loaders: int, duration: float, probe_interval: float) -> dict:
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        await wait_ready(client)
+        token = (await client.post("/token", data={"username": USERNAME, "password": PASSWORD})).json()["access_token"]
+        client.headers["Authorization"] = f"Bearer {token}"
+
+        stop_at = time.monotonic() + duration
+        status_latencies, history_latencies = [], []
+
+        async def heavy():
+            while time.monotonic() < stop_at:
+                started = time.perf_counter()
+                r = await client.get("/api/device/history/by-date", params={"target_date": day.date().isoformat()})
+                r.raise_for_status()
+                history_latencies.append((time.perf_counter() - started) * 1000)
+
+        async def probe():
+            while time.monotonic() < stop_at:
+                started = time.perf_counter()
+                (await client.get("/api/device/status")).raise_for_status()
+                status_latencies.append((time.perf_counter() - started) * 1000)
+                await asyncio.sleep(probe_interval)
+
+        await asyncio.gather(probe(), *(heavy() for _ in range(loaders)))
+
+    return {
+        "status_requests": len(status_latencies),
+        "status_p50_ms": round(percentile(status_latencies, 50), 2),
+        "status_p95_ms": round(percentile(status_latencies, 95), 2),
+        "status_p99_ms": round(percentile(status_latencies, 99), 2),
+        "status_max_ms": round(max(status_latencies, default=0.0), 2),
+        "history_requests": len(history_latencies),
+        "history_avg_ms": round(statistics.fmean(history_latencies), 2) if history_latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=86400, help="Số mẫu trong ngày được truy vấn (mặc định 1 mẫu/giây)")
+    parser.add_argument("--loaders", type=int, default=4, help="Số client gọi /history/by-date liên tục")
+    parser.add_argument("--duration", type=float, default=15.0, help="Thời gian đo mỗi chế độ (giây)")
+    parser.add_argument("--probe-interval", type=float, default=0.02, help="Khoảng nghỉ giữa 2 lần gọi /status (giây)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_status_")
+    db_url = f"sqlite:///{workdir}/bench.db"
+    day = datetime.combine(datetime.now().date() - timedelta(days=1), datetime.min.time())
+    print(f"Seeding {args.rows} rows into {workdir}/bench.db ...")
+    seed(db_url, args.rows, day)
+
+    results = {}
+    for offload in (False, True):
+        mode = "offload" if offload else "inline"
+        server = start_server(db_url, args.port, offload)
+        try:
+            results[mode] = asyncio.run(run_load(
+                f"http://127.0.0.1:{args.port}", day, args.loaders, args.duration, args.probe_interval
+            ))
+        finally:
+            server.terminate()
+            server.wait(10)
+        print(f"[{mode}] {results[mode]}")
+
+    print()
+    print(f"{'mode':<8} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}   /status ms ({args.loaders} concurrent by-date loaders)")
+    for mode, r in results.items():
+        print(f"{mode:<8} {r['status_p50_ms']:>9} {r['status_p95_ms']:>9} {r['status_p99_ms']:>9} {r['status_max_ms']:>9}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"params": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""
+Script thu gọn file smartlight.db: VACUUM toàn bộ (đồng thời chuyển DB cũ sang auto_vacuum=INCREMENTAL
+để server tự trả dung lượng trống về sau) rồi áp dụng chính sách retention.
+VACUUM khóa toàn bộ DB trong lúc chạy - nên chạy khi server đang tắt.
+
+    python compact_db.py
+"""
+import os
+import time
+from backend_app.config import settings
+from backend_app.retention import retention_engine, compact, auto_vacuum_mode
+
+def db_size_mb() -> float:
+    path = settings.DATABASE_URL.replace("sqlite:///", "")
+    return os.path.getsize(path) / 1024 / 1024 if os.path.exists(path) else 0.0
+
+def main():
+    print("=" * 50)
+    print("🧹 THU GỌN DATABASE")
+    print("=" * 50)
+
+    before = db_size_mb()
+    started = time.perf_counter()
+    compact()
+    deleted = retention_engine.apply_policies()
+    print(f"   - Đã xóa {deleted} dòng quá hạn")
+    elapsed = time.perf_counter() - started
+
+    print(f"✅ Hoàn tất trong {elapsed:.2f}s: {before:.1f} MB -> {db_size_mb():.1f} MB")
+    print(f"   - auto_vacuum = {auto_vacuum_mode()} (2 = INCREMENTAL)")
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 """
 Script tạo user admin và khởi tạo cài đặt mặc định cho hệ thống IoT Smart Light
 """
-from backend_app.database import SessionLocal, engine, Base
+from backend_app.database import SessionLocal, engine, Base, migrate_schema
+from backend_app.config import settings
 from backend_app.models.device import User, DeviceState, UserSettings
 from backend_app.routers.auth import get_password_hash
 
@@ -24,14 +25,14 @@ def create_user(username, password):
     finally:
         db.close()
 
-def init_device_state():
+def init_device_state(device_id=settings.DEFAULT_DEVICE_ID):
     """Khởi tạo trạng thái thiết bị mặc định"""
     db = SessionLocal()
     try:
-        device = db.query(DeviceState).filter(DeviceState.id == 1).first()
+        device = db.query(DeviceState).filter(DeviceState.device_id == device_id).first()
         if not device:
             device = DeviceState(
-                id=1,
+                device_id=device_id,
                 is_on=False,
                 brightness=0,
                 sensor_value=0,
@@ -76,6 +77,7 @@ def main():
     # Create all tables
     print("\n📦 Tạo database tables...")
     Base.metadata.create_all(bind=engine)
+    migrate_schema()
     print("✅ Database tables đã sẵn sàng.")
     
     # Create admin user
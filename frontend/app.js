@@ -2,7 +2,9 @@
 const CONFIG = {
     API_URL: 'http://127.0.0.1:8000',    
     POLL_INTERVAL: 2000,                 
-    UPDATE_DELAY: 4000                  
+    UPDATE_DELAY: 4000,
+    STREAM_RECONNECT_DELAY: 5000,        // Thử mở lại WebSocket sau khi mất kết nối
+    CHART_MAX_POINTS: 800                // Server giảm mẫu lịch sử còn tối đa số điểm này
 };
 
 // STATE MANAGEMENT
@@ -18,6 +20,9 @@ const state = {
     },
     
     pollInterval: null,
+    etags: new Map(),           // endpoint -> { etag, data } của lần GET có điều kiện gần nhất
+    socket: null,
+    reconnectTimer: null,
     chartInstance: null,
     isInteracting: false,
     interactionTimeout: null
@@ -71,19 +76,27 @@ const elements = {
 
 async function apiRequest(endpoint, options = {}) {
     const url = `${CONFIG.API_URL}${endpoint}`;
+    const { conditional, ...fetchOptions } = options;
     const headers = { 'Content-Type': 'application/json', ...options.headers };
     
     if (state.token) headers['Authorization'] = `Bearer ${state.token}`;
+
+    // GET có điều kiện: gửi lại ETag lần trước, server trả 304 (không có body) nếu dữ liệu chưa đổi
+    const cached = conditional ? state.etags.get(endpoint) : null;
+    if (cached) headers['If-None-Match'] = cached.etag;
     
     try {
-        const response = await fetch(url, { ...options, headers });
+        const response = await fetch(url, { ...fetchOptions, headers });
         if (response.status === 401) { 
             logout(); 
             throw new Error('Phiên đăng nhập hết hạn'); 
         }
+        if (response.status === 304 && cached) return cached.data;
         
         const data = await response.json();
         if (!response.ok) throw new Error(data.detail || 'Lỗi hệ thống');
+        const etag = conditional && response.headers.get('ETag');
+        if (etag) state.etags.set(endpoint, { etag, data });
         return data;
     } catch (error) {
         if (error.name === 'TypeError') { 
@@ -114,7 +127,7 @@ async function login(username, password) {
  * @returns {Promise}               - Promise trả về trạng thái thiết bị
  */
 async function getDeviceStatus() { 
-    return await apiRequest(`/api/device/status?t=${Date.now()}`); 
+    return await apiRequest('/api/device/status', { conditional: true }); 
 }
 
 
@@ -136,7 +149,7 @@ async function controlDevice(action, options = {}) {
  * @returns {Promise}               - Promise trả về mảng dữ liệu lịch sử
  */
 async function getHistoryByDate(dateStr) {
-    return await apiRequest(`/api/device/history/by-date?target_date=${dateStr}`);
+    return await apiRequest(`/api/device/history/by-date?target_date=${dateStr}&max_points=${CONFIG.CHART_MAX_POINTS}`);
 }
 
 
@@ -213,8 +226,9 @@ function showToast(message, type = 'info') {
 
 function logout() {
     state.token = null;
+    state.etags.clear();
     localStorage.removeItem('access_token');
-    stopPolling();
+    stopLiveUpdates();
     showScreen('login');
 }
 
@@ -365,20 +379,73 @@ function stopPolling() {
 
 async function fetchStatus() {
     try {
-        const status = await getDeviceStatus();
-        state.deviceStatus = status;
-        
-        setConnectionStatus(true);
-        updateDeviceUI();      
-        updateLastUpdated();  
-        updateChartLive();      
-        
+        applyStatus(await getDeviceStatus());
     } catch (error) {
         console.error('Polling error:', error);
         setConnectionStatus(false);
     }
 }
 
+/**
+ * Cập nhật trạng thái mới nhận được (từ WebSocket hoặc polling) lên giao diện
+ * 
+ * @param {object} status 
+ */
+function applyStatus(status) {
+    state.deviceStatus = status;
+    
+    setConnectionStatus(true);
+    updateDeviceUI();      
+    updateLastUpdated();  
+    updateChartLive();      
+}
+
+
+/**
+ * Mở luồng trạng thái thời gian thực qua WebSocket.
+ * Server chỉ đẩy bản tin khi trạng thái thay đổi; nếu WebSocket lỗi/đóng
+ * thì chuyển sang polling và định kỳ thử kết nối lại.
+ */
+function startStream() {
+    clearTimeout(state.reconnectTimer);
+    if (!state.token || state.socket) return;
+
+    const wsUrl = `${CONFIG.API_URL.replace(/^http/, 'ws')}/api/device/stream?token=${encodeURIComponent(state.token)}`;
+    const socket = new WebSocket(wsUrl);
+    state.socket = socket;
+
+    socket.onopen = () => {
+        stopPolling();
+    };
+
+    socket.onmessage = (event) => {
+        applyStatus(JSON.parse(event.data));
+    };
+
+    socket.onclose = () => {
+        state.socket = null;
+        if (!state.token) return;
+        // Fallback: polling cho tới khi mở lại được WebSocket
+        if (!state.pollInterval) startPolling();
+        state.reconnectTimer = setTimeout(startStream, CONFIG.STREAM_RECONNECT_DELAY);
+    };
+}
+
+function startLiveUpdates() {
+    startStream();
+}
+
+function stopLiveUpdates() {
+    clearTimeout(state.reconnectTimer);
+    stopPolling();
+    if (state.socket) {
+        const socket = state.socket;
+        state.socket = null;
+        socket.onclose = null;
+        socket.close();
+    }
+}
+
 
 // EVENT HANDLERS
 function setupEventListeners() {
@@ -402,7 +469,7 @@ function setupEventListeners() {
             elements.historyDateInput.value = today;
             loadAndDrawChart();
 
-            startPolling();
+            startLiveUpdates();
             showToast('Đăng nhập thành công', 'success');
         } catch (err) {
             elements.loginError.textContent = err.message;
@@ -416,7 +483,7 @@ function setupEventListeners() {
     elements.logoutBtn.addEventListener('click', () => {
         state.token = null;
         localStorage.removeItem('access_token');
-        stopPolling();
+        stopLiveUpdates();
         showScreen('login');
     });
 
@@ -526,7 +593,7 @@ document.addEventListener('DOMContentLoaded', async () => {
             elements.historyDateInput.value = today;
             loadAndDrawChart();
 
-            startPolling();
+            startLiveUpdates();
         } catch { 
             logout(); 
         }
@@ -0,0 +1,74 @@
+"""
+Cấu hình chung cho pytest: DB SQLite tạm (phải đặt DATABASE_URL TRƯỚC khi import backend_app),
+app FastAPI chạy qua TestClient (MQTT broker không có -> mqtt_service chỉ log lỗi kết nối).
+"""
+import json
+import os
+import tempfile
+import uuid
+from types import SimpleNamespace
+
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='smartlight-test-')}/test.db"
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend_app.main import app
+from backend_app.database import SessionLocal, WriteSessionLocal
+from backend_app.models.device import User, DeviceState
+from backend_app.mqtt_service import mqtt_service
+from backend_app.routers.auth import get_password_hash
+
+TEST_USER = ("tester", "secret")
+
+
+@pytest.fixture(scope="session")
+def client():
+    with WriteSessionLocal() as db:
+        db.add(User(username=TEST_USER[0], hashed_password=get_password_hash(TEST_USER[1])))
+        db.commit()
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture(scope="session")
+def auth_headers(client):
+    response = client.post("/token", data={"username": TEST_USER[0], "password": TEST_USER[1]})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def device_id():
+    """Mỗi test một thiết bị riêng: các test dùng chung một DB"""
+    return f"t-{uuid.uuid4().hex[:8]}"
+
+
+@pytest.fixture
+def make_device():
+    def make(device_id: str, **fields):
+        values = dict(is_on=False, brightness=0, sensor_value=0, is_auto_mode=False)
+        values.update(fields)
+        with WriteSessionLocal() as write_db:
+            write_db.add(DeviceState(device_id=device_id, **values))
+            write_db.commit()
+        return device_id
+    return make
+
+
+@pytest.fixture
+def publish():
+    """Giả lập bản tin status của thiết bị đi qua mqtt_service.on_message"""
+    def send(device_id: str, payload, suffix: str = ""):
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        topic = f"iot/light/{device_id}/status{suffix}"
+        mqtt_service.on_message(None, None, SimpleNamespace(topic=topic, payload=data))
+    return send
@@ -0,0 +1,149 @@
+"""user-024: thống kê sử dụng theo ngày/tuần (giờ đèn, điện năng, số lần bật/tắt)"""
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pytest
+from sqlalchemy import insert
+
+from backend_app.analytics import UsageAnalytics, summarize, usage_by_day, usage_by_day_from_rollups
+from backend_app.config import settings
+from backend_app.database import write_engine
+from backend_app.downsampling import to_epoch
+from backend_app.models.device import SensorHistory
+
+DAY = date(2026, 3, 1)
+MIDNIGHT = datetime.combine(DAY, datetime.min.time())
+
+
+def make_series(points):
+    """points = [(datetime, sensor, brightness, is_on, is_auto)] -> chuỗi mảng cột như load_series"""
+    columns = list(zip(*points))
+    return {
+        "ts": np.array([to_epoch(t) for t in columns[0]]),
+        "sensor_value": np.array(columns[1], dtype=np.float64),
+        "brightness": np.array(columns[2], dtype=np.float64),
+        "is_on": np.array(columns[3], dtype=np.float64),
+        "is_auto_mode": np.array(columns[4], dtype=np.float64),
+    }
+
+
+def overnight(start: datetime):
+    """Bật 50% từ 22:00 tới 02:00 hôm sau (mỗi phút một mẫu), tắt lúc 02:00"""
+    points = [(start + timedelta(minutes=i), 500, 50, 1, i < 60) for i in range(240)]
+    points.append((start + timedelta(minutes=240), 500, 0, 0, 0))
+    return points
+
+
+def test_usage_splits_at_midnight():
+    series = make_series(overnight(MIDNIGHT + timedelta(hours=22)))
+    result = usage_by_day(series, DAY, 2, max_gap=300, until=series["ts"][-1] + 3600)
+    assert result["samples"].tolist() == [120, 121]
+    assert result["on_seconds"].tolist() == [7200, 7200]
+    assert result["lamp_seconds"].tolist() == [3600, 3600]
+    assert result["auto_seconds"].tolist() == [3600, 0]
+    # Mẫu cuối kéo dài tối đa max_gap
+    assert result["covered_seconds"].tolist() == [7200, 7500]
+    assert result["switch_on"].tolist() == [0, 0] and result["switch_off"].tolist() == [0, 1]
+
+
+def test_usage_caps_gaps_and_counts_switches():
+    points = [
+        (MIDNIGHT + timedelta(hours=1), 0, 100, 0, 0),
+        (MIDNIGHT + timedelta(hours=2), 0, 100, 1, 0),      # bật
+        (MIDNIGHT + timedelta(hours=5), 0, 100, 0, 0),      # tắt, khoảng 3 giờ trước đó chỉ tính max_gap
+        (MIDNIGHT + timedelta(hours=6), 0, 100, 1, 0),      # bật
+    ]
+    until = to_epoch(MIDNIGHT + timedelta(hours=6, minutes=5))
+    result = usage_by_day(make_series(points), DAY, 1, max_gap=600, until=until)
+    assert result["on_seconds"].tolist() == [600 + 300]
+    assert result["switch_on"].tolist() == [2] and result["switch_off"].tolist() == [1]
+
+
+def test_usage_of_empty_series():
+    empty = {name: np.empty(0) for name in ("ts", "sensor_value", "brightness", "is_on", "is_auto_mode")}
+    result = usage_by_day(empty, DAY, 3, max_gap=300, until=0)
+    assert all(values.tolist() == [0, 0, 0] for values in result.values())
+
+
+def test_usage_from_rollups():
+    series = {
+        "ts": np.array([to_epoch(MIDNIGHT + timedelta(hours=h)) for h in (3, 4, 27)]),
+        "count": np.array([60.0, 60.0, 0.0]),
+        "brightness_sum": np.array([3000.0, 6000.0, 0.0]),
+        "on_seconds": np.array([3600.0, 1800.0, 0.0]),
+    }
+    result = usage_by_day_from_rollups(series, DAY, 2)
+    assert result["samples"].tolist() == [120, 0]
+    assert result["lamp_seconds"].tolist() == [3600 * 0.5 + 1800 * 1.0, 0]
+    assert result["switch_on"] is None and result["auto_seconds"] is None
+
+
+def test_summarize_converts_to_energy_and_cost():
+    day = {"samples": 10, "covered_seconds": 7200, "on_seconds": 7200, "lamp_seconds": 3600,
+           "auto_seconds": 1800, "switch_on": 1, "switch_off": 2, "source": "raw"}
+    total = summarize([day, dict(day, source="rollup", switch_on=None)])
+    kwh = 2 * settings.LAMP_POWER_WATTS / 1000
+    assert total["lamp_hours"] == 2 and total["on_hours"] == 4
+    assert total["energy_kwh"] == round(kwh, 4) and total["cost"] == round(kwh * settings.ENERGY_PRICE_PER_KWH, 2)
+    assert total["auto_share"] == 0.25
+    assert total["switch_on"] is None and total["switch_off"] == 4
+    assert total["source"] == "raw+rollup"
+
+
+@pytest.fixture
+def overnight_device(make_device, device_id):
+    """Thiết bị có lịch sử bật đèn qua đêm từ 22:00 ba ngày trước (trong RETENTION_RAW_DAYS)"""
+    make_device(device_id)
+    first_day = date.today() - timedelta(days=3)
+    start = datetime.combine(first_day, datetime.min.time()) + timedelta(hours=22)
+    rows = [
+        dict(device_id=device_id, sensor_value=s, brightness=b, is_on=bool(on), is_auto_mode=bool(auto), timestamp=t)
+        for t, s, b, on, auto in overnight(start)
+    ]
+    with write_engine.begin() as conn:
+        conn.execute(insert(SensorHistory), rows)
+    return device_id, first_day
+
+
+def test_daily_caches_closed_days(db, overnight_device):
+    device_id, first_day = overnight_device
+    analytics = UsageAnalytics(max_gap_seconds=300)
+    days = analytics.daily(db, device_id, first_day, first_day + timedelta(days=1))
+    assert [(v["on_seconds"], v["source"]) for _, v in days] == [(7200, "raw"), (7200, "raw")]
+    analytics.daily(db, device_id, first_day, first_day + timedelta(days=1))
+    assert analytics.stats() == {"cached_days": 2, "hits": 2, "misses": 2}
+
+    # Lô gửi bù cho ngày thứ hai: chỉ ngày đó (và sau đó) bị tính lại
+    second_noon = datetime.combine(first_day + timedelta(days=1), datetime.min.time()) + timedelta(hours=12)
+    analytics.invalidate(device_id, second_noon)
+    assert analytics.stats()["cached_days"] == 1
+    analytics.invalidate()
+    assert analytics.stats()["cached_days"] == 0
+
+
+def test_usage_endpoint(client, auth_headers, overnight_device):
+    device_id, first_day = overnight_device
+    response = client.get(f"/api/device/{device_id}/analytics/usage", headers=auth_headers,
+                          params={"start": first_day.isoformat(), "end": (first_day + timedelta(days=1)).isoformat()})
+    assert response.status_code == 200
+    body = response.json()
+    days = body["devices"][device_id]
+    assert [d["lamp_hours"] for d in days] == [1.0, 1.0]
+    assert [d["switch_off"] for d in days] == [0, 1]
+    assert body["total"]["on_hours"] == 4.0
+
+    weekly = client.get(f"/api/device/{device_id}/analytics/usage", headers=auth_headers,
+                        params={"start": first_day.isoformat(), "end": first_day.isoformat(), "period": "week"}).json()
+    monday = first_day - timedelta(days=first_day.weekday())
+    assert weekly["devices"][device_id][0]["period_start"] == monday.isoformat()
+
+
+def test_usage_endpoint_errors(client, auth_headers, device_id):
+    response = client.get(f"/api/device/{device_id}/analytics/usage", headers=auth_headers)
+    assert response.status_code == 404
+    response = client.get("/api/device/analytics/usage", headers=auth_headers,
+                          params={"start": "2026-03-05", "end": "2026-03-01"})
+    assert response.status_code == 400
+    response = client.get("/api/device/analytics/usage/all", headers=auth_headers,
+                          params={"start": "2020-01-01", "end": "2026-03-01"})
+    assert response.status_code == 400
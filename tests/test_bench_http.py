@@ -0,0 +1,52 @@
+"""user-017: benchmark REST API (phân vị theo endpoint, --mix, --profile)"""
+import importlib
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+BENCH_DIR = Path(__file__).resolve().parent.parent / "benchmarks"
+
+
+@pytest.fixture
+def bench_http(monkeypatch):
+    # Script chạy trực tiếp từ thư mục benchmarks/ (import _common không qua package)
+    monkeypatch.syspath_prepend(str(BENCH_DIR))
+    return importlib.import_module("bench_http")
+
+
+def test_percentile_interpolates(bench_http):
+    from _common import percentile
+
+    assert percentile([], 99) == 0.0
+    assert percentile([5.0], 50) == 5.0
+    values = [4.0, 1.0, 3.0, 2.0]
+    assert percentile(values, 0) == 1.0 and percentile(values, 100) == 4.0
+    assert percentile(values, 50) == 2.5
+    assert percentile(list(range(101)), 99) == 99
+
+
+def test_parse_mix(bench_http):
+    assert bench_http.parse_mix("status=3, history") == {"status": 3.0, "history": 1.0}
+    with pytest.raises(SystemExit, match="unknown endpoints"):
+        bench_http.parse_mix("status=1,nope=2")
+
+
+def test_small_run_reports_every_endpoint(tmp_path):
+    report_path = tmp_path / "http.json"
+    profile_path = tmp_path / "slowest.prof"
+    subprocess.run(
+        [sys.executable, str(BENCH_DIR / "bench_http.py"), "--rows", "2000", "--days", "3",
+         "--concurrency", "2", "--duration", "1", "--mix", "status=5,history=2,by-date=1",
+         "--profile", str(profile_path), "--profile-iterations", "2", "--json", str(report_path)],
+        cwd=tmp_path, check=True, capture_output=True, timeout=180,
+    )
+    report = json.loads(report_path.read_text())
+    assert set(report["results"]) == {"status", "history", "by-date"}
+    for result in report["results"].values():
+        assert result["requests"] > 0 and result["errors"] == 0
+        assert result["p50_ms"] <= result["p95_ms"] <= result["p99_ms"] <= result["max_ms"]
+    assert report["slowest"] in report["results"]
+    assert profile_path.stat().st_size > 0
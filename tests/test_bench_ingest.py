@@ -0,0 +1,30 @@
+"""user-016: benchmark ingest MQTT chạy được (cỡ nhỏ) và xuất báo cáo JSON đầy đủ"""
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+SCRIPT = Path(__file__).resolve().parent.parent / "benchmarks" / "bench_ingest.py"
+
+
+@pytest.mark.parametrize("codec", ["json", "struct"])
+def test_inproc_run_commits_every_message(tmp_path, codec):
+    report_path = tmp_path / "ingest.json"
+    # Chạy ở tiến trình riêng: script tự đặt DATABASE_URL trước khi import backend_app
+    subprocess.run(
+        [sys.executable, str(SCRIPT), "--lamps", "20", "--rate", "200", "--duration", "1",
+         "--codec", codec, "--json", str(report_path)],
+        cwd=tmp_path, check=True, capture_output=True, timeout=120,
+    )
+    report = json.loads(report_path.read_text())
+    assert report["params"]["codec"] == codec
+    assert report["published"] > 0
+    assert report["committed_rows"] + report["dropped"] == report["published"]
+    assert report["lost"] == 0
+    for key in ("lag_p50_ms", "lag_p95_ms", "lag_p99_ms", "lag_max_ms"):
+        assert report[key] >= 0
+    assert report["lag_p50_ms"] <= report["lag_p99_ms"] <= report["lag_max_ms"]
+    assert report["db_bytes_per_row"] > 0
+    assert report["commit_timeline"]
@@ -0,0 +1,82 @@
+"""user-019: điều khiển hàng loạt theo danh sách/nhóm/tag và lọc tag bằng instr (không phải LIKE)"""
+import pytest
+
+from backend_app.models.device import DeviceState
+from backend_app.state_cache import state_cache
+
+
+@pytest.fixture
+def tagged(client, auth_headers, make_device, device_id):
+    """Tạo thiết bị (tên riêng theo test) rồi gán nhóm/tag qua API"""
+    def make(suffix: str, group: str = None, tags: list = None):
+        dev = make_device(f"{device_id}-{suffix}")
+        state_cache.invalidate(dev)
+        response = client.put(f"/api/device/{dev}/group", headers=auth_headers,
+                              json={"group": group, "tags": tags})
+        assert response.status_code == 200
+        return dev
+    return make
+
+
+def matching(db, tag: str, prefix: str) -> list:
+    rows = db.query(DeviceState.device_id).filter(DeviceState.has_tag(tag), DeviceState.device_id.startswith(prefix))
+    return sorted(row.device_id for row in rows)
+
+
+def test_has_tag_treats_wildcards_literally(db, tagged, device_id):
+    pct = tagged("pct", tags=["50%"])
+    pct_other = tagged("pct2", tags=["500"])
+    under = tagged("under", tags=["a_b"])
+    tagged("axb", tags=["axb"])
+    multi = tagged("multi", tags=["floor-1", "a_b"])
+
+    assert matching(db, "50%", device_id) == [pct]
+    assert matching(db, "a_b", device_id) == sorted([under, multi])
+    assert matching(db, "%", device_id) == []
+    assert matching(db, "50", device_id) == []          # Chỉ khớp nguyên tag, không khớp một phần
+    assert matching(db, "floor-1,a_b", device_id) == []  # Tag chứa dấu phẩy không bao giờ khớp
+    assert matching(db, "500", device_id) == [pct_other]
+
+
+def test_group_update_validates_tags(client, auth_headers, tagged):
+    dev = tagged("v", group="floor-2", tags=[" lobby ", ""])
+    response = client.put(f"/api/device/{dev}/group", headers=auth_headers, json={"tags": ["a,b"]})
+    assert response.status_code == 400
+    response = client.put(f"/api/device/{dev}/group", headers=auth_headers, json={"group": ""})
+    assert response.json() == {"device_id": dev, "group": None, "tags": ["lobby"]}
+    response = client.put("/api/device/no-such-device/group", headers=auth_headers, json={"group": "x"})
+    assert response.status_code == 404
+
+
+def test_bulk_control_by_group_tag_and_list(client, auth_headers, db, tagged, device_id):
+    group = f"{device_id}-floor"
+    first = tagged("g1", group=group)
+    second = tagged("g2", group=group, tags=["corner"])
+    tag_only = tagged("t1", tags=[f"{device_id}_tag"])
+    missing = f"{device_id}-missing"
+
+    response = client.post("/api/device/control/bulk", headers=auth_headers, json={
+        "action": "SET_BRIGHTNESS", "value": 35,
+        "group": group, "tag": f"{device_id}_tag", "devices": [missing, first],
+    })
+    assert response.status_code == 200
+    body = response.json()
+    assert body["requested"] == 4 and body["sent"] == 3
+    statuses = {r["device_id"]: r["status"] for r in body["results"]}
+    assert statuses == {missing: "not_found", first: "sent", second: "sent", tag_only: "sent"}
+
+    # Trạng thái được lưu trong cùng request (một transaction), không chờ command_scheduler
+    rows = db.query(DeviceState).filter(DeviceState.device_id.in_([first, second, tag_only])).all()
+    assert [(row.brightness, row.is_on, row.rules_armed) for row in rows] == [(35, True, False)] * 3
+
+
+def test_bulk_control_rejects_bad_requests(client, auth_headers, tagged):
+    dev = tagged("b")
+    response = client.post("/api/device/control/bulk", headers=auth_headers, json={"action": "SET_BRIGHTNESS", "value": 1})
+    assert response.status_code == 400
+    response = client.post("/api/device/control/bulk", headers=auth_headers,
+                           json={"action": "SET_BRIGHTNESS", "value": 150, "devices": [dev]})
+    assert response.status_code == 400
+    response = client.post("/api/device/control/bulk", headers=auth_headers,
+                           json={"action": "SET_BRIGHTNESS", "devices": [dev]})
+    assert response.json()["results"] == [{"device_id": dev, "status": "unchanged"}]
@@ -0,0 +1,115 @@
+"""user-013: command_scheduler gộp lệnh cùng loại, giới hạn tần suất gửi và ghi trạng thái theo lô"""
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from backend_app.command_scheduler import CommandScheduler
+from backend_app.models.device import DeviceState
+
+
+def brightness(value):
+    return {"type": "MANUAL", "state": "ON", "brightness": value}
+
+
+@pytest.fixture
+def scheduler_factory():
+    created = []
+
+    def make(window=0.1, rate=0.0):
+        scheduler = CommandScheduler(coalesce_window=window, max_rate=rate)
+        scheduler.sent_log = []
+        scheduler.sent_event = threading.Event()
+
+        def publish(payload, device_id):
+            scheduler.sent_log.append((time.monotonic(), device_id, payload))
+            scheduler.sent_event.set()
+
+        scheduler.bind_publisher(publish)
+        created.append(scheduler)
+        return scheduler
+
+    yield make
+    for scheduler in created:
+        scheduler.stop()
+
+
+def test_same_kind_commands_are_coalesced(scheduler_factory):
+    scheduler = scheduler_factory(window=0.2)
+    scheduler.start()
+    for value in (10, 20, 30):
+        scheduler.submit("d1", brightness(value))
+    scheduler.submit("d1", {"type": "AUTO", "enable": False})
+    scheduler.submit("d1", brightness(40))
+    assert scheduler.sent_event.wait(2)
+    time.sleep(0.05)
+    # Lệnh cùng loại tới sau thay thế lệnh cũ và xếp cuối: chỉ gửi AUTO rồi độ sáng cuối cùng
+    assert [p for _, _, p in scheduler.sent_log] == [{"type": "AUTO", "enable": False}, brightness(40)]
+    assert scheduler.stats()["coalesced"] == 3 and scheduler.sent == 2
+
+
+def test_devices_are_coalesced_independently(scheduler_factory):
+    scheduler = scheduler_factory(window=0.1)
+    scheduler.start()
+    scheduler.submit("d1", brightness(10))
+    scheduler.submit("d2", brightness(20))
+    deadline = time.monotonic() + 2
+    while scheduler.sent < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sorted((d, p["brightness"]) for _, d, p in scheduler.sent_log) == [("d1", 10), ("d2", 20)]
+    assert scheduler.coalesced == 0
+
+
+def test_max_rate_spaces_out_sends(scheduler_factory):
+    scheduler = scheduler_factory(window=0.0, rate=5.0)
+    scheduler.start()
+    scheduler.submit("d1", brightness(10))
+    assert scheduler.sent_event.wait(2)
+    scheduler.sent_event.clear()
+    scheduler.submit("d1", brightness(20))
+    assert scheduler.sent_event.wait(2)
+    (first, _, _), (second, _, _) = scheduler.sent_log
+    assert second - first >= 0.2 - 0.01
+
+
+def test_stop_flushes_pending_commands(scheduler_factory):
+    scheduler = scheduler_factory(window=60)
+    scheduler.start()
+    scheduler.submit("d1", brightness(10))
+    assert scheduler.stats()["pending"] == 1
+    scheduler.stop()
+    assert [p for _, _, p in scheduler.sent_log] == [brightness(10)]
+
+
+def test_states_of_due_devices_are_saved_together(scheduler_factory, db, make_device):
+    ids = [make_device(f"t-sched-{i}-{time.time_ns()}") for i in range(3)]
+    scheduler = scheduler_factory(window=60)
+    scheduler.start()
+    now = datetime.now()
+    for i, device_id in enumerate(ids):
+        state = {"device_id": device_id, "is_on": True, "brightness": 10 * (i + 1), "sensor_value": 0,
+                 "is_auto_mode": False, "last_updated": now, "rules_armed": False}
+        scheduler.submit(device_id, brightness(10 * (i + 1)), state)
+    scheduler.stop()
+
+    rows = db.query(DeviceState).filter(DeviceState.device_id.in_(ids)).order_by(DeviceState.brightness).all()
+    assert [row.brightness for row in rows] == [10, 20, 30]
+    assert scheduler.state_writes == 1 and scheduler.failed_writes == 0
+
+
+def test_publish_error_does_not_stop_scheduler(scheduler_factory):
+    scheduler = scheduler_factory(window=0.0)
+    calls = []
+
+    def flaky(payload, device_id):
+        calls.append(device_id)
+        if device_id == "bad":
+            raise RuntimeError("broker down")
+
+    scheduler.bind_publisher(flaky)
+    scheduler.start()
+    scheduler.submit("bad", brightness(10))
+    scheduler.submit("good", brightness(10))
+    scheduler.stop()
+    assert sorted(calls) == ["bad", "good"] and scheduler.sent == 1
@@ -0,0 +1,125 @@
+"""user-014: command_tracker xác nhận lệnh bằng cid hoặc theo trạng thái báo về"""
+from types import SimpleNamespace
+
+import pytest
+
+from backend_app import command_tracker as tracker_module
+from backend_app.command_tracker import CommandTracker, LatencyHistogram, expected_state
+
+ON_50 = {"type": "MANUAL", "state": "ON", "brightness": 50}
+OFF = {"type": "MANUAL", "state": "OFF", "brightness": 0}
+AUTO = {"type": "AUTO", "enable": True}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Đồng hồ monotonic giả, tua bằng clock.advance(giây)"""
+    class Clock:
+        now = 1000.0
+
+        def advance(self, seconds):
+            self.now += seconds
+
+    fake = Clock()
+    monkeypatch.setattr(tracker_module, "time", SimpleNamespace(monotonic=lambda: fake.now))
+    return fake
+
+
+@pytest.fixture
+def tracker(clock):
+    return CommandTracker(timeout=5.0, max_pending=3, min_rtt=0.05)
+
+
+def test_expected_state():
+    assert expected_state(ON_50) == {"is_on": True, "brightness": 50}
+    assert expected_state(OFF) == {"is_on": False}
+    assert expected_state(AUTO) == {"is_auto_mode": True}
+
+
+def test_track_adds_cid_without_touching_payload(tracker):
+    sent = tracker.track(ON_50, "d")
+    assert "cid" not in ON_50 and sent["cid"] and sent["brightness"] == 50
+    assert tracker.report("d")["d"]["pending"] == 1
+
+
+def test_cid_ack_measures_latency(tracker, clock):
+    sent = tracker.track(ON_50, "d")
+    clock.advance(0.12)
+    tracker.acknowledge("d", {"cid": sent["cid"], "is_on": True, "brightness": 50})
+    report = tracker.report("d")["d"]
+    assert report["acked_by_cid"] == 1 and report["pending"] == 0
+    assert report["latency"]["count"] == 1 and report["latency"]["max_ms"] == pytest.approx(120)
+
+
+def test_state_ack_when_firmware_has_no_cid(tracker, clock):
+    tracker.track(ON_50, "d")
+    clock.advance(0.2)
+    tracker.acknowledge("d", {"is_on": True, "brightness": 40})   # chưa khớp
+    tracker.acknowledge("d", {"is_on": True, "brightness": 50})
+    report = tracker.report("d")["d"]
+    assert report["acked_by_state"] == 1 and report["pending"] == 0
+    assert report["latency"]["count"] == 1 and report["state_latency"]["count"] == 0
+
+
+def test_state_ack_ignores_messages_before_min_rtt(tracker, clock):
+    tracker.track(ON_50, "d")
+    clock.advance(0.01)     # bản tin đang trên đường về lúc gửi lệnh
+    tracker.acknowledge("d", {"is_on": True, "brightness": 50})
+    assert tracker.report("d")["d"]["pending"] == 1
+    clock.advance(0.1)
+    tracker.acknowledge("d", {"is_on": True, "brightness": 50})
+    assert tracker.report("d")["d"]["pending"] == 0
+
+
+def test_state_latency_kept_apart_once_device_echoes_cid(tracker, clock):
+    first = tracker.track(ON_50, "d")
+    clock.advance(0.1)
+    tracker.acknowledge("d", {"cid": first["cid"], "is_on": True, "brightness": 50})
+
+    tracker.track(OFF, "d")
+    clock.advance(0.3)
+    tracker.acknowledge("d", {"is_on": False})   # bản tin không mang cid nhưng khớp trạng thái
+    report = tracker.report("d")["d"]
+    assert report["acked_by_state"] == 1
+    assert report["latency"]["count"] == 1 and report["state_latency"]["count"] == 1
+
+
+def test_unknown_or_stale_cid_is_not_counted(tracker, clock):
+    tracker.track(ON_50, "d")
+    clock.advance(0.1)
+    tracker.acknowledge("d", {"cid": "not-ours", "is_on": True, "brightness": 50})
+    report = tracker.report("d")["d"]
+    # Có cid thì chỉ khớp theo cid, không rơi về so trạng thái
+    assert report["acked_by_cid"] == 0 and report["acked_by_state"] == 0 and report["pending"] == 1
+
+
+def test_same_kind_supersedes_and_timeouts(tracker, clock):
+    tracker.track(ON_50, "d")
+    tracker.track(dict(ON_50, brightness=60), "d")
+    tracker.track(AUTO, "d")
+    report = tracker.report("d")["d"]
+    assert report["superseded"] == 1 and report["pending"] == 2
+    clock.advance(5.0)
+    report = tracker.report("d")["d"]
+    assert report["timeouts"] == 2 and report["pending"] == 0
+
+
+def test_max_pending_drops_oldest(clock):
+    tracker = CommandTracker(timeout=5.0, max_pending=2, min_rtt=0.0)
+    tracker.track(ON_50, "d")
+    tracker.track(AUTO, "d")
+    tracker.track({"type": "OTHER"}, "d")
+    report = tracker.report("d")["d"]
+    assert report["pending"] == 2 and report["timeouts"] == 1
+    assert tracker.stats()["sent"] == 3
+
+
+def test_latency_histogram_percentiles():
+    histogram = LatencyHistogram(bounds=(10, 100))
+    for value in (5, 5, 50, 200):
+        histogram.observe(value)
+    summary = histogram.summary()
+    assert summary["count"] == 4 and summary["max_ms"] == 200 and summary["avg_ms"] == 65
+    assert summary["p50_ms"] == 10
+    assert summary["p99_ms"] <= 200
+    assert LatencyHistogram().percentile(50) is None
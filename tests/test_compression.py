@@ -0,0 +1,135 @@
+"""user-023: nén lịch sử (deadband / swinging door) và dựng lại chuỗi"""
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from backend_app.compression import HistoryCompressor
+from backend_app.downsampling import reconstruct_series, to_epoch
+
+T0 = datetime(2026, 3, 1, 12, 0, 0)
+
+
+def state(value, is_on=True, brightness=50, auto=False):
+    return {"sensor_value": value, "brightness": brightness, "is_on": is_on, "is_auto_mode": auto}
+
+
+def compressor(device_id, **config):
+    comp = HistoryCompressor()
+    comp.set_override(device_id, config)
+    return comp
+
+
+def offer_values(comp, device_id, values, step=1.0):
+    stored = []
+    for i, value in enumerate(values):
+        stored += comp.offer(device_id, [(T0 + timedelta(seconds=i * step), state(value))])
+    return [s["sensor_value"] for _, s in stored]
+
+
+def test_off_stores_everything():
+    assert HistoryCompressor().offer("d", [(T0, state(1))]) is None
+    assert compressor("d", method="off").offer("d", [(T0, state(1))]) is None
+
+
+def test_deadband_stores_only_big_changes():
+    comp = compressor("d", method="deadband", deadband=5, max_interval=300)
+    assert offer_values(comp, "d", [100, 102, 104, 105, 106, 110, 111]) == [100, 106]
+    assert comp.pending("d")[1]["sensor_value"] == 111
+    assert comp.stats("d") == {"devices": 1, "received": 7, "stored": 2, "ratio": 3.5}
+
+
+def test_discrete_change_stores_held_and_new_sample():
+    comp = compressor("d", method="deadband", deadband=50, max_interval=300)
+    stored = comp.offer("d", [(T0, state(100)), (T0 + timedelta(seconds=1), state(101)),
+                              (T0 + timedelta(seconds=2), state(102, brightness=80))])
+    assert [(s["sensor_value"], s["brightness"]) for _, s in stored] == [(100, 50), (101, 50), (102, 80)]
+    assert comp.pending("d") is None
+
+
+def test_heartbeat_after_max_interval():
+    comp = compressor("d", method="deadband", deadband=50, max_interval=10)
+    assert offer_values(comp, "d", [100] * 25) == [100, 100, 100]
+
+
+def test_late_sample_is_stored_unchanged():
+    comp = compressor("d", method="deadband", deadband=50, max_interval=300)
+    comp.offer("d", [(T0, state(100))])
+    late = (T0 - timedelta(seconds=30), state(999))
+    assert comp.offer("d", [late]) == [late]
+    assert comp.offer("d", [(T0 + timedelta(seconds=1), state(101))]) == []
+
+
+def test_swinging_door_keeps_only_turning_points():
+    comp = compressor("d", method="swinging_door", deviation=2, max_interval=300)
+    ramp_up = [10 * i for i in range(11)]              # 0..100, một đường thẳng
+    ramp_down = [100 - 5 * i for i in range(1, 11)]    # 95..50
+    assert offer_values(comp, "d", ramp_up + ramp_down) == [0, 100]
+    assert comp.pending("d")[1]["sensor_value"] == 50
+
+
+def test_drain_flushes_held_samples():
+    comp = compressor("d", method="deadband", deadband=50, max_interval=300)
+    offer_values(comp, "d", [100, 101])
+    assert [(d, s["sensor_value"]) for d, _, s in comp.drain()] == [("d", 101)]
+    assert comp.drain() == []
+
+
+def test_swinging_door_reconstruction_error_is_bounded():
+    deviation = 5.0
+    comp = compressor("d", method="swinging_door", deviation=deviation, max_interval=300)
+    rng = np.random.default_rng(7)
+    values = np.round(500 + 200 * np.sin(np.arange(600) / 40) + rng.normal(0, 1, 600)).astype(int)
+    samples = [(T0 + timedelta(seconds=i), state(int(v))) for i, v in enumerate(values)]
+    stored = comp.offer("d", samples) + [comp.pending("d")]
+    assert len(stored) < len(samples) / 5
+
+    series = {
+        "ts": np.array([to_epoch(t) for t, _ in stored]),
+        "sensor_value": np.array([s["sensor_value"] for _, s in stored], dtype=np.float64),
+        "brightness": np.full(len(stored), 50.0),
+        "is_on": np.ones(len(stored)),
+        "is_auto_mode": np.zeros(len(stored)),
+    }
+    rebuilt = reconstruct_series(series, to_epoch(T0), to_epoch(T0) + len(values), 1, "linear")
+    assert rebuilt["ts"].size == len(values)
+    # Nội suy tuyến tính lệch tối đa deviation (cộng 0.5 do làm tròn về số nguyên)
+    assert np.max(np.abs(rebuilt["sensor_value"] - values)) <= deviation + 0.5
+
+
+def test_step_reconstruction_holds_previous_value():
+    series = {"ts": np.array([0.0, 10.0]), "sensor_value": np.array([1.0, 2.0]),
+              "brightness": np.array([5.0, 6.0]), "is_on": np.array([1.0, 0.0]), "is_auto_mode": np.zeros(2)}
+    rebuilt = reconstruct_series(series, -5, 15, 5, "step")
+    assert rebuilt["ts"].tolist() == [0, 5, 10]
+    assert rebuilt["sensor_value"].tolist() == [1, 1, 2]
+    assert rebuilt["is_on"].tolist() == [1, 1, 0]
+    assert reconstruct_series(series, -5, 15, 5, "linear")["sensor_value"].tolist() == [1, 2, 2]
+
+
+def test_api_config_and_reconstruct_include_held_sample(client, auth_headers, publish, make_device, device_id):
+    make_device(device_id)
+    response = client.put(f"/api/device/{device_id}/compression", headers=auth_headers,
+                          json={"method": "deadband", "deadband": 5})
+    assert response.json()["config"]["method"] == "deadband"
+    assert client.put("/api/device/no-such-device/compression", headers=auth_headers,
+                      json={"method": "deadband"}).status_code == 404
+
+    values = [100, 101, 102, 103, 150, 151]
+    publish(device_id, {"samples": [
+        {"sensor_value": v, "brightness": 50, "is_on": True, "is_auto_mode": False, "age": 60 - 10 * i}
+        for i, v in enumerate(values)
+    ]})
+    stats = client.get(f"/api/device/{device_id}/compression", headers=auth_headers).json()["stats"]
+    assert stats["received"] == 6 and stats["stored"] == 2
+
+    response = client.get(f"/api/device/{device_id}/history", headers=auth_headers,
+                          params={"hours": 1, "reconstruct": "step", "interval": 1})
+    data = response.json()["data"]
+    sensor = [item["sensor_value"] for item in data]
+    # Mẫu 151 chưa lưu (đang giữ trong bộ nén) vẫn có trong chuỗi dựng lại
+    assert sensor[-1] == 151 and sensor[0] == 100
+    assert set(sensor) == {100, 150, 151}
+    assert 59 <= len(sensor) <= 61     # Mỗi giây một điểm từ mẫu đầu (60 s trước) tới hiện tại
+
+    client.put(f"/api/device/{device_id}/compression", headers=auth_headers, json={})
+    assert client.get(f"/api/device/{device_id}/compression", headers=auth_headers).json()["config"]["method"] == "off"
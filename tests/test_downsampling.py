@@ -0,0 +1,94 @@
+"""user-005: giảm mẫu phía server (gom khung cố định, LTTB) cho API lịch sử"""
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from backend_app.database import WriteSessionLocal
+from backend_app.downsampling import (
+    bucket_aggregate, clamp_resolution, downsample_lttb, lttb_indices, to_datetimes, to_epoch,
+)
+from backend_app.models.device import SensorHistory
+
+
+def make_series(n, step=1.0):
+    ts = np.arange(n, dtype=np.float64) * step
+    return {
+        "ts": ts,
+        "sensor_value": np.sin(ts / 10.0) * 100 + 500,
+        "brightness": (ts % 100).astype(np.float64),
+        "is_on": (ts % 20 < 10).astype(np.float64),
+        "is_auto_mode": np.zeros(n),
+    }
+
+
+def test_lttb_keeps_endpoints_and_spike():
+    x = np.arange(1000, dtype=np.float64)
+    y = np.zeros(1000)
+    y[437] = 1000.0
+    selected = lttb_indices(x, y, 20)
+    assert selected.size == 20
+    assert selected[0] == 0 and selected[-1] == 999
+    assert 437 in selected
+    assert np.all(np.diff(selected) > 0)
+
+
+def test_lttb_returns_everything_below_threshold():
+    x = np.arange(10, dtype=np.float64)
+    assert lttb_indices(x, x, 50).tolist() == list(range(10))
+
+
+@pytest.mark.parametrize("max_points", [3, 4, 5, 7, 100, 999])
+def test_downsample_lttb_respects_max_points(max_points):
+    series = make_series(5000)
+    result = downsample_lttb(series, max_points)
+    assert 0 < result["ts"].size <= max_points
+    assert result["ts"][0] == 0 and result["ts"][-1] == 4999
+    assert np.all(np.diff(result["ts"]) > 0)
+
+
+def test_downsample_lttb_short_series_unchanged():
+    series = make_series(50)
+    assert downsample_lttb(series, 100) is series
+
+
+def test_bucket_aggregate_min_max_avg_and_origin():
+    series = make_series(10)
+    series["sensor_value"] = np.arange(10, dtype=np.float64)
+    buckets = bucket_aggregate(series, 4, origin=2.0)
+    assert buckets["ts"].tolist() == [-2.0, 2.0, 6.0]
+    assert buckets["count"].tolist() == [2, 4, 4]
+    assert buckets["sensor_value_min"].tolist() == [0, 2, 6]
+    assert buckets["sensor_value_max"].tolist() == [1, 5, 9]
+    assert buckets["sensor_value_avg"].tolist() == [0.5, 3.5, 7.5]
+
+
+def test_clamp_resolution_bounds_bucket_count():
+    assert clamp_resolution(60, 3600, 100) == 60
+    assert clamp_resolution(1, 86400, 5000) == 18
+
+
+def test_epoch_round_trip():
+    moment = datetime(2026, 1, 2, 3, 4, 5, 678000)
+    assert to_datetimes(np.array([to_epoch(moment)])) == [moment]
+
+
+def test_history_range_api_downsamples(client, auth_headers, device_id):
+    start = (datetime.now() - timedelta(days=3)).replace(second=0, microsecond=0)
+    with WriteSessionLocal() as db:
+        db.bulk_insert_mappings(SensorHistory, [
+            dict(device_id=device_id, sensor_value=i % 700, brightness=50, is_on=True, is_auto_mode=False,
+                 timestamp=start + timedelta(seconds=i))
+            for i in range(2000)
+        ])
+        db.commit()
+    # Khoảng ngắn: max_points chọn LTTB trên mẫu gốc, resolution < 1 phút gom trên mẫu gốc (không qua rollup)
+    params = {"start": str(start), "end": str(start + timedelta(seconds=2000))}
+    url = f"/api/device/{device_id}/history/range"
+
+    raw = client.get(url, params=dict(params, max_points=100), headers=auth_headers).json()
+    assert 0 < raw["total"] <= 100 and "resolution" not in raw
+
+    buckets = client.get(url, params=dict(params, resolution=30), headers=auth_headers).json()
+    assert buckets["resolution"] == 30 and buckets["total"] == 67
+    assert sum(item["count"] for item in buckets["data"]) == 2000
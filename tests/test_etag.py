@@ -0,0 +1,122 @@
+"""user-025: ETag / 304 Not Modified cho các API đọc (If-None-Match, If-Modified-Since)"""
+import time
+from datetime import date, datetime, timedelta
+from email.utils import format_datetime, parsedate_to_datetime
+
+import pytest
+
+from backend_app.state_cache import state_cache
+
+STATUS = {"sensor_value": 400, "brightness": 30, "is_on": True, "is_auto_mode": False}
+
+
+def revalidate(client, auth_headers, url, params=None, **headers):
+    return client.get(url, headers=dict(auth_headers, **headers), params=params)
+
+
+@pytest.fixture
+def device(client, publish, device_id):
+    publish(device_id, STATUS)
+    return device_id
+
+
+def test_status_etag_and_304(client, auth_headers, publish, device):
+    url = f"/api/device/{device}/status"
+    first = revalidate(client, auth_headers, url)
+    etag = first.headers["etag"]
+    assert first.status_code == 200 and first.headers["cache-control"] == "private, no-cache"
+
+    cached = revalidate(client, auth_headers, url, **{"If-None-Match": etag})
+    assert cached.status_code == 304 and cached.headers["etag"] == etag and cached.content == b""
+    # Danh sách nhiều ETag, ETag yếu (W/) và "*" đều được chấp nhận
+    for header in (f'"other", W/{etag}', "*"):
+        assert revalidate(client, auth_headers, url, **{"If-None-Match": header}).status_code == 304
+
+    publish(device, dict(STATUS, brightness=60))
+    changed = revalidate(client, auth_headers, url, **{"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+    assert changed.json()["brightness"] == 60
+
+
+def test_unknown_device_has_no_etag(client, auth_headers, device_id):
+    response = revalidate(client, auth_headers, f"/api/device/{device_id}/status", **{"If-None-Match": "*"})
+    assert response.status_code == 404 and "etag" not in response.headers
+
+
+def test_settings_etag_changes_on_update(client, auth_headers):
+    client.put("/api/device/settings", headers=auth_headers, json={"light_threshold_low": 300})
+    first = revalidate(client, auth_headers, "/api/device/settings")
+    etag = first.headers["etag"]
+    assert revalidate(client, auth_headers, "/api/device/settings", **{"If-None-Match": etag}).status_code == 304
+
+    client.put("/api/device/settings", headers=auth_headers, json={"light_threshold_low": 300})
+    after = revalidate(client, auth_headers, "/api/device/settings", **{"If-None-Match": etag})
+    assert after.status_code == 200 and after.headers["etag"] != etag
+
+
+def test_dashboard_etag(client, auth_headers, publish, device):
+    url = f"/api/device/{device}/dashboard"
+    etag = revalidate(client, auth_headers, url).headers["etag"]
+    assert revalidate(client, auth_headers, url, **{"If-None-Match": etag}).status_code == 304
+    publish(device, dict(STATUS, is_on=False))
+    assert revalidate(client, auth_headers, url, **{"If-None-Match": etag}).status_code == 200
+
+
+def test_past_day_last_modified_and_backfill(client, auth_headers, publish, device):
+    yesterday = date.today() - timedelta(days=1)
+    url = f"/api/device/{device}/history/by-date"
+    params = {"target_date": yesterday.isoformat()}
+    first = revalidate(client, auth_headers, url, params)
+    etag, last_modified = first.headers["etag"], first.headers["last-modified"]
+    assert first.status_code == 200 and etag.startswith('"history-day-')
+
+    assert revalidate(client, auth_headers, url, params, **{"If-Modified-Since": last_modified}).status_code == 304
+    older = format_datetime(parsedate_to_datetime(last_modified) - timedelta(seconds=1), usegmt=True)
+    assert revalidate(client, auth_headers, url, params, **{"If-Modified-Since": older}).status_code == 200
+    assert revalidate(client, auth_headers, url, params, **{"If-Modified-Since": "garbage"}).status_code == 200
+    # If-None-Match được ưu tiên hơn If-Modified-Since
+    response = revalidate(client, auth_headers, url, params,
+                          **{"If-None-Match": '"stale"', "If-Modified-Since": last_modified})
+    assert response.status_code == 200
+
+    # Lô gửi bù cho hôm qua: phiên bản của riêng ngày đó đổi sau khi ingest commit
+    noon = datetime.combine(yesterday, datetime.min.time()) + timedelta(hours=12)
+    publish(device, {"samples": [dict(STATUS, age=(datetime.now() - noon).total_seconds())]})
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        response = revalidate(client, auth_headers, url, params, **{"If-None-Match": etag})
+        if response.status_code == 200:
+            break
+        time.sleep(0.05)
+    assert response.status_code == 200 and response.headers["etag"] != etag
+    assert [row["sensor_value"] for row in response.json()] == [400]
+
+
+def test_other_days_unaffected_by_backfill(client, auth_headers, device):
+    url = f"/api/device/{device}/history/by-date"
+    params = {"target_date": (date.today() - timedelta(days=2)).isoformat()}
+    etag = revalidate(client, auth_headers, url, params).headers["etag"]
+    state_cache.touch_days({(device, date.today() - timedelta(days=1))})
+    assert revalidate(client, auth_headers, url, params, **{"If-None-Match": etag}).status_code == 304
+
+
+def test_today_uses_history_version(client, auth_headers, device):
+    response = revalidate(client, auth_headers, f"/api/device/{device}/history/by-date",
+                          {"target_date": date.today().isoformat()})
+    assert response.headers["etag"].startswith('"history-') and "last-modified" not in response.headers
+
+
+def test_range_etag_only_when_result_is_stable(client, auth_headers, device):
+    url = f"/api/device/{device}/history/range"
+    start = (datetime.now() - timedelta(hours=1)).isoformat()
+    end = datetime.now().isoformat()
+
+    assert "etag" in revalidate(client, auth_headers, url, {"start": start}).headers
+    assert "etag" in revalidate(client, auth_headers, url, {"start": start, "end": end, "resolution": 60}).headers
+    # Bỏ trống end: số khung / lưới dựng lại đổi theo thời gian
+    assert "etag" not in revalidate(client, auth_headers, url, {"start": start, "resolution": 60}).headers
+    assert "etag" not in revalidate(client, auth_headers, url, {"start": start, "reconstruct": "step"}).headers
+    # Khoảng vượt thời gian giữ dữ liệu gốc tự chuyển sang khung rollup: cũng không có ETag
+    old_start = (datetime.now() - timedelta(days=40)).isoformat()
+    response = revalidate(client, auth_headers, url, {"start": old_start})
+    assert "resolution" in response.json() and "etag" not in response.headers
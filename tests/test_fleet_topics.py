@@ -0,0 +1,40 @@
+"""user-002: nhiều thiết bị qua topic wildcard, trạng thái riêng từng thiết bị"""
+import pytest
+
+from backend_app.config import settings
+from backend_app.mqtt_service import MQTTService
+from backend_app.state_cache import state_cache
+
+
+@pytest.mark.parametrize("topic, expected", [
+    ("iot/light/status", (settings.DEFAULT_DEVICE_ID, None)),
+    ("iot/light/status/struct", (settings.DEFAULT_DEVICE_ID, "struct")),
+    ("iot/light/lamp-7/status", ("lamp-7", None)),
+    ("iot/light/lamp-7/status/msgpack", ("lamp-7", "msgpack")),
+    ("iot/light//status", (None, None)),
+    ("iot/light/lamp-7/command", (None, None)),
+    ("other/topic", (None, None)),
+])
+def test_parse_status_topic(topic, expected):
+    assert MQTTService.parse_status_topic(topic) == expected
+
+
+def test_default_device_keeps_legacy_command_topic():
+    assert MQTTService.command_topic() == settings.MQTT_TOPIC_COMMAND
+    assert MQTTService.command_topic(settings.DEFAULT_DEVICE_ID) == settings.MQTT_TOPIC_COMMAND
+    assert MQTTService.command_topic("lamp-7") == "iot/light/lamp-7/command"
+
+
+def test_each_device_keeps_its_own_state(client, auth_headers, publish, device_id):
+    other = device_id + "-b"
+    publish(device_id, {"is_on": True, "brightness": 30, "sensor_value": 100, "is_auto_mode": False})
+    publish(other, {"is_on": False, "brightness": 0, "sensor_value": 900, "is_auto_mode": True})
+
+    assert state_cache.get(device_id)["sensor_value"] == 100
+    assert state_cache.get(other)["sensor_value"] == 900
+    body = client.get(f"/api/device/{other}/status", headers=auth_headers).json()
+    assert (body["is_on"], body["sensor_value"], body["is_auto_mode"]) == (False, 900, True)
+
+
+def test_unknown_device_status_is_404(client, auth_headers, device_id):
+    assert client.get(f"/api/device/{device_id}/status", headers=auth_headers).status_code == 404
@@ -0,0 +1,64 @@
+"""user-007: truy vấn lịch sử theo khoảng thời gian dùng index và export NDJSON/CSV dạng stream"""
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+
+from backend_app import history_export
+from backend_app.database import WriteSessionLocal
+from backend_app.history_export import history_range, iter_export
+from backend_app.models.device import SensorHistory
+
+# Còn trong thời gian giữ dữ liệu gốc (RETENTION_RAW_DAYS) nhưng ngoài recent_history -> đọc SQLite
+START = (datetime.now() - timedelta(days=2)).replace(microsecond=0)
+
+
+@pytest.fixture
+def history_device(device_id):
+    with WriteSessionLocal() as db:
+        db.bulk_insert_mappings(SensorHistory, [
+            dict(device_id=device_id, sensor_value=i, brightness=10, is_on=i % 2 == 0, is_auto_mode=False,
+                 timestamp=START + timedelta(seconds=i))
+            for i in range(2500)
+        ])
+        db.commit()
+    return device_id
+
+
+def test_range_query_uses_device_timestamp_index(db, device_id):
+    stmt = history_range((SensorHistory.id,), device_id, START, START + timedelta(hours=1))
+    compiled = stmt.compile(compile_kwargs={"literal_binds": True})
+    plan = " ".join(str(row[-1]) for row in db.execute(text(f"EXPLAIN QUERY PLAN {compiled}")))
+    assert "ix_sensor_history_device_ts" in plan
+
+
+def test_export_streams_in_chunks_over_half_open_range(history_device, monkeypatch):
+    monkeypatch.setattr(history_export, "EXPORT_CHUNK_ROWS", 1000)
+    chunks = list(iter_export(history_device, START + timedelta(seconds=100), START + timedelta(seconds=2200), "ndjson"))
+    rows = [json.loads(line) for chunk in chunks for line in chunk.splitlines()]
+    assert len(chunks) == 3
+    assert [rows[0]["sensor_value"], rows[-1]["sensor_value"], len(rows)] == [100, 2199, 2100]
+    assert rows[0]["is_on"] is True
+
+
+def test_export_api_csv(client, auth_headers, history_device):
+    params = {"start": str(START), "end": str(START + timedelta(seconds=10)), "format": "csv"}
+    response = client.get(f"/api/device/{history_device}/history/export", params=params, headers=auth_headers)
+    assert response.headers["content-type"].startswith("text/csv")
+    assert "attachment" in response.headers["content-disposition"]
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert rows[0] == list(history_export.EXPORT_FIELDS)
+    assert [int(r[2]) for r in rows[1:]] == list(range(10))
+
+
+def test_range_api_returns_first_rows_and_validates_range(client, auth_headers, history_device):
+    url = f"/api/device/{history_device}/history/range"
+    params = {"start": str(START + timedelta(seconds=5)), "end": str(START + timedelta(seconds=50)), "limit": 10}
+    body = client.get(url, params=params, headers=auth_headers).json()
+    assert [item["sensor_value"] for item in body["data"]] == list(range(5, 15))
+
+    params = {"start": str(START), "end": str(START)}
+    assert client.get(url, params=params, headers=auth_headers).status_code == 400
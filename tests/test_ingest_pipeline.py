@@ -0,0 +1,61 @@
+"""user-001: hàng đợi ghi trễ (write-behind) của ingest_service"""
+from datetime import datetime, timedelta
+
+from backend_app.ingest_service import IngestPipeline
+from backend_app.models.device import DeviceState, SensorHistory
+from backend_app.state_cache import state_cache
+
+
+def make_state(device_id, sensor_value, record_time):
+    return {
+        "device_id": device_id, "is_on": True, "brightness": 50, "sensor_value": sensor_value,
+        "is_auto_mode": False, "last_updated": record_time, "rules_armed": None,
+    }
+
+
+def test_submit_drops_when_queue_full(device_id):
+    pipeline = IngestPipeline(maxsize=1, batch_size=10, flush_interval=0.01)
+    now = datetime.now()
+    assert pipeline.submit(device_id, make_state(device_id, 1, now), now) is True
+    assert pipeline.submit(device_id, make_state(device_id, 2, now), now) is False
+    assert (pipeline.received, pipeline.dropped) == (2, 1)
+
+
+def test_collect_stops_at_batch_size(device_id):
+    pipeline = IngestPipeline(maxsize=10, batch_size=2, flush_interval=1.0)
+    now = datetime.now()
+    for value in range(3):
+        pipeline.submit(device_id, make_state(device_id, value, now), now)
+    assert len(pipeline._collect()) == 2
+    assert len(pipeline._collect()) == 1
+
+
+def test_flush_keeps_last_state_and_every_history_row(db, device_id):
+    pipeline = IngestPipeline(maxsize=10, batch_size=10, flush_interval=0.01)
+    start = datetime.now() - timedelta(seconds=3)
+    for value in range(3):
+        record_time = start + timedelta(seconds=value)
+        pipeline.submit(device_id, make_state(device_id, value, record_time), record_time)
+    before = state_cache.history_version(device_id)
+
+    pipeline._flush(pipeline._collect())
+
+    assert (pipeline.flushed_batches, pipeline.flushed_messages, pipeline.failed_batches) == (1, 3, 0)
+    row = db.query(DeviceState).filter(DeviceState.device_id == device_id).one()
+    assert row.sensor_value == 2
+    values = [r.sensor_value for r in db.query(SensorHistory).filter(SensorHistory.device_id == device_id)
+              .order_by(SensorHistory.timestamp)]
+    assert values == [0, 1, 2]
+    assert state_cache.history_version(device_id) > before
+
+
+def test_flush_does_not_overwrite_newer_state(db, device_id):
+    pipeline = IngestPipeline(maxsize=10, batch_size=10, flush_interval=0.01)
+    now = datetime.now()
+    pipeline.submit(device_id, make_state(device_id, 9, now), now)
+    pipeline._flush(pipeline._collect())
+    older = now - timedelta(minutes=1)
+    pipeline.submit(device_id, make_state(device_id, 1, older), older)
+    pipeline._flush(pipeline._collect())
+
+    assert db.query(DeviceState).filter(DeviceState.device_id == device_id).one().sensor_value == 9
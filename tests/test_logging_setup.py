@@ -0,0 +1,44 @@
+"""user-018: log không chặn (QueueHandler bỏ bản ghi khi đầy), log có cấu trúc và lấy mẫu"""
+import logging
+import queue
+import time
+
+import backend_app.main  # noqa: F401  (main gọi setup_logging lúc import)
+from backend_app.logging_setup import LogSampler, StructuredFormatter, _DroppingQueueHandler, setup_logging
+
+
+def make_record(**extra):
+    record = logging.LogRecord("backend_app.test", logging.INFO, __file__, 1, "hello %s", ("world",), None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_structured_fields_are_appended():
+    formatter = StructuredFormatter("%(message)s")
+    assert formatter.format(make_record()) == "hello world"
+    line = formatter.format(make_record(device="d1", latency_ms=12.5, other="x"))
+    assert line == "hello world device=d1 latency_ms=12.5"
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = _DroppingQueueHandler(queue.Queue(2))
+    started = time.perf_counter()
+    for _ in range(5):
+        handler.handle(make_record())
+    assert time.perf_counter() - started < 0.5
+    assert handler.queue.qsize() == 2 and handler.dropped == 3
+
+
+def test_sampler_keeps_one_in_every():
+    sample = LogSampler(every=3)
+    assert [sample("a") for _ in range(7)] == [True, False, False, True, False, False, True]
+    assert sample("b") is True
+    assert all(LogSampler(every=0)("k") for _ in range(3))
+
+
+def test_setup_logging_is_idempotent():
+    setup_logging()
+    setup_logging()
+    logger = logging.getLogger("backend_app")
+    assert sum(isinstance(h, _DroppingQueueHandler) for h in logger.handlers) == 1
+    assert logger.propagate is False
@@ -0,0 +1,77 @@
+"""user-015: registry metric kiểu Prometheus (shard theo thread) và endpoint /metrics"""
+import threading
+
+from backend_app.metrics import MetricsRegistry
+
+
+def parse(text: str) -> dict:
+    """{"tên{nhãn}": giá trị} từ text exposition format (bỏ dòng HELP/TYPE)"""
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_counter_merges_thread_shards():
+    registry = MetricsRegistry()
+    counter = registry.counter("jobs_total", "Jobs", ("kind",))
+
+    def work():
+        for _ in range(1000):
+            counter.inc(labels=("a",))
+        counter.inc(5, labels=("b",))
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    text = registry.render()
+    assert "# TYPE jobs_total counter" in text
+    samples = parse(text)
+    assert samples['jobs_total{kind="a"}'] == 4000
+    assert samples['jobs_total{kind="b"}'] == 20
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        histogram.observe(value)
+    samples = parse(registry.render())
+    assert samples['latency_seconds_bucket{le="0.1"}'] == 1
+    assert samples['latency_seconds_bucket{le="1"}'] == 3
+    assert samples['latency_seconds_bucket{le="+Inf"}'] == 4
+    assert samples["latency_seconds_count"] == 4
+    assert samples["latency_seconds_sum"] == 4.25
+
+
+def test_histogram_timer_and_label_escaping():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("op_seconds", "Op", ("path",), buckets=(10.0,))
+    with histogram.time(('/a"b',)):
+        pass
+    assert parse(registry.render())['op_seconds_count{path="/a\\"b"}'] == 1
+
+
+def test_gauge_reads_callback_and_skips_errors():
+    registry = MetricsRegistry()
+    registry.gauge("queue_depth", "Depth", lambda: 7)
+    registry.gauge("broken", "Broken", lambda: 1 / 0)
+    samples = parse(registry.render())
+    assert samples["queue_depth"] == 7 and "broken" not in samples
+
+
+def test_metrics_endpoint_reports_routes(client, auth_headers):
+    client.get("/api/device/settings", headers=auth_headers)
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert "# TYPE iot_http_request_seconds histogram" in text
+    # Nhãn route là mẫu đường dẫn, không phải URL thật
+    assert 'route="/api/device/settings"' in text
+    assert "iot_ingest_queue_depth " in text
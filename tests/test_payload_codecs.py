@@ -0,0 +1,49 @@
+"""user-021: định dạng payload status (JSON, struct, msgpack/cbor tùy chọn)"""
+import pytest
+
+from backend_app.payload_codecs import CODECS, decode_payload, encode_payload, get_codec
+from backend_app.state_cache import state_cache
+
+STATUS = {"is_on": True, "brightness": 70, "sensor_value": 1023, "is_auto_mode": False}
+
+
+@pytest.mark.parametrize("name", sorted(CODECS))
+def test_round_trip_by_format_byte(name):
+    codec, data = decode_payload(encode_payload(STATUS, name))
+    assert codec.name == name and data == STATUS
+
+
+@pytest.mark.parametrize("name", sorted(CODECS))
+def test_round_trip_by_topic_suffix(name):
+    body = encode_payload(STATUS, name, format_byte=False)
+    codec, data = decode_payload(body, name)
+    assert codec.name == name and data == STATUS
+
+
+def test_json_without_format_byte_and_memoryview():
+    body = b' {"is_on": false}'
+    assert decode_payload(body)[1] == {"is_on": False}
+    assert decode_payload(memoryview(b'{"a": 1}'))[1] == {"a": 1}
+
+
+def test_struct_layout():
+    body = encode_payload(dict(STATUS, is_auto_mode=True), "struct", format_byte=False)
+    assert body == bytes((0b11, 70)) + (1023).to_bytes(2, "little")
+    with pytest.raises(ValueError, match="4 bytes"):
+        decode_payload(body[:3], "struct")
+
+
+def test_unknown_or_missing_codec():
+    with pytest.raises(ValueError, match="not available"):
+        get_codec("protobuf")
+    if "msgpack" not in CODECS:
+        # Byte định dạng đã biết nhưng thư viện chưa cài: báo rõ thay vì thử đọc như JSON
+        with pytest.raises(ValueError, match="'msgpack' is not available"):
+            decode_payload(bytes((0x02,)) + b"\x80")
+
+
+@pytest.mark.parametrize("suffix", ["", "/struct"])
+def test_on_message_accepts_struct_payload(client, publish, device_id, suffix):
+    publish(device_id, encode_payload(STATUS, "struct", format_byte=not suffix), suffix)
+    state = state_cache.get(device_id)
+    assert {k: state[k] for k in STATUS} == STATUS
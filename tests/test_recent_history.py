@@ -0,0 +1,109 @@
+"""user-020: vòng đệm lịch sử gần đây trong bộ nhớ (ring buffer numpy)"""
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from backend_app.database import WriteSessionLocal
+from backend_app.downsampling import to_epoch
+from backend_app.ingest_service import ingest_pipeline
+from backend_app.models.device import SensorHistory
+from backend_app.recent_history import RecentHistoryBuffer, recent_history
+
+T0 = datetime.now().replace(microsecond=0) - timedelta(minutes=30)
+
+
+def sample(value, is_on=True, auto=False):
+    return {"sensor_value": value, "brightness": value % 100, "is_on": is_on, "is_auto_mode": auto}
+
+
+@pytest.fixture
+def buffer(db):
+    def make(capacity=4, warm_rows=1000000):
+        buf = RecentHistoryBuffer(capacity=capacity, horizon_hours=1, warm_rows=warm_rows)
+        buf.warm(db)
+        return buf
+    return make
+
+
+def test_new_device_after_warm_is_complete(buffer, device_id):
+    buf = buffer()
+    assert buf.series(device_id, T0)["ts"].size == 0
+    assert buf.series(device_id, datetime.now() - timedelta(hours=2)) is None   # trước mốc warm
+    assert buf.stats()["hits"] == 1 and buf.stats()["misses"] == 1
+
+
+def test_ring_wraps_and_keeps_newest(buffer, device_id):
+    buf = buffer(capacity=4)
+    warmed = buf.stats()["samples"]     # DB dùng chung: các test khác có thể đã ghi mẫu gần đây
+    for i in range(6):
+        buf.append(device_id, sample(100 + i, is_on=i % 2 == 0, auto=i == 5), T0 + timedelta(seconds=i))
+    # Hai mẫu đầu đã bị ghi đè: khoảng bắt đầu trước mẫu cũ nhất còn lại không phục vụ được
+    assert buf.series(device_id, T0) is None
+    series = buf.series(device_id, T0 + timedelta(seconds=2))
+    assert series["sensor_value"].tolist() == [102, 103, 104, 105]
+    assert series["is_on"].tolist() == [1, 0, 1, 0]
+    assert series["is_auto_mode"].tolist() == [0, 0, 0, 1]
+    assert buf.stats()["samples"] == warmed + 4
+
+    part = buf.series(device_id, T0 + timedelta(seconds=3), T0 + timedelta(seconds=5))
+    assert part["ts"].tolist() == [to_epoch(T0 + timedelta(seconds=s)) for s in (3, 4)]
+
+
+def test_ring_grows_up_to_capacity(buffer, device_id):
+    buf = buffer(capacity=200)
+    for i in range(150):
+        buf.append(device_id, sample(i), T0 + timedelta(seconds=i))
+    series = buf.series(device_id, T0)
+    assert series["sensor_value"].tolist() == list(range(150))
+
+
+def test_extend_merges_late_batch(buffer, device_id):
+    buf = buffer(capacity=10)
+    buf.extend(device_id, [(T0 + timedelta(seconds=s), sample(s)) for s in (0, 4, 8)])
+    # Lô gửi bù (cũ hơn mẫu cuối) được trộn vào đúng vị trí
+    buf.extend(device_id, [(T0 + timedelta(seconds=s), sample(s)) for s in (2, 6)])
+    buf.extend(device_id, [])
+    assert buf.series(device_id, T0)["sensor_value"].tolist() == [0, 2, 4, 6, 8]
+
+
+def test_discard_before_cutoff(buffer, device_id):
+    buf = buffer(capacity=10)
+    for i in range(5):
+        buf.append(device_id, sample(i), T0 + timedelta(seconds=i))
+    buf.discard(device_id, T0 + timedelta(seconds=3))
+    assert buf.series(device_id, T0)["sensor_value"].tolist() == [3, 4]
+    buf.discard(device_id)
+    assert buf.series(device_id, T0)["ts"].size == 0
+
+
+def test_warm_loads_db_rows_and_respects_row_cap(db, buffer, device_id):
+    # Mốc vài giây sau hiện tại: chắc chắn là các mẫu mới nhất trong DB dùng chung của bộ test
+    base = datetime.now() + timedelta(seconds=5)
+    with WriteSessionLocal() as write_db:
+        write_db.add_all(
+            SensorHistory(device_id=device_id, sensor_value=i, brightness=i, is_on=True, is_auto_mode=False,
+                          timestamp=base + timedelta(milliseconds=100 * i))
+            for i in range(5)
+        )
+        write_db.commit()
+
+    full = buffer(capacity=10)
+    assert full.series(device_id, base - timedelta(minutes=1))["sensor_value"].tolist() == [0, 1, 2, 3, 4]
+
+    capped = buffer(capacity=10, warm_rows=3)
+    assert capped.stats()["samples"] == 3
+    assert capped.series(device_id, base) is None
+    # Mẫu cũ nhất đã nạp có thể có mẫu cùng thời điểm bị cắt: chỉ đầy đủ từ SAU mẫu đó
+    assert capped.series(device_id, base + timedelta(milliseconds=200)) is None
+    series = capped.series(device_id, base + timedelta(milliseconds=250))
+    assert series["sensor_value"].tolist() == [3, 4]
+    assert np.all(np.diff(series["ts"]) > 0)
+
+
+def test_dropped_message_is_not_buffered(client, publish, device_id, monkeypatch):
+    monkeypatch.setattr(ingest_pipeline, "submit", lambda *args, **kwargs: False)
+    since = datetime.now() - timedelta(seconds=1)
+    publish(device_id, {"sensor_value": 500, "brightness": 20, "is_on": True, "is_auto_mode": False})
+    series = recent_history.series(device_id, since)
+    assert series is not None and series["ts"].size == 0
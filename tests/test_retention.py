@@ -0,0 +1,80 @@
+"""user-008: dọn dữ liệu cũ theo lô trên thread nền và incremental vacuum"""
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend_app.config import settings
+from backend_app.database import WriteSessionLocal
+from backend_app.models.device import SensorHistory
+from backend_app.retention import AUTO_VACUUM_INCREMENTAL, RetentionEngine, auto_vacuum_mode
+from backend_app.state_cache import state_cache
+
+
+@pytest.fixture
+def engine():
+    return RetentionEngine(interval=3600, batch_size=7, batch_pause=0, vacuum_pages=100)
+
+
+def add_history(device_id, times):
+    with WriteSessionLocal() as db:
+        db.bulk_insert_mappings(SensorHistory, [
+            dict(device_id=device_id, sensor_value=1, brightness=1, is_on=True, is_auto_mode=False, timestamp=ts)
+            for ts in times
+        ])
+        db.commit()
+
+
+def count(db, device_id):
+    return db.query(SensorHistory).filter(SensorHistory.device_id == device_id).count()
+
+
+def test_delete_batched_only_removes_rows_before_cutoff(db, engine, device_id):
+    now = datetime.now()
+    add_history(device_id, [now - timedelta(hours=h) for h in range(1, 51)])
+    add_history(device_id + "-other", [now - timedelta(hours=30)])
+
+    deleted = engine.delete_batched("sensor_history", "timestamp", now - timedelta(hours=20), device_id)
+
+    assert deleted == 30
+    assert count(db, device_id) == 20
+    assert count(db, device_id + "-other") == 1
+
+
+def test_job_keeps_recent_hours_and_bumps_history_version(db, engine, device_id):
+    now = datetime.now()
+    add_history(device_id, [now - timedelta(hours=h) for h in range(1, 11)])
+    before = state_cache.history_version(device_id)
+
+    job = engine.schedule_delete(device_id, keep_hours=5)
+    engine._run_job(job["job_id"])
+
+    result = engine.get_job(job["job_id"])
+    assert (result["status"], result["deleted_records"]) == ("done", 6)
+    assert count(db, device_id) == 4
+    assert state_cache.history_version(device_id) > before
+
+
+def test_policies_remove_expired_raw_rows(db, engine, device_id):
+    now = datetime.now()
+    add_history(device_id, [now - timedelta(days=settings.RETENTION_RAW_DAYS + 1), now - timedelta(days=1)])
+    assert engine.apply_policies() >= 1
+    assert count(db, device_id) == 1
+
+
+def test_new_database_uses_incremental_vacuum():
+    assert auto_vacuum_mode() == AUTO_VACUUM_INCREMENTAL
+
+
+def test_delete_api_runs_job_in_background(client, auth_headers, db, device_id):
+    add_history(device_id, [datetime.now() - timedelta(minutes=m) for m in range(1, 4)])
+    job = client.delete(f"/api/device/{device_id}/history", headers=auth_headers)
+    assert job.status_code == 202
+
+    url = f"/api/device/history/jobs/{job.json()['job_id']}"
+    deadline = time.monotonic() + 5
+    while client.get(url, headers=auth_headers).json()["status"] != "done" and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert client.get(url, headers=auth_headers).json()["deleted_records"] == 3
+    assert count(db, device_id) == 0
+    assert client.get("/api/device/history/jobs/missing", headers=auth_headers).status_code == 404
@@ -0,0 +1,135 @@
+"""user-006: bảng rollup phút/giờ/ngày cập nhật tăng dần và chọn mức rollup cho API lịch sử"""
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from backend_app.config import settings
+from backend_app.database import WriteSessionLocal
+from backend_app.downsampling import bucket_aggregate, load_series
+from backend_app.models.device import SensorHistory, SensorRollupMinute, SensorRollupHour
+from backend_app.rollups import (
+    RollupAggregator, align_to_rollup, backfill, estimate_history_rows, load_rollup_series,
+    pick_rollup_level, rollup_buckets, rollup_resolution,
+)
+
+MINUTE = datetime(2026, 3, 1, 10, 0)
+
+
+def row(device_id, ts, sensor_value, is_on=True, brightness=50):
+    return {"device_id": device_id, "timestamp": ts, "sensor_value": sensor_value,
+            "brightness": brightness, "is_on": is_on, "is_auto_mode": False}
+
+
+def rollup_row(db, model, device_id):
+    return db.query(model).filter(model.device_id == device_id).one()
+
+
+def test_upsert_merges_batches_into_same_bucket(db, device_id):
+    aggregator = RollupAggregator(max_gap_seconds=300)
+    with WriteSessionLocal() as write_db:
+        aggregator.apply(write_db, [row(device_id, MINUTE, 10), row(device_id, MINUTE + timedelta(seconds=20), 30)])
+        write_db.commit()
+        aggregator.apply(write_db, [row(device_id, MINUTE + timedelta(seconds=40), 5, is_on=False)])
+        write_db.commit()
+
+    minute = rollup_row(db, SensorRollupMinute, device_id)
+    assert (minute.count, minute.sensor_min, minute.sensor_max, minute.sensor_sum) == (3, 5, 30, 45)
+    assert (minute.on_count, minute.on_seconds) == (2, 40.0)
+    assert rollup_row(db, SensorRollupHour, device_id).count == 3
+
+
+def test_gap_longer_than_max_gap_is_not_on_time(db, device_id):
+    aggregator = RollupAggregator(max_gap_seconds=30)
+    with WriteSessionLocal() as write_db:
+        aggregator.apply(write_db, [row(device_id, MINUTE, 1), row(device_id, MINUTE + timedelta(seconds=45), 2)])
+        write_db.commit()
+    assert rollup_row(db, SensorRollupMinute, device_id).on_seconds == 0.0
+
+
+def test_backfill_matches_incremental_rollup(db, device_id):
+    rows = [row(device_id, MINUTE + timedelta(seconds=17 * i), i % 97, is_on=i % 5 != 0) for i in range(400)]
+    aggregator = RollupAggregator(max_gap_seconds=settings.ROLLUP_MAX_GAP_SECONDS)
+    columns = ("bucket_start", "count", "sensor_min", "sensor_max", "sensor_sum", "on_count", "on_seconds")
+    with WriteSessionLocal() as write_db:
+        write_db.bulk_insert_mappings(SensorHistory, rows)
+        aggregator.apply(write_db, rows[:150])
+        aggregator.apply(write_db, rows[150:])
+        write_db.commit()
+        incremental = [tuple(getattr(r, c) for c in columns) for r in write_db.query(SensorRollupMinute)
+                       .filter(SensorRollupMinute.device_id == device_id).order_by(SensorRollupMinute.bucket_start)]
+        backfill(write_db, device_id)
+        write_db.commit()
+        rebuilt = [tuple(getattr(r, c) for c in columns) for r in write_db.query(SensorRollupMinute)
+                   .filter(SensorRollupMinute.device_id == device_id).order_by(SensorRollupMinute.bucket_start)]
+    assert [r[:-1] for r in rebuilt] == [r[:-1] for r in incremental]
+    assert [r[-1] for r in rebuilt] == pytest.approx([r[-1] for r in incremental])
+
+
+@pytest.mark.parametrize("resolution, level", [(30, None), (60, 60), (90, None), (300, 60), (7200, 3600), (172800, 86400)])
+def test_pick_rollup_level(resolution, level):
+    picked = pick_rollup_level(resolution)
+    assert (picked[0] if picked else None) == level
+
+
+def test_rollup_resolution_bounds_point_count():
+    assert rollup_resolution(3600, 100) is None
+    assert rollup_resolution(7 * 86400, 5000) == 180
+    assert align_to_rollup(5000) == 7200
+
+
+def test_bucket_aggregate_on_seconds_matches_rollup(db, device_id):
+    rows = [row(device_id, MINUTE + timedelta(seconds=23 * i), i, is_on=(i // 7) % 2 == 0) for i in range(300)]
+    with WriteSessionLocal() as write_db:
+        write_db.bulk_insert_mappings(SensorHistory, rows)
+        RollupAggregator(max_gap_seconds=settings.ROLLUP_MAX_GAP_SECONDS).apply(write_db, rows)
+        write_db.commit()
+    end = MINUTE + timedelta(hours=2)
+    raw = bucket_aggregate(load_series(db, device_id, MINUTE, end), 600)
+    rolled = rollup_buckets(load_rollup_series(db, SensorRollupMinute, device_id, MINUTE, end), 600)
+    assert sorted(raw) == sorted(rolled)
+    assert np.allclose(raw["on_seconds"], rolled["on_seconds"])
+    assert np.array_equal(raw["count"], rolled["count"])
+
+
+@pytest.fixture
+def hourly_device(device_id):
+    """Một mẫu mỗi phút trong 2 ngày gần đây, rollup dựng bằng backfill"""
+    now = datetime.now().replace(second=0, microsecond=0)
+    with WriteSessionLocal() as write_db:
+        write_db.bulk_insert_mappings(SensorHistory, [
+            row(device_id, now - timedelta(minutes=i), i % 500) for i in range(1, 2 * 1440)
+        ])
+        backfill(write_db, device_id)
+        write_db.commit()
+    return device_id, now
+
+
+def test_estimate_history_rows_uses_hourly_rollup(db, hourly_device):
+    device_id, now = hourly_device
+    assert estimate_history_rows(db, device_id, now - timedelta(days=3)) == 2 * 1440 - 1
+
+
+def test_wide_range_switches_to_rollup_buckets(client, auth_headers, hourly_device, monkeypatch):
+    device_id, now = hourly_device
+    monkeypatch.setattr(settings, "HISTORY_RAW_ROW_BUDGET", 500)
+    params = {"start": str(now - timedelta(days=2)), "end": str(now - timedelta(hours=1)), "limit": 50}
+    body = client.get(f"/api/device/{device_id}/history/range", params=params, headers=auth_headers).json()
+    assert body["resolution"] % 60 == 0
+    assert 0 < body["total"] <= 50
+    assert {"on_seconds", "count"} <= set(body["data"][0])
+
+    monkeypatch.setattr(settings, "HISTORY_RAW_ROW_BUDGET", 10000)
+    body = client.get(f"/api/device/{device_id}/history/range", params=params, headers=auth_headers).json()
+    assert "resolution" not in body and body["total"] == 50
+
+
+def test_range_past_raw_retention_reads_rollups(client, auth_headers, device_id):
+    old = (datetime.now() - timedelta(days=settings.RETENTION_RAW_DAYS + 5)).replace(second=0, microsecond=0)
+    with WriteSessionLocal() as write_db:
+        RollupAggregator(max_gap_seconds=300).apply(write_db, [row(device_id, old + timedelta(minutes=i), i) for i in range(5)])
+        write_db.commit()
+    params = {"start": str(old - timedelta(hours=1)), "end": str(old + timedelta(hours=1))}
+    body = client.get(f"/api/device/{device_id}/history/range", params=params, headers=auth_headers).json()
+    assert body["resolution"] == 60
+    assert [item["count"] for item in body["data"]] == [1] * 5
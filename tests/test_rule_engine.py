@@ -0,0 +1,125 @@
+"""user-012: rule_engine (trễ, debounce, dwell) và cờ rules_armed lưu cùng trạng thái thiết bị"""
+import time
+from datetime import datetime, timedelta
+
+from backend_app.models.device import DeviceState
+from backend_app.routers.control import build_command
+from backend_app.rule_engine import RuleEngine
+from backend_app.schemas.device_schema import ControlRequest
+from backend_app.state_cache import state_cache
+
+T0 = datetime(2026, 3, 1, 18, 0, 0)
+THRESHOLDS = {"light_threshold_low": 300, "light_threshold_high": 700}
+AUTO_ON = {"type": "AUTO", "enable": True}
+LIGHT_OFF = {"type": "MANUAL", "state": "OFF", "brightness": 0}
+
+
+def make_engine(debounce=5, dwell=0):
+    engine = RuleEngine(enabled=True, debounce_seconds=debounce, min_dwell_seconds=dwell)
+    engine.configure(THRESHOLDS)
+    return engine
+
+
+def make_state(sensor, is_on=False, auto=False, armed=True):
+    return {"is_on": is_on, "is_auto_mode": auto, "sensor_value": sensor, "rules_armed": armed}
+
+
+def test_debounce_needs_zone_to_hold():
+    engine = make_engine(debounce=5)
+    assert engine.evaluate("d", make_state(900), T0) is None
+    assert engine.evaluate("d", make_state(900), T0 + timedelta(seconds=3)) is None
+    assert engine.evaluate("d", make_state(900), T0 + timedelta(seconds=5)) == AUTO_ON
+    assert engine.debounced == 2 and engine.commands_sent == 1
+
+
+def test_flicker_resets_debounce():
+    engine = make_engine(debounce=5)
+    engine.evaluate("d", make_state(900), T0)
+    engine.evaluate("d", make_state(100), T0 + timedelta(seconds=3))  # sáng chen vào
+    assert engine.evaluate("d", make_state(900), T0 + timedelta(seconds=6)) is None
+    assert engine.evaluate("d", make_state(900), T0 + timedelta(seconds=11)) == AUTO_ON
+
+
+def test_hysteresis_band_keeps_zone():
+    engine = make_engine(debounce=0)
+    assert engine.evaluate("d", make_state(900), T0) == AUTO_ON
+    # Giữa low và high: giữ vùng DARK, không gửi gì dù đèn đang tắt
+    assert engine.evaluate("d", make_state(500, is_on=False), T0 + timedelta(seconds=1)) is None
+    assert engine.evaluate("d", make_state(100, is_on=True, auto=True), T0 + timedelta(seconds=2)) == LIGHT_OFF
+
+
+def test_no_command_when_light_already_right():
+    engine = make_engine(debounce=0)
+    assert engine.evaluate("d", make_state(900, is_on=True, auto=True), T0) is None
+    assert engine.commands_sent == 0
+    # Vùng vẫn được xác nhận: lần sau không cần debounce lại
+    assert engine.stats()["devices"] == 1
+
+
+def test_min_dwell_between_commands():
+    engine = make_engine(debounce=0, dwell=60)
+    assert engine.evaluate("d", make_state(900), T0) == AUTO_ON
+    assert engine.evaluate("d", make_state(100, is_on=True), T0 + timedelta(seconds=10)) is None
+    assert engine.dwell_suppressed == 1
+    assert engine.evaluate("d", make_state(100, is_on=True), T0 + timedelta(seconds=61)) == LIGHT_OFF
+
+
+def test_disarmed_device_is_left_alone():
+    engine = make_engine(debounce=0)
+    assert engine.evaluate("d", make_state(900, armed=False), T0) is None
+    assert engine.commands_sent == 0
+
+
+def test_unconfigured_or_disabled_engine_does_nothing():
+    engine = RuleEngine(enabled=True, debounce_seconds=0, min_dwell_seconds=0)
+    assert engine.evaluate("d", make_state(900), T0) is None
+    engine.enabled = False
+    engine.configure(THRESHOLDS)
+    assert engine.evaluate("d", make_state(900), T0) is None
+
+
+def test_first_decision_is_recorded_in_device_state(device_id):
+    state_cache.apply_changes(device_id, {"sensor_value": 900, "is_auto_mode": True}, T0)
+    engine = make_engine(debounce=0)
+    engine.evaluate(device_id, state_cache.get(device_id), T0)
+    assert state_cache.get(device_id)["rules_armed"] is True
+
+    # Lệnh tắt đèn của chính luật làm mất is_auto_mode nhưng không tắt luật
+    state_cache.apply_changes(device_id, {"sensor_value": 100, "is_on": True, "is_auto_mode": False}, T0)
+    assert engine.evaluate(device_id, state_cache.get(device_id), T0 + timedelta(seconds=1)) == LIGHT_OFF
+    assert state_cache.get(device_id)["rules_armed"] is True
+
+
+def test_first_decision_follows_auto_mode(device_id):
+    state_cache.apply_changes(device_id, {"sensor_value": 900, "is_auto_mode": False}, T0)
+    engine = make_engine(debounce=0)
+    assert engine.evaluate(device_id, state_cache.get(device_id), T0) is None
+    assert state_cache.get(device_id)["rules_armed"] is False
+
+
+def test_manual_control_disarms_and_auto_rearms():
+    device = make_state(500)
+    changes, _ = build_command(ControlRequest(action="SET_BRIGHTNESS", value=40), device)
+    assert changes["rules_armed"] is False
+    changes, _ = build_command(ControlRequest(action="SET_AUTO", enable=True), device)
+    assert changes["rules_armed"] is True
+    changes, _ = build_command(ControlRequest(action="SET_AUTO", enable=False), device)
+    assert changes["rules_armed"] is False
+
+
+def test_rules_armed_persists_across_reload(client, auth_headers, db, device_id, make_device):
+    make_device(device_id, is_auto_mode=True)
+    response = client.post(f"/api/device/{device_id}/control", headers=auth_headers,
+                           json={"action": "SET_BRIGHTNESS", "value": 30})
+    assert response.status_code == 200
+    # Trạng thái được command_scheduler lưu sau cửa sổ gộp lệnh
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        db.expire_all()
+        row = db.query(DeviceState).filter(DeviceState.device_id == device_id).one()
+        if row.rules_armed is not None:
+            break
+        time.sleep(0.05)
+    assert row.rules_armed is False
+    state_cache.invalidate(device_id)
+    assert state_cache.get(device_id)["rules_armed"] is False
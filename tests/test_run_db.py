@@ -0,0 +1,57 @@
+"""user-010: truy vấn DB đồng bộ chạy trên thread pool riêng, không chặn event loop"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from backend_app.config import settings
+from backend_app.database import run_db
+
+
+def current_thread_name():
+    return threading.current_thread().name
+
+
+def test_run_db_uses_db_executor(monkeypatch):
+    monkeypatch.setattr(settings, "DB_OFFLOAD", True)
+    assert asyncio.run(run_db(current_thread_name)).startswith("db")
+
+
+def test_run_db_inline_when_offload_disabled(monkeypatch):
+    monkeypatch.setattr(settings, "DB_OFFLOAD", False)
+    assert asyncio.run(run_db(current_thread_name)) == threading.current_thread().name
+
+
+def test_blocking_calls_do_not_stall_event_loop(monkeypatch):
+    monkeypatch.setattr(settings, "DB_OFFLOAD", True)
+
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        started = time.perf_counter()
+        await asyncio.gather(run_db(time.sleep, 0.2), run_db(time.sleep, 0.2))
+        elapsed = time.perf_counter() - started
+        task.cancel()
+        return elapsed, ticks
+
+    elapsed, ticks = asyncio.run(scenario())
+    assert elapsed < 0.35     # Hai lời gọi chạy song song trên pool
+    assert ticks >= 5         # Event loop vẫn chạy trong lúc chờ
+
+
+def test_run_db_propagates_exceptions(monkeypatch):
+    monkeypatch.setattr(settings, "DB_OFFLOAD", True)
+
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError, match="boom"):
+        asyncio.run(run_db(fail))
@@ -0,0 +1,91 @@
+"""user-003: cache trạng thái thiết bị trong bộ nhớ và thread theo dõi thay đổi từ tiến trình khác"""
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend_app.config import settings
+from backend_app.database import WriteSessionLocal
+from backend_app.models.device import DeviceState
+from backend_app.state_cache import DeviceStateCache, state_cache
+
+
+def external_connection():
+    return sqlite3.connect(settings.DATABASE_URL.removeprefix("sqlite:///"))
+
+
+@pytest.fixture
+def watcher():
+    # watch_engine chỉ có MỘT connection: tạm dừng thread theo dõi của app nếu đang chạy.
+    # Chu kỳ dài: thread nền không tự chạy, test gọi _external_change() trực tiếp
+    running = state_cache._thread is not None
+    state_cache.stop()
+    cache = DeviceStateCache(revalidate_interval=3600)
+    cache.start()
+    yield cache
+    cache.stop()
+    if running:
+        state_cache.start()
+
+
+def test_apply_telemetry_merges_and_bumps_version(device_id):
+    now = datetime.now()
+    state_cache.apply_telemetry(device_id, {"is_on": True, "brightness": 40, "sensor_value": 10}, now)
+    version = state_cache.version(device_id)
+    state = state_cache.apply_telemetry(device_id, {"sensor_value": 20}, now + timedelta(seconds=1))
+
+    assert (state["is_on"], state["brightness"], state["sensor_value"]) == (True, 40, 20)
+    assert state_cache.version(device_id) > version
+    state["sensor_value"] = -1
+    assert state_cache.get(device_id)["sensor_value"] == 20
+
+
+def test_history_count_includes_late_samples_inside_window(device_id):
+    now = datetime.now()
+    state_cache.apply_telemetry(device_id, {"sensor_value": 1}, now)
+    state_cache.apply_samples(device_id, [(now - timedelta(hours=1), {"sensor_value": 2})])
+    state_cache.apply_samples(device_id, [(now - timedelta(days=2), {"sensor_value": 3})])
+    assert state_cache.history_count_24h(device_id) == 2
+
+
+def test_stale_batch_does_not_replace_state(device_id):
+    now = datetime.now()
+    state_cache.apply_telemetry(device_id, {"sensor_value": 5}, now)
+    rows, state = state_cache.apply_samples(device_id, [(now - timedelta(minutes=5), {"sensor_value": 1})])
+    assert state is None and len(rows) == 1
+    assert state_cache.get(device_id)["sensor_value"] == 5
+
+
+def test_own_writes_are_not_external(watcher, device_id):
+    with WriteSessionLocal() as db:
+        db.add(DeviceState(device_id=device_id, is_on=False, brightness=0, is_auto_mode=False))
+        db.commit()
+    assert watcher._external_change() is False
+    # Chu kỳ sau connection ghi rảnh: hỏi thẳng data_version của nó, vẫn không có thay đổi từ bên ngoài
+    assert watcher._external_change() is False
+
+
+def test_external_write_is_detected_and_reconciled(watcher, device_id):
+    watcher.load()
+    with external_connection() as conn:
+        conn.execute(
+            "INSERT INTO device_state (device_id, is_on, brightness, sensor_value, is_auto_mode, last_updated) "
+            "VALUES (?, 1, 77, 0, 0, ?)", (device_id, str(datetime.now())),
+        )
+    assert watcher._external_change() is True
+    watcher._reconcile()
+    assert watcher.get(device_id)["brightness"] == 77
+    assert watcher._external_change() is False
+
+
+def test_external_write_mixed_with_own_commit_is_detected(watcher, device_id):
+    with external_connection() as conn:
+        conn.execute(
+            "INSERT INTO device_state (device_id, is_on, brightness, sensor_value, is_auto_mode) VALUES (?, 0, 1, 0, 0)",
+            (device_id,),
+        )
+    with WriteSessionLocal() as db:
+        db.add(DeviceState(device_id=device_id + "-own", is_on=False, brightness=0, is_auto_mode=False))
+        db.commit()
+    # Lần trả connection ghi đã thấy data_version của nó đổi -> có commit từ bên ngoài
+    assert watcher._external_change() is True
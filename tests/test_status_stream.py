@@ -0,0 +1,61 @@
+"""user-004: phát trạng thái qua WebSocket thay cho polling"""
+import asyncio
+import json
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from backend_app.broadcast import BroadcastHub
+
+
+def state(device_id, sensor_value=0):
+    return {"device_id": device_id, "is_on": True, "brightness": 10, "sensor_value": sensor_value}
+
+
+def test_publish_without_loop_or_subscribers_is_noop():
+    hub = BroadcastHub(buffer_size=4)
+    hub.publish(state("a"))
+    assert hub.published == 0
+
+
+def test_fanout_reaches_device_and_fleet_subscribers():
+    async def scenario():
+        hub = BroadcastHub(buffer_size=4)
+        hub.bind_loop(asyncio.get_running_loop())
+        one, other, fleet = hub.subscribe("a"), hub.subscribe("b"), hub.subscribe()
+        hub.publish(state("a", 1))
+        return [json.loads(sub.queue.get_nowait())["sensor_value"] for sub in (one, fleet)], other.queue.qsize()
+
+    received, other_size = asyncio.run(scenario())
+    assert received == [1, 1]
+    assert other_size == 0
+
+
+def test_slow_subscriber_is_dropped_without_blocking_others():
+    async def scenario():
+        hub = BroadcastHub(buffer_size=2)
+        hub.bind_loop(asyncio.get_running_loop())
+        slow, fast = hub.subscribe("a"), hub.subscribe("a")
+        for value in range(3):
+            hub.publish(state("a", value))
+            fast.queue.get_nowait()
+        return hub, slow
+
+    hub, slow = asyncio.run(scenario())
+    assert slow.dropped and slow.queue.get_nowait() is None
+    assert hub.stats() == {"subscribers": 1, "published": 3, "dropped_clients": 1}
+
+
+def test_websocket_sends_snapshot_then_updates(client, auth_headers, publish, device_id):
+    token = auth_headers["Authorization"].split()[1]
+    publish(device_id, {"is_on": True, "brightness": 20, "sensor_value": 111, "is_auto_mode": False})
+    with client.websocket_connect(f"/api/device/{device_id}/stream?token={token}") as ws:
+        assert json.loads(ws.receive_text())["sensor_value"] == 111
+        publish(device_id, {"sensor_value": 222})
+        assert json.loads(ws.receive_text())["sensor_value"] == 222
+
+
+def test_websocket_rejects_invalid_token(client):
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect("/api/device/stream?token=invalid") as ws:
+            ws.receive_text()
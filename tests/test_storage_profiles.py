@@ -0,0 +1,36 @@
+"""user-011: profile PRAGMA của SQLite (WAL) và tách pool đọc / MỘT connection ghi"""
+import pytest
+
+from backend_app.config import settings
+from backend_app.database import create_db_engine, engine, write_engine
+
+
+def pragma(db_engine, name):
+    with db_engine.connect() as conn:
+        return conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+
+@pytest.mark.parametrize("db_engine", [engine, write_engine], ids=["read", "write"])
+def test_production_profile_applied_to_every_pool(db_engine):
+    assert pragma(db_engine, "journal_mode") == "wal"
+    assert pragma(db_engine, "synchronous") == 1  # NORMAL
+    assert pragma(db_engine, "busy_timeout") == 5000
+
+
+def test_single_write_connection_and_sized_read_pool():
+    assert write_engine.pool.size() == 1
+    assert engine.pool.size() == settings.DB_READ_POOL_SIZE
+
+
+def test_default_profile_keeps_sqlite_defaults(tmp_path):
+    default_engine = create_db_engine(f"sqlite:///{tmp_path}/plain.db", "default", pool_size=1)
+    try:
+        assert pragma(default_engine, "journal_mode") == "delete"
+        assert pragma(default_engine, "auto_vacuum") == 2  # INCREMENTAL cho DB mới
+    finally:
+        default_engine.dispose()
+
+
+def test_unknown_profile_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        create_db_engine(f"sqlite:///{tmp_path}/x.db", "turbo", pool_size=1)
@@ -0,0 +1,84 @@
+"""user-022: bản tin nhiều mẫu và hiệu chỉnh đồng hồ thiết bị (ClockSync)"""
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend_app.config import settings
+from backend_app.state_cache import state_cache
+from backend_app.telemetry_batch import ClockSync, batch_samples, clock_sync
+
+RECEIVED = 1_800_000_000.0
+
+
+def reading(value, **timing):
+    return dict(timing, sensor_value=value, brightness=10, is_on=True, is_auto_mode=False)
+
+
+def test_clock_sync_keeps_smallest_offset():
+    sync = ClockSync(window=3, resync_seconds=30)
+    # Uptime 100 s lúc server ở RECEIVED, các lần đo sau chịu thêm độ trễ mạng khác nhau
+    assert sync.observe("d", 100.0, RECEIVED + 0.3) == pytest.approx(RECEIVED - 99.7)
+    assert sync.observe("d", 110.0, RECEIVED + 10.1) == pytest.approx(RECEIVED - 99.9)
+    assert sync.observe("d", 120.0, RECEIVED + 20.5) == pytest.approx(RECEIVED - 99.9)
+    assert sync.offset("d") == pytest.approx(RECEIVED - 99.9)
+    assert sync.offset("other") is None
+
+
+def test_clock_sync_window_forgets_old_measurements():
+    sync = ClockSync(window=2, resync_seconds=30)
+    sync.observe("d", 0.0, 100.0)       # offset 100
+    sync.observe("d", 0.0, 105.0)
+    assert sync.observe("d", 0.0, 104.0) == 104.0
+
+
+def test_clock_sync_resyncs_after_jump():
+    sync = ClockSync(window=8, resync_seconds=30)
+    sync.observe("d", 500.0, RECEIVED)
+    # Thiết bị khởi động lại: uptime về gần 0
+    assert sync.observe("d", 5.0, RECEIVED + 10) == RECEIVED + 5
+    assert sync.stats() == {"devices": 1, "resyncs": 1}
+
+
+def test_batch_samples_uses_device_clock(device_id):
+    data = {"sent_at": 1000.0, "samples": [reading(3, t=999.0), reading(1, t=990.0), reading(2, t=995.0)]}
+    rows = batch_samples(device_id, data, RECEIVED)
+    assert [s["sensor_value"] for _, s in rows] == [1, 2, 3]
+    assert [ts for ts, _ in rows] == [datetime.fromtimestamp(RECEIVED - d) for d in (10, 5, 1)]
+    assert clock_sync.offset(device_id) == RECEIVED - 1000.0
+
+
+def test_batch_samples_age_default_and_clamp(device_id):
+    data = {"samples": [reading(1, age=30), reading(2), reading(3, t=50.0), reading(4, t=40.0)]}
+    rows = batch_samples(device_id, data, RECEIVED)
+    # Không có sent_at: mẫu có t lớn nhất coi là lúc gửi
+    assert [(ts, s["sensor_value"]) for ts, s in rows] == [
+        (datetime.fromtimestamp(RECEIVED - 30), 1),
+        (datetime.fromtimestamp(RECEIVED - 10), 4),
+        (datetime.fromtimestamp(RECEIVED), 2),
+        (datetime.fromtimestamp(RECEIVED), 3),
+    ]
+
+    # Giờ sau lúc nhận (age âm) bị kẹp lại
+    rows = batch_samples(device_id, {"samples": [reading(5, age=-60)]}, RECEIVED)
+    assert rows[0][0] == datetime.fromtimestamp(RECEIVED)
+
+
+@pytest.mark.parametrize("samples", [[], "x", [reading(0)] * (settings.TELEMETRY_BATCH_MAX_SAMPLES + 1)])
+def test_batch_samples_rejects_bad_batches(device_id, samples):
+    with pytest.raises(ValueError):
+        batch_samples(device_id, {"samples": samples}, RECEIVED)
+
+
+def test_on_message_batch_updates_state_from_newest(client, publish, device_id):
+    publish(device_id, {"sent_at": 5000.0, "samples": [
+        reading(300, t=4990.0), reading(900, t=4999.0), reading(600, t=4995.0),
+    ]})
+    state = state_cache.get(device_id)
+    assert state["sensor_value"] == 900
+    assert abs(state["last_updated"] - (datetime.now() - timedelta(seconds=1))) < timedelta(seconds=2)
+
+    # Lô gửi bù cũ hơn trạng thái hiện tại: chỉ bổ sung lịch sử
+    publish(device_id, {"samples": [reading(100, age=3600)]})
+    assert state_cache.get(device_id)["sensor_value"] == 900
+    assert time.time() - clock_sync.offset(device_id) == pytest.approx(5000.0, abs=2)
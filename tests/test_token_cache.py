@@ -0,0 +1,74 @@
+"""user-009: cache xác thực token trong get_current_user"""
+import sqlite3
+import time
+from datetime import timedelta
+
+from backend_app.config import settings
+from backend_app.database import WriteSessionLocal
+from backend_app.models.device import User
+from backend_app.routers.auth import create_access_token, get_password_hash
+from backend_app.token_cache import TokenCache, token_cache
+
+
+def make_user(username):
+    return User(username=username, hashed_password="x")
+
+
+def test_lru_eviction_and_expiry():
+    cache = TokenCache(max_size=2, ttl=60)
+    future = time.time() + 3600
+    cache.put("a", make_user("u1"), future)
+    cache.put("b", make_user("u2"), future)
+    cache.get("a")
+    cache.put("c", make_user("u3"), future)
+    assert cache.get("b") is None and cache.get("a") is not None
+    assert cache.evictions == 1
+
+    cache.put("old", make_user("u4"), time.time() - 1)  # exp của JWT đã qua
+    assert cache.get("old") is None
+
+
+def test_invalidate_user_drops_all_their_tokens():
+    cache = TokenCache(max_size=10, ttl=60)
+    future = time.time() + 3600
+    cache.put("a", make_user("u1"), future)
+    cache.put("b", make_user("u1"), future)
+    cache.put("c", make_user("u2"), future)
+    cache.invalidate_user("u1")
+    assert [cache.get(t) is None for t in "abc"] == [True, True, False]
+
+
+def test_revalidate_clears_only_when_users_table_changes(db, device_id):
+    cache = TokenCache(max_size=10, ttl=60)
+    cache.revalidate(db)
+    cache.put("a", make_user("u1"), time.time() + 3600)
+    cache.revalidate(db)
+    assert cache.get("a") is not None
+
+    with sqlite3.connect(settings.DATABASE_URL.removeprefix("sqlite:///")) as conn:
+        conn.execute("INSERT INTO users (username, hashed_password) VALUES (?, 'x')", (device_id,))
+    cache.revalidate(db)
+    assert cache.get("a") is None
+
+
+def test_cached_token_skips_verification_and_is_dropped_on_user_change(client, device_id):
+    with WriteSessionLocal() as db:
+        db.add(User(username=device_id, hashed_password=get_password_hash("pw")))
+        db.commit()
+    token = create_access_token({"sub": device_id}, timedelta(minutes=5))
+    headers = {"Authorization": f"Bearer {token}"}
+
+    assert client.get("/api/device/settings", headers=headers).status_code == 200
+    hits = token_cache.hits
+    assert client.get("/api/device/settings", headers=headers).status_code == 200
+    assert token_cache.hits == hits + 1
+
+    with WriteSessionLocal() as db:
+        db.query(User).filter(User.username == device_id).one().hashed_password = "changed"
+        db.commit()
+    assert token_cache.get(token) is None
+
+    with WriteSessionLocal() as db:
+        db.delete(db.query(User).filter(User.username == device_id).one())
+        db.commit()
+    assert client.get("/api/device/settings", headers=headers).status_code == 401